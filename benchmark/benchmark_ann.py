@@ -0,0 +1,118 @@
+"""
+Benchmark indici ANN FAISS: recall@k e latenza di IVF / HNSW / IVF-PQ rispetto all'indice flat (esatto),
+più la matrice NumPy a forza bruta (float16/int8) di rag/numpy_store.py.
+
+Esempi (dalla cartella principale del progetto):
+    python benchmark/benchmark_ann.py --n 200000
+    python benchmark/benchmark_ann.py --from-index data/vectors
+    python benchmark/benchmark_ann.py --n 5000 --types numpy --numpy-dtype int8
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from rag import ann_index  # noqa: E402
+from rag.numpy_store import NumpyFlatIndex  # noqa: E402
+from rag.rag_config import load_rag_config  # noqa: E402
+
+LOG_FILENAME = "benchmark_ann.txt"
+
+
+def log_print(message):
+    print(message)
+    with open(LOG_FILENAME, "a", encoding="utf-8") as log_file:
+        log_file.write(message + "\n")
+
+
+def synthetic_vectors(n, dim, clusters=256, seed=0):
+    """Vettori normalizzati raggruppati in cluster (più realistici del rumore uniforme)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    x = centers[labels] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    faiss.normalize_L2(x)
+    return x
+
+
+def vectors_from_index(folder):
+    """Vettori di un indice flat, anche diviso in segmenti (data/vectors/seg-*/index.faiss)."""
+    paths = sorted(glob.glob(os.path.join(folder, "index.faiss")) + glob.glob(os.path.join(folder, "seg-*", "index.faiss")))
+    parts = []
+    for path in paths:
+        index = faiss.read_index(path)
+        parts.append(index.reconstruct_n(0, index.ntotal).astype(np.float32))
+    return np.concatenate(parts)
+
+
+def search_timed(index, queries, k):
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+    return ids, elapsed * 1000.0 / len(queries)
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / float(truth.size)
+
+
+def index_size_mb(index):
+    if isinstance(index, NumpyFlatIndex):
+        return index.nbytes / (1024 ** 2)
+    return len(faiss.serialize_index(index)) / (1024 ** 2)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall vs latenza degli indici ANN rispetto a flat.")
+    ap.add_argument("--n", type=int, default=100000, help="Numero di vettori sintetici.")
+    ap.add_argument("--dim", type=int, default=384, help="Dimensione (all-MiniLM-L6-v2 = 384).")
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--from-index", help="Usa i vettori di un indice flat esistente (es. data/vectors).")
+    ap.add_argument("--types", default="ivf,hnsw,ivfpq,numpy", help="Tipi da confrontare con flat.")
+    ap.add_argument("--numpy-dtype", default=None, help="float16 | int8 (default: config/rag.json)")
+    args = ap.parse_args()
+
+    with open(LOG_FILENAME, "w", encoding="utf-8") as f:
+        f.write("=== BENCHMARK ANN ===\n\n")
+
+    x = vectors_from_index(args.from_index) if args.from_index else synthetic_vectors(args.n, args.dim)
+    n, dim = x.shape
+    rng = np.random.default_rng(1)
+    q = x[rng.choice(n, min(args.queries, n), replace=False)] + 0.05 * rng.normal(size=(min(args.queries, n), dim)).astype(np.float32)
+    q = np.ascontiguousarray(q, dtype=np.float32)
+    faiss.normalize_L2(q)
+    cfg = load_rag_config()["index"]
+
+    log_print(f"📊 {n} vettori dim {dim}, {len(q)} query, k={args.k}, thread FAISS={faiss.omp_get_max_threads()}")
+    log_print(f"   scelta automatica per questo corpus: {ann_index.choose_index_type(n, cfg)}\n")
+
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(x)
+    truth, flat_ms = search_timed(flat, q, args.k)
+    log_print(f"✅ flat   | recall 1.000 | {flat_ms:.3f} ms/query | {index_size_mb(flat):.1f} MB")
+
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip()]:
+        t0 = time.perf_counter()
+        if index_type == "numpy":
+            dtype = args.numpy_dtype or cfg.get("numpy_dtype", "float16")
+            index, params = NumpyFlatIndex(dim, dtype=dtype, metric="ip"), {"type": "numpy", "dtype": dtype}
+        else:
+            index, params = ann_index.build_index(x, cfg, index_type=index_type)
+        index.add(x)
+        build_s = time.perf_counter() - t0
+        found, ms = search_timed(index, q, args.k)
+        log_print(
+            f"✅ {params['type']:<6} | recall {recall_at_k(found, truth):.3f} | {ms:.3f} ms/query "
+            f"(x{flat_ms / ms:.1f}) | build {build_s:.1f}s | {index_size_mb(index):.1f} MB | {params}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark estrattori PDF: pagine/s e caratteri estratti per ogni backend installato.
+
+Esempi (dalla cartella principale del progetto):
+    python benchmark/benchmark_pdf_extract.py                 # tutti i PDF in data/pdfs
+    python benchmark/benchmark_pdf_extract.py manuale.pdf --repeat 3
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from rag.pdf_extract import BACKENDS, available_backends  # noqa: E402
+
+LOG_FILENAME = "benchmark_pdf_extract.txt"
+
+
+def log_print(message):
+    print(message)
+    with open(LOG_FILENAME, "a", encoding="utf-8") as log_file:
+        log_file.write(message + "\n")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Confronto velocità degli estrattori di testo PDF (senza cache).")
+    ap.add_argument("pdfs", nargs="*", help="PDF da analizzare (default: data/pdfs/*.pdf)")
+    ap.add_argument("--repeat", type=int, default=1, help="Ripetizioni per backend (si tiene la migliore).")
+    args = ap.parse_args()
+
+    pdfs = args.pdfs or sorted(glob.glob(os.path.join("data", "pdfs", "*.pdf")))
+    if not pdfs:
+        print("❌ Nessun PDF trovato.")
+        sys.exit(1)
+
+    with open(LOG_FILENAME, "w", encoding="utf-8") as f:
+        f.write("=== BENCHMARK ESTRAZIONE PDF ===\n\n")
+
+    backends = available_backends()
+    log_print(f"📊 {len(pdfs)} PDF | backend installati: {', '.join(backends)}")
+    missing = [b for b in BACKENDS if b not in backends]
+    if missing:
+        log_print(f"   non installati: {', '.join(missing)}")
+
+    for name in backends:
+        extract = BACKENDS[name][2]
+        pages = chars = 0
+        best = None
+        try:
+            for _ in range(max(1, args.repeat)):
+                start = time.perf_counter()
+                pages = chars = 0
+                for path in pdfs:
+                    texts = extract(path)
+                    pages += len(texts)
+                    chars += sum(len(t) for t in texts)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        except Exception as e:
+            log_print(f"❌ {name:<10} | errore: {e}")
+            continue
+        log_print(f"✅ {name:<10} | {pages} pagine in {best:.2f}s | {pages / best:.1f} pagine/s | {chars} caratteri")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark retrieval: recall del retriever ibrido (BM25 + FAISS con RRF) a vari k rispetto al solo denso a k=10,
+e caratteri di contesto passati al modello (il costo di prefill) per ciascun k.
+
+Le domande vengono da un file JSONL ({"question": ..., "source": "file.pdf", "page": 3}, page 1-based e
+facoltativa) oppure sono generate dai chunk stessi: una finestra di --words parole di un chunk a caso,
+pertinente per ogni chunk che la contiene. Le domande generate favoriscono i termini esatti: per scegliere
+il k di produzione usare domande reali quando ci sono.
+
+Esempi (dalla cartella principale del progetto, con un indice già costruito):
+    python benchmark/benchmark_retrieval.py
+    python benchmark/benchmark_retrieval.py --questions data/eval_agrario.jsonl --collection agrario
+    python benchmark/benchmark_retrieval.py --write        # salva in config/rag.json il k consigliato
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from rag import rag_chain  # noqa: E402
+from rag.rag_config import CONFIG_PATH  # noqa: E402
+
+LOG_FILENAME = "benchmark_retrieval.txt"
+DENSE_K = 10
+
+
+def log_print(message):
+    print(message)
+    with open(LOG_FILENAME, "a", encoding="utf-8") as log_file:
+        log_file.write(message + "\n")
+
+
+def _doc_key(doc):
+    return (doc.metadata or {}).get("chunk_id") or doc.page_content
+
+
+def all_docs(collection):
+    docs, cursor = [], None
+    while True:
+        page, cursor = rag_chain.iter_chunks(cursor=cursor, limit=500, collection=collection)
+        docs.extend(page)
+        if cursor is None:
+            return docs
+
+
+def generated_questions(docs, n, words, seed=0):
+    """(domanda, chunk pertinenti): finestra di parole presa da un chunk, pertinente per tutti i chunk che la contengono."""
+    rng = random.Random(seed)
+    candidates = [d for d in docs if len(d.page_content.split()) >= words]
+    out = []
+    for doc in rng.sample(candidates, min(n, len(candidates))):
+        tokens = doc.page_content.split()
+        start = rng.randrange(0, len(tokens) - words + 1)
+        question = " ".join(tokens[start:start + words])
+        out.append((question, {_doc_key(d) for d in docs if question in " ".join(d.page_content.split())}))
+    return out
+
+
+def file_questions(path, docs):
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            page = row.get("page")
+            relevant = {_doc_key(d) for d in docs
+                        if rag_chain._match_source(d, row["source"])
+                        and (page is None or int((d.metadata or {}).get("page", -1)) + 1 == int(page))}
+            out.append((row["question"], relevant))
+    return out
+
+
+def recall(retrieved, relevant):
+    """Frazione di domande con almeno un chunk pertinente tra quelli recuperati."""
+    hits = sum(1 for docs, rel in zip(retrieved, relevant) if rel & {_doc_key(d) for d in docs})
+    return hits / float(len(relevant) or 1)
+
+
+def write_k(k):
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    cfg.setdefault("retrieval", {})["k"] = k
+    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
+        json.dump(cfg, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall ibrido@k contro denso@10 e contesto passato al modello.")
+    ap.add_argument("--collection", default=None, help="Collezione da valutare (default: quella di default).")
+    ap.add_argument("--questions", help="JSONL con question, source e (facoltativo) page.")
+    ap.add_argument("--n", type=int, default=200, help="Domande generate dai chunk (senza --questions).")
+    ap.add_argument("--words", type=int, default=8, help="Parole per domanda generata.")
+    ap.add_argument("--max-k", type=int, default=DENSE_K)
+    ap.add_argument("--write", action="store_true", help="Scrive il k consigliato in config/rag.json.")
+    args = ap.parse_args()
+
+    with open(LOG_FILENAME, "w", encoding="utf-8") as f:
+        f.write("=== BENCHMARK RETRIEVAL ===\n\n")
+
+    docs = all_docs(args.collection)
+    if not docs:
+        print("❌ Nessun chunk indicizzato.")
+        sys.exit(1)
+    pairs = file_questions(args.questions, docs) if args.questions else generated_questions(docs, args.n, args.words)
+    pairs = [(q, rel) for q, rel in pairs if rel]
+    if not pairs:
+        print("❌ Nessuna domanda con chunk pertinenti nell'indice.")
+        sys.exit(1)
+    questions = [q for q, _ in pairs]
+    relevant = [rel for _, rel in pairs]
+    origin = args.questions or f"generate ({args.words} parole)"
+    log_print(f"📊 {len(docs)} chunk, {len(pairs)} domande {origin}")
+
+    dense = [rag_chain.retrieve(q, k=DENSE_K, mode="dense", collection=args.collection) for q in questions]
+    dense_recall = recall(dense, relevant)
+    dense_chars = sum(len(d.page_content) for docs_q in dense for d in docs_q) / len(dense)
+    log_print(f"✅ denso  k={DENSE_K:<2} | recall {dense_recall:.3f} | contesto {dense_chars:.0f} caratteri/domanda")
+
+    hybrid = [rag_chain.retrieve(q, k=args.max_k, mode="hybrid", collection=args.collection) for q in questions]
+    best = None
+    for k in range(1, args.max_k + 1):
+        top = [docs_q[:k] for docs_q in hybrid]   # k <= candidates: i primi k della fusione sono il risultato a k
+        r = recall(top, relevant)
+        chars = sum(len(d.page_content) for docs_q in top for d in docs_q) / len(top)
+        if best is None and r >= dense_recall:
+            best = k
+        log_print(f"✅ ibrido k={k:<2} | recall {r:.3f} | contesto {chars:.0f} caratteri/domanda "
+                  f"({chars / (dense_chars or 1):.0%} del denso)")
+
+    if best is None:
+        log_print(f"⚠️ nessun k <= {args.max_k} raggiunge la recall del denso@{DENSE_K}")
+        return
+    log_print(f"👉 k consigliato: {best} (minimo con recall ibrida >= denso@{DENSE_K})")
+    if args.write:
+        write_k(best)
+        log_print(f"   retrieval.k = {best} scritto in {CONFIG_PATH}")
+
+
+if __name__ == "__main__":
+    main()
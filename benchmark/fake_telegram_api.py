@@ -0,0 +1,190 @@
+"""
+Finta API Telegram locale per provare tg_ollama_bridge.py in modalità webhook, senza bot reale.
+
+Il bridge, avviato con TELEGRAM_API_URL puntato qui e "webhook.enabled" in config/telegram.json, chiama
+setWebhook: da quel momento questo server invia gli update al webhook e misura, per ogni update, il tempo
+fino al primo messaggio del bot che lo cita (reply_to_message_id / reply_parameters). Gli update arrivano da
+chat di gruppo, dove reply_text di python-telegram-bot cita il messaggio a cui risponde; i messaggi
+successivi della stessa risposta (pezzi lunghi, vocali, errori TTS) non vengono contati.
+Serve eva in esecuzione per le risposte.
+
+Esempi (dalla cartella principale del progetto):
+    python benchmark/fake_telegram_api.py --chats 4 --messages 3
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:test python tg_ollama_bridge.py
+    python benchmark/fake_telegram_api.py --voice data/prova.ogg   # vocali invece di testo
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+
+from aiohttp import ClientSession, web
+
+LOG_FILENAME = "fake_telegram_api.txt"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "EVA", "username": "eva_test_bot"}
+
+
+def log_print(message):
+    print(message)
+    with open(LOG_FILENAME, "a", encoding="utf-8") as log_file:
+        log_file.write(message + "\n")
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class FakeTelegram:
+    def __init__(self, args):
+        self.args = args
+        self.webhook = None            # parametri dell'ultimo setWebhook
+        self.webhook_set = asyncio.Event()
+        self.pending = {}              # (chat, message_id dell'update) -> istante di invio, finché non c'è risposta
+        self.latencies = []
+        self.calls = defaultdict(int)
+        self.next_id = 1
+        self.done = asyncio.Event()
+
+    def _message(self, chat_id, **extra):
+        self.next_id += 1
+        msg = {"message_id": self.next_id, "date": int(time.time()), "from": BOT_USER,
+               "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"}}
+        msg.update(extra)
+        return msg
+
+    def _answered(self, chat_id, params):
+        """Conta solo il primo messaggio che cita un update ancora senza risposta."""
+        reply_to = params.get("reply_to_message_id")
+        if reply_to is None and isinstance(params.get("reply_parameters"), dict):
+            reply_to = params["reply_parameters"].get("message_id")
+        try:
+            sent = self.pending.pop((int(chat_id), int(reply_to)), None)
+        except (TypeError, ValueError):
+            return
+        if sent is None:
+            return
+        self.latencies.append(time.monotonic() - sent)
+        if len(self.latencies) == self.args.chats * self.args.messages:
+            self.done.set()
+
+    @staticmethod
+    async def _params(request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    async def bot_method(self, request):
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        chat_id = params.get("chat_id")
+        result = True
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "setWebhook":
+            self.webhook = params
+            self.webhook_set.set()
+        elif method == "getWebhookInfo":
+            result = {"url": (self.webhook or {}).get("url", ""), "has_custom_certificate": False,
+                      "pending_update_count": 0}
+        elif method == "sendMessage":
+            result = self._message(chat_id, text=params.get("text", ""))
+            self._answered(chat_id, params)
+        elif method == "editMessageText":
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif method == "sendVoice":
+            result = self._message(chat_id, voice={"file_id": "bot-voice", "file_unique_id": "bot-voice",
+                                                   "duration": 1})
+            self._answered(chat_id, params)
+        elif method == "getFile":
+            result = {"file_id": params.get("file_id"), "file_unique_id": params.get("file_id"),
+                      "file_size": os.path.getsize(self.args.voice), "file_path": "voice/voice.ogg"}
+        return web.json_response({"ok": True, "result": result})
+
+    async def file(self, request):
+        return web.FileResponse(self.args.voice)
+
+    def _update(self, update_id, chat_id):
+        message = {"message_id": update_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+                   "from": {"id": -chat_id, "is_bot": False, "first_name": f"Utente {-chat_id}"}}
+        if self.args.voice:
+            message["voice"] = {"file_id": f"voice-{update_id}", "file_unique_id": f"voice-{update_id}",
+                                "duration": 3, "mime_type": "audio/ogg"}
+        else:
+            message["text"] = f"{self.args.text} ({update_id})"
+        return {"update_id": update_id, "message": message}
+
+    async def send_updates(self):
+        await self.webhook_set.wait()
+        url = self.webhook["url"]
+        headers = {}
+        if self.webhook.get("secret_token"):
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook["secret_token"]
+        log_print(f"🔗 setWebhook: {url} | allowed_updates: {self.webhook.get('allowed_updates')}")
+        await asyncio.sleep(1.0)   # il bridge finisce l'avvio dopo setWebhook
+
+        update_id = 0
+        start = time.monotonic()
+        async with ClientSession() as session:
+            for _ in range(self.args.messages):
+                for c in range(self.args.chats):
+                    update_id += 1
+                    chat_id = -1000 - c   # id negativi: chat di gruppo
+                    self.pending[(chat_id, update_id)] = time.monotonic()
+                    async with session.post(url, json=self._update(update_id, chat_id), headers=headers) as r:
+                        if r.status != 200:
+                            log_print(f"❌ update {update_id}: HTTP {r.status}")
+        try:
+            await asyncio.wait_for(self.done.wait(), timeout=self.args.timeout)
+        except asyncio.TimeoutError:
+            log_print(f"⏱️ timeout: {len(self.latencies)} risposte su {update_id} update")
+        elapsed = time.monotonic() - start
+        log_print(f"📊 {update_id} update in {self.args.chats} chat | risposte: {len(self.latencies)} in {elapsed:.2f}s")
+        if self.latencies:
+            log_print(f"   prima risposta p50/p95/max: {_pct(self.latencies, 0.5):.2f} / "
+                      f"{_pct(self.latencies, 0.95):.2f} / {max(self.latencies):.2f} s")
+        log_print("   chiamate API: " + ", ".join(f"{m}={n}" for m, n in sorted(self.calls.items())))
+
+
+async def main():
+    ap = argparse.ArgumentParser(description="Finta API Telegram che invia update al webhook del bridge.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--chats", type=int, default=4, help="Chat simulate.")
+    ap.add_argument("--messages", type=int, default=3, help="Messaggi per chat.")
+    ap.add_argument("--text", default="Ciao! Cos'è il Sole?")
+    ap.add_argument("--voice", help="File .ogg da inviare come vocale (al posto del testo).")
+    ap.add_argument("--timeout", type=float, default=300.0, help="Attesa massima delle risposte (s).")
+    args = ap.parse_args()
+
+    with open(LOG_FILENAME, "w", encoding="utf-8") as f:
+        f.write("=== FINTA API TELEGRAM ===\n\n")
+
+    fake = FakeTelegram(args)
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", fake.bot_method)
+    app.router.add_get("/file/bot{token}/{path:.*}", fake.file)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    log_print(f"🤖 API su http://{args.host}:{args.port} — avvia il bridge con TELEGRAM_API_URL=http://{args.host}:{args.port}")
+    try:
+        await fake.send_updates()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,6 +5,8 @@ import os
 import sys
 import re
 import json
+import hashlib
+import threading
 import importlib.util
 from time import time
 from datetime import datetime
@@ -12,14 +14,19 @@ from tempfile import NamedTemporaryFile
 
 from flask import (
     Flask, render_template, request, jsonify, Response, stream_with_context,
-    redirect, url_for, flash, send_from_directory
+    redirect, url_for, flash, send_from_directory, send_file
 )
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from werkzeug.serving import WSGIRequestHandler
 from fpdf import FPDF
-from pypdf import PdfReader
 from ollama import Client
 import requests
 
+from rag.rag_config import load_rag_config
+from rag.pdf_extract import PdfExtractor
+from rag.ingest import Chunk, LexicalStoreSink, ingest as ingest_chunks
+
 # ========= Paths & Config =========
 BASE_PATH = os.path.abspath("./")
 
@@ -35,14 +42,24 @@ BACKUP_DIR = os.path.join(CONFIG_DIR, "backups")
 DATA_DIR = os.path.join(BASE_PATH, "data")
 UPLOAD_DIR = os.path.join(DATA_DIR, "pdfs")
 CHUNKS_STORE = os.path.join(DATA_DIR, "chunks.txt")
-
-# Chunking config
-CHUNK_MAX_CHARS = 1200
-CHUNK_OVERLAP   = 200
+PARTIAL_DIR = os.path.join(DATA_DIR, "uploads")        # upload a blocchi non ancora completati
+PDF_HASHES = os.path.join(DATA_DIR, "pdf_hashes.json")  # sha256 -> nome file, per la deduplica
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")         # export dei chunk, uno per versione dello store
+CHUNKS_VERSION_FILE = os.path.join(DATA_DIR, "chunks.version")
+EXPORT_WAIT_SEC = 15   # attesa massima della richiesta mentre l'export viene generato
+
+# Upload in streaming
+UPLOAD_BLOCK = 1024 * 1024
+MAX_FORM_UPLOAD = 50 * 1024 * 1024   # solo /upload (form multipart); /upload_stream e /upload_chunk non hanno limite
+STREAM_UPLOAD_ENDPOINTS = {"upload_stream", "upload_chunk"}   # scrivono su disco a blocchi, senza bufferizzare
+PARTIAL_MAX_AGE = 24 * 3600
+
+# Chunk store (dimensioni dei chunk in config/rag.json, sezione "chunking")
 CHUNK_DELIM     = "\n\n<<<CHUNK_DELIM>>>\n\n"
+CHUNKS_PAGE_SIZE = 50
 
 # Crea cartelle necessarie
-for d in [CONFIG_DIR, LOG_PATH, HANDLERS_PATH, BACKUP_DIR, DATA_DIR, UPLOAD_DIR]:
+for d in [CONFIG_DIR, LOG_PATH, HANDLERS_PATH, BACKUP_DIR, DATA_DIR, UPLOAD_DIR, PARTIAL_DIR, EXPORT_DIR]:
     os.makedirs(d, exist_ok=True)
 
 def _now():
@@ -138,6 +155,9 @@ def _normalize_config(cfg: dict) -> dict:
     cfg.setdefault("profiles", {})
     if not isinstance(cfg["profiles"], dict):
         cfg["profiles"] = {}
+    cfg.setdefault("collections", {})
+    if not isinstance(cfg["collections"], dict):
+        cfg["collections"] = {}
     if cfg["default_profile"] not in cfg["profiles"]:
         cfg["default_profile"] = "default" if "default" in cfg["profiles"] else (next(iter(cfg["profiles"]), ""))
     return cfg
@@ -154,6 +174,10 @@ PROFILES = CONFIG.get("profiles", {})
 # ========= Client Ollama =========
 ollama_client = Client(host=OLLAMA_BASE)
 
+# ========= Estrazione PDF e chunking (condivisi da chunk store e indice vettoriale) =========
+RAG_CFG = load_rag_config()
+pdf_extractor = PdfExtractor.from_config(RAG_CFG["extraction"])
+
 # ========= Utility =========
 def log_to_file(question, bot_answer):
     try:
@@ -289,6 +313,57 @@ def stream_response(messages, model_name: str, options: dict):
 
     return _generator
 
+# ========= RAG (documenti indicizzati) =========
+_rag_module = None
+_rag_error = None
+
+def _get_rag():
+    """Importa rag.rag_chain al primo uso (LangChain/FAISS sono pesanti e opzionali)."""
+    global _rag_module, _rag_error
+    if _rag_module is not None or _rag_error is not None:
+        return _rag_module
+    try:
+        from rag import rag_chain
+        rag_chain.configure_collections(CONFIG.get("collections"))
+        rag_chain.configure_ollama(OLLAMA_BASE)
+        _rag_module = rag_chain
+        log_info("RAG disponibile (rag.rag_chain caricato)")
+    except Exception as e:
+        _rag_error = e
+        log_error(f"RAG non disponibile: {e}")
+    return _rag_module
+
+def rag_answer(question: str, model_name: str, system_message=None, options=None, collection=None) -> str:
+    rag = _get_rag()
+    if rag is None:
+        return f"(errore: RAG non disponibile - {_rag_error})"
+    try:
+        return sanitize_chunk(rag.ask_question(question, model_name=model_name, system_message=system_message,
+                                               options=options, collection=collection))
+    except Exception as e:
+        log_error(f"RAG fallito (model: {model_name}) - {e}")
+        return f"(errore RAG: {e})"
+
+def rag_stream_response(question: str, model_name: str, system_message=None, options=None, collection=None):
+    """Come stream_response, ma con retrieval: le fonti arrivano subito, poi i token."""
+    def _generator():
+        rag = _get_rag()
+        if rag is None:
+            yield f"(errore: RAG non disponibile - {_rag_error})"
+            return
+        print(f"[DEBUG] RAG STREAM → {model_name}", file=sys.stderr)
+        try:
+            for content in rag.ask_question_stream(question, model_name=model_name, system_message=system_message,
+                                                   options=options, collection=collection):
+                if content:
+                    yield sanitize_chunk(content)
+        except Exception as e:
+            err = f"\n[errore stream RAG: {e}]"
+            log_error(err)
+            yield err
+
+    return _generator
+
 # ========= Handler Loader (plugin locali) =========
 _LOADED_HANDLERS = []
 
@@ -327,6 +402,13 @@ def try_local_handlers(text: str):
             log_error(f"Errore in handler {getattr(mod, '__name__', mod)}: {e}")
     return None
 
+def static_replies() -> list[str]:
+    """Risposte sempre uguali (modalità comandi, STATIC_REPLIES degli handler), come le riceve il client."""
+    replies = [CMD_MODE_ON_MSG, CMD_MODE_OFF_MSG] + list(CMD_MODE_STATUS_MSG.values())
+    for mod in _LOADED_HANDLERS:
+        replies.extend(sanitize_chunk(r) for r in getattr(mod, "STATIC_REPLIES", ()) if isinstance(r, str) and r.strip())
+    return list(dict.fromkeys(replies))
+
 # ========= Modalità comandi =========
 def _read_commands():
     data = _read_json(COMMANDS_PATH, default={
@@ -343,6 +425,9 @@ def _read_commands():
 
 COMANDI = _read_commands()
 CMD_PREFIX = COMANDI.get("prefix", "#@#")
+CMD_MODE_ON_MSG = "Modalita comandi ATTIVATA"
+CMD_MODE_OFF_MSG = "Modalita comandi DISATTIVATA. Torno a usare il modello."
+CMD_MODE_STATUS_MSG = {True: "Modalita comandi: ON", False: "Modalita comandi: OFF"}
 
 def _read_command_mode() -> bool:
     try:
@@ -380,12 +465,52 @@ def _resolve_run_settings(model_from_req: str, profile_name: str):
         model = model_from_req.strip()
     return model, system, options
 
+def _rag_settings(profile_name: str, rag_from_req=None):
+    """(usa_rag, system message RAG, collezione) dal profilo, con override opzionale dalla richiesta."""
+    _, prof = _get_profile(profile_name)
+    use = bool(prof.get("rag")) if rag_from_req is None else bool(rag_from_req)
+    return use, (prof.get("rag_system") or None), _valid_collection(prof.get("collection"))
+
+# ---- Collezioni di documenti (una base di conoscenza per profilo)
+DEFAULT_COLLECTION = "default"
+
+def _collection_names():
+    return [DEFAULT_COLLECTION] + sorted(n for n in CONFIG.get("collections", {}) if n != DEFAULT_COLLECTION)
+
+def _valid_collection(name):
+    """Nome di una collezione definita in config.json; altrimenti 'default'."""
+    name = (name or "").strip()
+    return name if name in _collection_names() else DEFAULT_COLLECTION
+
+def _chunks_store_path(collection=None):
+    """chunks.txt della collezione; 'default' usa lo store storico data/chunks.txt."""
+    collection = _valid_collection(collection)
+    if collection == DEFAULT_COLLECTION:
+        return CHUNKS_STORE
+    return os.path.join(BASE_PATH, RAG_CFG["collections"]["root"], collection, "chunks.txt")
+
+def _req_flag(v):
+    if v is None or str(v).strip() == "":
+        return None
+    return str(v).strip().lower() in ("1", "true", "yes", "si", "on")
+
 # ========= Flask =========
 app = Flask(__name__)
 app.static_folder = 'static'
 app.secret_key = os.environ.get("FLASK_SECRET", "dev-secret")
 app.config['UPLOAD_FOLDER'] = UPLOAD_DIR
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
+# niente MAX_CONTENT_LENGTH globale: varrebbe anche per gli upload in streaming (vedi _limit_form_uploads)
+
+@app.before_request
+def _limit_form_uploads():
+    if request.endpoint not in STREAM_UPLOAD_ENDPOINTS and (request.content_length or 0) > MAX_FORM_UPLOAD:
+        raise RequestEntityTooLarge()
+
+@app.context_processor
+def _inject_collections():
+    """[(nome, etichetta)] delle collezioni, per i menu di upload, chunk e profili."""
+    defs = CONFIG.get("collections", {})
+    return {"rag_collections": [(n, (defs.get(n) or {}).get("label") or n) for n in _collection_names()]}
 
 # ---------- helpers upload ----------
 ALLOWED_EXTENSIONS = {"pdf"}
@@ -421,16 +546,16 @@ def home():
 # Alias 'index' per compatibilità con i template
 app.add_url_rule("/", endpoint="index", view_func=home)
 
-def _answer_pipeline(user_text: str, model: str, profile: str):
+def _answer_pipeline(user_text: str, model: str, profile: str, rag=None):
     t = (user_text or "").strip()
     if _match_any(COMANDI.get("start"), t):
         _write_command_mode(True)
-        return "Modalita comandi ATTIVATA"
+        return CMD_MODE_ON_MSG
     if _match_any(COMANDI.get("stop"), t):
         _write_command_mode(False)
-        return "Modalita comandi DISATTIVATA. Torno a usare il modello."
+        return CMD_MODE_OFF_MSG
     if _match_any(COMANDI.get("status"), t):
-        return "Modalita comandi: ON" if _read_command_mode() else "Modalita comandi: OFF"
+        return CMD_MODE_STATUS_MSG[_read_command_mode()]
     if _read_command_mode():
         return f"{CMD_PREFIX}{t if t else '(vuoto)'}"
 
@@ -439,6 +564,9 @@ def _answer_pipeline(user_text: str, model: str, profile: str):
         return local
 
     model_res, system_prompt, options = _resolve_run_settings(model, profile)
+    use_rag, rag_system, collection = _rag_settings(profile, rag)
+    if use_rag:
+        return rag_answer(t, model_res, rag_system, options, collection)
     messages = [{"role": "system", "content": system_prompt},
                 {"role": "user", "content": t}]
     new_msg = get_response(messages, model_res, options)
@@ -446,17 +574,16 @@ def _answer_pipeline(user_text: str, model: str, profile: str):
     msgout = sanitize_chunk(msgout)
     return msgout
 
-def _answer_pipeline_stream(user_text: str, model: str, profile: str):
+def _answer_pipeline_stream(user_text: str, model: str, profile: str, rag=None):
     t = (user_text or "").strip()
     if _match_any(COMANDI.get("start"), t):
         _write_command_mode(True)
-        return "text", ("Modalita comandi ATTIVATA",)
+        return "text", (CMD_MODE_ON_MSG,)
     if _match_any(COMANDI.get("stop"), t):
         _write_command_mode(False)
-        return "text", ("Modalita comandi DISATTIVATA. Torno a usare il modello.",)
+        return "text", (CMD_MODE_OFF_MSG,)
     if _match_any(COMANDI.get("status"), t):
-        status = "Modalita comandi: ON" if _read_command_mode() else "Modalita comandi: OFF"
-        return "text", (status,)
+        return "text", (CMD_MODE_STATUS_MSG[_read_command_mode()],)
     if _read_command_mode():
         return "text", (f"{CMD_PREFIX}{t if t else '(vuoto)'}",)
 
@@ -465,6 +592,9 @@ def _answer_pipeline_stream(user_text: str, model: str, profile: str):
         return "text", (local,)
 
     model_res, system_prompt, options = _resolve_run_settings(model, profile)
+    use_rag, rag_system, collection = _rag_settings(profile, rag)
+    if use_rag:
+        return "stream", (rag_stream_response(t, model_res, rag_system, options, collection),)
     messages = [{"role": "system", "content": system_prompt},
                 {"role": "user", "content": t}]
     gen = stream_response(messages, model_res, options)
@@ -495,12 +625,14 @@ def json_response():
         q = (data.get('query') or '').strip()
         model = (data.get('model') or DEFAULT_MODEL).strip()
         profile = (data.get('profile') or CONFIG.get("default_profile", "default")).strip()
+        rag = _req_flag(data.get('rag'))
     else:
         q = (request.args.get('query') or '').strip()
         model = (request.args.get('model') or DEFAULT_MODEL).strip()
         profile = (request.args.get('profile') or CONFIG.get("default_profile", "default")).strip()
+        rag = _req_flag(request.args.get('rag'))
 
-    msgout = _answer_pipeline(q, model, profile)
+    msgout = _answer_pipeline(q, model, profile, rag)
     log_to_file(q, msgout)
     return jsonify({"response": msgout, "action": "ok"})
 
@@ -510,8 +642,9 @@ def stream():
     q = (data.get("query") or "").strip()
     model = (data.get("model") or DEFAULT_MODEL).strip()
     profile = (data.get("profile") or CONFIG.get("default_profile", "default")).strip()
+    rag = _req_flag(data.get("rag"))
 
-    mode, payload = _answer_pipeline_stream(q, model, profile)
+    mode, payload = _answer_pipeline_stream(q, model, profile, rag)
     if mode == "text":
         text = payload[0]
         log_to_file(q, text)
@@ -535,6 +668,11 @@ def healthz():
     ok = check_ollama_connectivity(False)
     return ("ok", 200) if ok else ("ollama unreachable", 503)
 
+@app.route('/static_replies')
+def static_replies_route():
+    """Per i client con TTS (bridge Telegram): testi da pre-sintetizzare all'avvio."""
+    return jsonify({"replies": static_replies()})
+
 # ---------- FORMS UTILS ----------
 def _to_float(v):
     try:
@@ -606,6 +744,9 @@ def reload_config():
     DEFAULT_PROFILE = CONFIG.get("default_profile", "default")
     PROFILES = CONFIG.get("profiles", {})
     ollama_client = Client(host=OLLAMA_BASE)
+    if _rag_module is not None:
+        _rag_module.configure_collections(CONFIG.get("collections"))
+        _rag_module.configure_ollama(OLLAMA_BASE)
 
 # # ---------- CONFIG GENERALE ----------
 # @app.route("/config", methods=["GET", "POST"])
@@ -741,7 +882,9 @@ def profile_new():
             "label": label,
             "model": model,
             "system": system,
-            "options": options
+            "options": options,
+            "rag": bool(request.form.get("rag")),
+            "collection": _valid_collection(request.form.get("collection"))
         }
         new_conf["profiles"] = profiles
         new_conf = _normalize_config(new_conf)
@@ -785,12 +928,15 @@ def profile_edit(name):
 
         new_conf = dict(CONFIG)
         profiles = dict(new_conf.get("profiles", {}))
-        profiles[name] = {
+        profiles[name] = dict(profiles.get(name) or {})
+        profiles[name].update({
             "label": label,
             "model": model,
             "system": system,
-            "options": options
-        }
+            "options": options,
+            "rag": bool(request.form.get("rag")),
+            "collection": _valid_collection(request.form.get("collection"))
+        })
         new_conf["profiles"] = profiles
         new_conf = _normalize_config(new_conf)
 
@@ -880,13 +1026,29 @@ def pdfrag():
 
 @app.route('/clear_chunks', methods=['POST'])
 def clear_chunks():
-    clear_vectorstore()
+    clear_vectorstore(request.form.get("collection"))
     return redirect(url_for('pdfrag'))
 
 @app.route("/chunks")
 def chunks():
-    chunks_list = get_indexed_chunks()
-    return render_template("chunks.html", chunks=chunks_list)
+    cursor = request.args.get("cursor") or None
+    limit = min(max(_to_int(request.args.get("limit")) or CHUNKS_PAGE_SIZE, 1), 500)
+    source = (request.args.get("source") or "").strip() or None
+    collection = _valid_collection(request.args.get("collection"))
+    rag = _get_rag()
+    if rag is not None:
+        # direttamente dal docstore dell'indice: nessun embedding, cursore = id dell'ultimo chunk mostrato
+        docs, next_cursor = rag.iter_chunks(cursor=cursor, limit=limit, source=source, collection=collection)
+        chunks_list = [_format_indexed_chunk(d) for d in docs]
+        sources = rag.list_sources(collection)
+        total = rag.count_chunks(collection=collection)
+    else:
+        cursor = _to_int(cursor) or 0
+        chunks_list, next_cursor = list_chunks_page(cursor=cursor, limit=limit, source=source, collection=collection)
+        total, sources = chunk_stats(collection)
+    return render_template("chunks.html", chunks=chunks_list,
+                           cursor=cursor, next_cursor=next_cursor, limit=limit,
+                           source=source, sources=sources, total=total, collection=collection)
 
 @app.route('/manage', methods=['GET'])
 def manage():
@@ -897,6 +1059,7 @@ def manage():
 def upload():
     logs = []
     paths = []
+    collection = _request_collection()
 
     try:
         ensure_upload_dir()
@@ -926,27 +1089,122 @@ def upload():
             if not allowed_file(file.filename):
                 logs.append(f"[SKIP] {file.filename}: estensione non permessa (solo .pdf).")
                 continue
-            saved_path = save_pdf(file)
-            logs.append(f"[UPLOAD] Caricato: {os.path.basename(saved_path)}")
-            paths.append(saved_path)
+            saved_path, _, duplicate = store_pdf_stream(file.stream, file.filename)
+            if _log_stored(file.filename, saved_path, duplicate, collection, logs):
+                paths.append(saved_path)
         except Exception as e:
             err = f"[ERRORE] {file.filename}: {e}"
             logs.append(err)
             log_error(err)
 
-    if paths:
-        try:
-            num_chunks, added = ingest_pdfs(paths)
-            logs.append(f"[INGEST] Totale chunk indicizzati: {num_chunks}")
-            for i, chunk in enumerate(added[:5]):
-                logs.append(f"[CHUNK {i}] {chunk[:80]}...")
-        except Exception as e:
-            logs.append(f"[INGEST ERRORE] {e}")
-            log_error(f"ingest error: {e}")
-
+    _ingest_uploaded(paths, logs, collection)
     pdf_files = list_pdfs()
     return render_template("manage.html", pdf_files=pdf_files, log_messages=logs)
 
+def _request_collection():
+    data = request.get_json(silent=True) if request.is_json else None
+    return _valid_collection(request.form.get("collection") or request.args.get("collection")
+                             or (data or {}).get("collection"))
+
+def _log_stored(filename, saved_path, duplicate, collection, logs) -> bool:
+    """Registra l'esito dell'upload; True se il PDF va indicizzato nella collezione."""
+    name = os.path.basename(saved_path)
+    if not duplicate:
+        logs.append(f"[UPLOAD] Caricato: {name}")
+        return True
+    if _collection_has_pdf(collection, name):
+        logs.append(f"[SKIP] {filename}: contenuto identico a {name}, già indicizzato.")
+        return False
+    # stesso PDF già su disco ma non ancora in questa collezione: si indicizza senza ricopiarlo
+    logs.append(f"[UPLOAD] {filename}: contenuto identico a {name}, aggiunto alla collezione '{collection}'.")
+    return True
+
+def _ingest_uploaded(paths, logs, collection=None):
+    if not paths:
+        return
+    try:
+        num_chunks, added = ingest_pdfs(paths, collection)
+        logs.append(f"[INGEST] Totale chunk indicizzati ({_valid_collection(collection)}): {num_chunks}")
+        for i, chunk in enumerate(added[:5]):
+            logs.append(f"[CHUNK {i}] {chunk[:80]}...")
+    except Exception as e:
+        logs.append(f"[INGEST ERRORE] {e}")
+        log_error(f"ingest error: {e}")
+
+# ---------- Upload in streaming (senza form multipart) ----------
+@app.route('/upload_stream', methods=['POST', 'PUT'])
+def upload_stream():
+    """Corpo della richiesta = PDF grezzo, nome in ?filename=. Scritto su disco a blocchi con hash al volo."""
+    logs = []
+    filename = (request.args.get("filename") or "").strip()
+    try:
+        ensure_upload_dir()
+        saved_path, sha, duplicate = store_pdf_stream(request.stream, filename)
+    except Exception as e:
+        log_error(f"upload_stream {filename}: {e}")
+        return jsonify({"status": "error", "error": str(e)}), 400
+    collection = _request_collection()
+    if _log_stored(filename, saved_path, duplicate, collection, logs):
+        _ingest_uploaded([saved_path], logs, collection)
+    return jsonify({"status": "ok", "file": os.path.basename(saved_path), "sha256": sha,
+                    "duplicate": duplicate, "logs": logs})
+
+# ---------- Upload a blocchi riprendibile ----------
+_UPLOAD_ID_RX = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+def _partial_path(upload_id: str) -> str:
+    if not _UPLOAD_ID_RX.match(upload_id or ""):
+        raise ValueError("upload_id non valido")
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+@app.route('/upload_chunk/<upload_id>', methods=['GET'])
+def upload_chunk_status(upload_id):
+    """Offset da cui riprendere l'upload (0 se mai iniziato)."""
+    try:
+        path = _partial_path(upload_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    return jsonify({"status": "ok", "offset": offset})
+
+@app.route('/upload_chunk/<upload_id>', methods=['POST', 'PUT'])
+def upload_chunk(upload_id):
+    """Accoda un blocco; header X-Upload-Offset = posizione del blocco nel file (409 se non coincide)."""
+    try:
+        path = _partial_path(upload_id)
+        offset = int(request.headers.get("X-Upload-Offset", "0"))
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+    if offset == 0:
+        _cleanup_partial_uploads()
+    try:
+        new_offset = append_partial_upload(upload_id, path, offset, request.stream)
+    except _OffsetMismatch as e:
+        return jsonify({"status": "conflict", "offset": e.current}), 409
+    except Exception as e:
+        log_error(f"upload_chunk {upload_id}: {e}")
+        return jsonify({"status": "error", "error": str(e)}), 500
+    return jsonify({"status": "ok", "offset": new_offset})
+
+@app.route('/upload_chunk/<upload_id>/finish', methods=['POST'])
+def upload_chunk_finish(upload_id):
+    data = request.get_json(silent=True) or {}
+    filename = (data.get("filename") or request.args.get("filename") or "").strip()
+    logs = []
+    try:
+        path = _partial_path(upload_id)
+        if not os.path.exists(path):
+            return jsonify({"status": "error", "error": "upload sconosciuto o già completato"}), 404
+        saved_path, sha, duplicate = finish_partial_upload(upload_id, path, filename)
+    except Exception as e:
+        log_error(f"upload_chunk_finish {upload_id}: {e}")
+        return jsonify({"status": "error", "error": str(e)}), 400
+    collection = _valid_collection(data.get("collection") or request.args.get("collection"))
+    if _log_stored(filename, saved_path, duplicate, collection, logs):
+        _ingest_uploaded([saved_path], logs, collection)
+    return jsonify({"status": "ok", "file": os.path.basename(saved_path), "sha256": sha,
+                    "duplicate": duplicate, "logs": logs})
+
 @app.route('/delete_pdf/<filename>', methods=['POST'])
 def delete_pdf_route(filename):
     delete_pdf(filename)
@@ -960,115 +1218,260 @@ def serve_pdf(filename):
 
 @app.route('/export_chunks')
 def export_chunks():
-    chunks_list = get_indexed_chunks()
-    response = "\n\n".join(chunks_list)
-    return response, 200, {
-        'Content-Type': 'text/plain; charset=utf-8',
-        'Content-Disposition': 'attachment; filename=chunks_export.txt'
-    }
+    return _serve_export("txt", request.args.get("collection"))
 
 @app.route('/search_chunks', methods=['GET'])
 def search_chunks():
     query = request.args.get('q', '').lower()
-    chunks_list = get_indexed_chunks()
-    results = [c for c in chunks_list if query in c.lower()]
-    return render_template("chunks.html", chunks=results, query=query)
+    collection = _valid_collection(request.args.get("collection"))
+    results = [c for c in _iter_chunks_text(_chunks_store_path(collection)) if query in c.lower()]
+    return render_template("chunks.html", chunks=results, query=query, collection=collection)
 
 @app.route('/export_chunks_pdf')
 def export_chunks_pdf():
-    chunks_list = get_indexed_chunks()
+    return _serve_export("pdf", request.args.get("collection"))
+
+# ---------- Export chunk: generati al primo download, una volta per versione dello store della collezione ----------
+_EXPORT_KINDS = {
+    "txt": ("text/plain; charset=utf-8", "chunks_export.txt"),
+    "pdf": ("application/pdf", "export_chunks.pdf"),
+}
+_export_lock = threading.Lock()
+_export_jobs = {}   # (tipo, collezione, versione) -> threading.Event impostato a generazione finita
+_chunks_version_lock = threading.Lock()
+
+def _chunks_version_path(collection=None) -> str:
+    """Versione del chunk store della collezione, accanto al suo chunks.txt ('default': data/chunks.version)."""
+    collection = _valid_collection(collection)
+    if collection == DEFAULT_COLLECTION:
+        return CHUNKS_VERSION_FILE
+    return os.path.join(os.path.dirname(_chunks_store_path(collection)), "chunks.version")
+
+def _chunks_version(collection=None) -> int:
+    try:
+        with open(_chunks_version_path(collection), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except Exception:
+        return 0
+
+def _bump_chunks_version(collection=None):
+    """
+    Da chiamare a ogni modifica del chunk store della collezione: invalida i suoi export.
+    Vengono rigenerati solo al primo download della nuova versione (_serve_export).
+    """
+    collection = _valid_collection(collection)
+    path = _chunks_version_path(collection)
+    with _chunks_version_lock:
+        version = _chunks_version(collection) + 1
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(str(version))
+            os.replace(tmp, path)
+        except Exception as e:
+            log_error(f"aggiornamento versione chunk fallito ({collection}): {e}")
+        _remove_old_exports(collection, version)
+
+def _export_path(kind: str, collection: str, version: int) -> str:
+    return os.path.join(EXPORT_DIR, f"chunks-{collection}-v{version}.{kind}")
+
+def _remove_old_exports(collection: str, version: int):
+    prefix = f"chunks-{collection}-v"
+    keep = {os.path.basename(_export_path(k, collection, version)) for k in _EXPORT_KINDS}
+    try:
+        for name in os.listdir(EXPORT_DIR):
+            # export della collezione di versioni precedenti, e quelli senza collezione (chunks-v<n>)
+            if (name.startswith(prefix) or name.startswith("chunks-v")) and name not in keep:
+                os.remove(os.path.join(EXPORT_DIR, name))
+    except Exception as e:
+        log_error(f"pulizia export fallita: {e}")
+
+def _write_export_txt(path: str, store: str):
+    # scritto un chunk alla volta: il file non passa mai tutto in memoria
+    with open(path, "w", encoding="utf-8") as f:
+        for i, chunk in enumerate(_iter_chunks_text(store)):
+            if i:
+                f.write("\n\n")
+            f.write(chunk)
+
+def _write_export_pdf(path: str, store: str):
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
     pdf.set_font("Arial", size=11)
-    for chunk in chunks_list:
+    for chunk in _iter_chunks_text(store):
         pdf.multi_cell(0, 6, chunk + "\n")
         pdf.ln(2)
-    pdf_output = os.path.join(DATA_DIR, "export_chunks.pdf")
-    pdf.output(pdf_output)
-    return send_from_directory(DATA_DIR, "export_chunks.pdf", as_attachment=True)
+    pdf.output(path)
 
-@app.errorhandler(413)
-def too_large(e):
-    return "File troppo grande. Limite 50MB (modifica MAX_CONTENT_LENGTH per aumentarlo).", 413
-
-# ---------- Parser/Chunking ----------
-def _load_chunks_text() -> list[str]:
-    if not os.path.exists(CHUNKS_STORE):
-        return []
+def _run_export(kind: str, collection: str, version: int, done: threading.Event):
+    path = _export_path(kind, collection, version)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
     try:
-        with open(CHUNKS_STORE, "r", encoding="utf-8") as f:
-            data = f.read()
-        if not data.strip():
-            return []
-        if CHUNK_DELIM in data:
-            parts = data.split(CHUNK_DELIM)
-        else:
-            parts = [p for p in data.split("\n\n") if p.strip()]
-        return [p for p in parts if p.strip()]
+        start = time()
+        (_write_export_pdf if kind == "pdf" else _write_export_txt)(tmp, _chunks_store_path(collection))
+        os.replace(tmp, path)   # atomico: chi scarica vede solo file completi
+        log_info(f"Export chunk {kind} '{collection}' v{version} pronto in {time() - start:.1f}s")
+        if _chunks_version(collection) != version:
+            # lo store è cambiato durante la generazione: l'export è già vecchio
+            os.unlink(path)
     except Exception as e:
-        log_error(f"_load_chunks_text error: {e}")
-        return []
+        log_error(f"Export chunk {kind} '{collection}' v{version} fallito: {e}")
+        try:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        except Exception:
+            pass
+    finally:
+        done.set()
+        with _export_lock:
+            _export_jobs.pop((kind, collection, version), None)
+
+def _start_export(kind: str, collection: str, version: int) -> threading.Event:
+    """Avvia (una sola volta) la generazione dell'export; ritorna l'evento di completamento."""
+    key = (kind, collection, version)
+    with _export_lock:
+        done = _export_jobs.get(key)
+        if done is None:
+            done = threading.Event()
+            _export_jobs[key] = done
+            threading.Thread(target=_run_export, args=(kind, collection, version, done),
+                             name=f"export-{kind}-{collection}-v{version}", daemon=True).start()
+        return done
+
+def _serve_export(kind: str, collection=None):
+    collection = _valid_collection(collection)
+    mimetype, download_name = _EXPORT_KINDS[kind]
+    if collection != DEFAULT_COLLECTION:
+        download_name = f"{collection}_{download_name}"
+    version = _chunks_version(collection)
+    path = _export_path(kind, collection, version)
+    if not os.path.exists(path):
+        _start_export(kind, collection, version).wait(EXPORT_WAIT_SEC)
+    if not os.path.exists(path):
+        return ("Esportazione in preparazione, riprova tra qualche secondo.", 202,
+                {"Retry-After": "5", "Content-Type": "text/plain; charset=utf-8"})
+    # send_file gestisce ETag/Last-Modified e le richieste Range (download riprendibili)
+    return send_file(path, mimetype=mimetype, as_attachment=True,
+                     download_name=download_name, conditional=True)
 
-def _save_chunks_text(chunks: list[str]) -> None:
-    try:
-        with open(CHUNKS_STORE, "w", encoding="utf-8") as f:
-            f.write(CHUNK_DELIM.join(chunks))
-    except Exception as e:
-        log_error(f"_save_chunks_text error: {e}")
+@app.errorhandler(413)
+def too_large(e):
+    return ("File troppo grande. Limite 50MB per il form di upload (MAX_FORM_UPLOAD); "
+            "per file più grandi usa /upload_stream o /upload_chunk.", 413)
 
-def _extract_pdf_pages_text(path: str) -> list[str]:
-    texts = []
+# ---------- Parser/Chunking ----------
+def _format_indexed_chunk(doc) -> str:
+    """Chunk del docstore nello stesso formato di chunks.txt ([SRC] nome | p. | c. | id.)."""
+    meta = doc.metadata or {}
+    return LexicalStoreSink.format_chunk(Chunk(meta.get("chunk_id", ""), meta.get("source") or "",
+                                               int(meta.get("page") or 0), int(meta.get("chunk") or 0),
+                                               doc.page_content))
+
+def _iter_chunks_text(path=CHUNKS_STORE):
+    """Legge chunks.txt a blocchi e restituisce un chunk alla volta, senza caricare tutto il file."""
+    if not os.path.exists(path):
+        return
+    buf = ""
+    seen_delim = False
     try:
-        reader = PdfReader(path)
-        for p in reader.pages:
-            t = p.extract_text() or ""
-            texts.append(t)
+        with open(path, "r", encoding="utf-8") as f:
+            while True:
+                block = f.read(64 * 1024)
+                if not block:
+                    break
+                buf += block
+                if CHUNK_DELIM not in buf:
+                    continue
+                seen_delim = True
+                parts = buf.split(CHUNK_DELIM)
+                buf = parts.pop()
+                for p in parts:
+                    if p.strip():
+                        yield p
     except Exception as e:
-        log_error(f"Errore lettura PDF '{path}': {e}")
-    return texts
-
-def _normalize_text(s: str) -> str:
-    if not s:
-        return ""
-    s = s.replace("\r", "\n")
-    s = re.sub(r"\u00A0", " ", s)
-    s = re.sub(r"[ \t]+", " ", s)
-    s = re.sub(r"\n{3,}", "\n\n", s)
-    return s.strip()
-
-def _chunk_text(t: str, max_chars=CHUNK_MAX_CHARS, overlap=CHUNK_OVERLAP) -> list[str]:
-    t = _normalize_text(t)
-    n = len(t)
-    if n == 0:
-        return []
-
-    chunks = []
-    i = 0
-    while i < n:
-        hard_end = min(n, i + max_chars)
-        window = t[i:hard_end]
-        m = list(re.finditer(r"(\n\n|[\.!?](?:\s|$))", window))
-        if m:
-            end = i + m[-1].end()
-        else:
-            end = hard_end
-        if end <= i:
-            end = min(n, i + max_chars)
-
-        chunk = t[i:end].strip()
-        if chunk:
-            chunks.append(chunk)
-
-        if end >= n:
-            break
-
-        if overlap > 0:
-            i = max(end - overlap, i + 1)
-        else:
-            i = end
-
-    return chunks
+        log_error(f"_iter_chunks_text error: {e}")
+        return
+    if seen_delim:
+        if buf.strip():
+            yield buf
+    else:
+        # formato legacy: chunk separati da riga vuota
+        for p in buf.split("\n\n"):
+            if p.strip():
+                yield p
+
+_SRC_RX = re.compile(r"^\[SRC\] (.+?) \| p\.\d+")
+
+def _chunk_source(chunk: str):
+    m = _SRC_RX.match(chunk or "")
+    return m.group(1) if m else None
+
+def _store_separator(path) -> bytes:
+    """CHUNK_DELIM, o la riga vuota del formato legacy se nel file non compare mai."""
+    delim = CHUNK_DELIM.encode("utf-8")
+    tail = b""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            if delim in tail + block:
+                return delim
+            tail = block[-len(delim):]
+    return b"\n\n"
+
+def _iter_chunks_at(path, offset=0):
+    """(offset in byte, chunk) dal chunk store a partire da offset: la pagina successiva è una seek, non una rilettura."""
+    if not os.path.exists(path):
+        return
+    sep = _store_separator(path)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        buf, start = b"", offset
+        for block in iter(lambda: f.read(64 * 1024), b""):
+            buf += block
+            parts = buf.split(sep)
+            buf = parts.pop()
+            for part in parts:
+                if part.strip():
+                    yield start, part.decode("utf-8", errors="replace")
+                start += len(part) + len(sep)
+        if buf.strip():
+            yield start, buf.decode("utf-8", errors="replace")
+
+def list_chunks_page(cursor=0, limit=CHUNKS_PAGE_SIZE, source=None, collection=None):
+    """
+    Pagina di chunk dal chunk store: (chunk, next_cursor) con next_cursor=None a fine store.
+    Il cursore è l'offset in byte del primo chunk della pagina: ogni pagina legge solo i propri chunk.
+    """
+    items = []
+    for pos, chunk in _iter_chunks_at(_chunks_store_path(collection), max(0, cursor)):
+        if source and _chunk_source(chunk) != source:
+            continue
+        if len(items) == limit:
+            return items, pos
+        items.append(chunk)
+    return items, None
+
+_chunk_stats_lock = threading.Lock()
+_chunk_stats_cache = {}   # collezione -> (versione chunk store, totale, {sorgente: n_chunk})
+
+def chunk_stats(collection=None):
+    """(totale chunk, {sorgente: n_chunk}) letti in streaming, una volta per versione del chunk store."""
+    collection = _valid_collection(collection)
+    version = _chunks_version(collection)
+    with _chunk_stats_lock:
+        cached = _chunk_stats_cache.get(collection)
+    if cached and cached[0] == version:
+        return cached[1], dict(cached[2])
+    total = 0
+    counts = {}
+    for chunk in _iter_chunks_text(_chunks_store_path(collection)):
+        total += 1
+        src = _chunk_source(chunk) or "(senza sorgente)"
+        counts[src] = counts.get(src, 0) + 1
+    with _chunk_stats_lock:
+        _chunk_stats_cache[collection] = (version, total, counts)
+    return total, dict(counts)
 
 def list_pdfs():
     try:
@@ -1077,12 +1480,7 @@ def list_pdfs():
         log_error(f"list_pdfs error: {e}")
         return []
 
-def save_pdf(file_storage):
-    ensure_upload_dir()
-    fname = secure_filename(file_storage.filename or "")
-    if not allowed_file(fname):
-        raise ValueError("Estensione non permessa (solo .pdf).")
-
+def _unique_upload_dest(fname: str):
     name, ext = os.path.splitext(fname)
     candidate = fname
     i = 1
@@ -1091,56 +1489,216 @@ def save_pdf(file_storage):
         candidate = f"{name} ({i}){ext}"
         dest = os.path.join(app.config['UPLOAD_FOLDER'], candidate)
         i += 1
+    return candidate, dest
 
-    file_storage.save(dest)
-    log_info(f"[UPLOAD] Salvato: {candidate}")
-    return dest
-
-def get_indexed_chunks() -> list[str]:
-    return _load_chunks_text()
+# ---- indice hash dei PDF (deduplica per contenuto)
+_pdf_hashes_lock = threading.RLock()   # rientrante: _commit_pdf registra l'hash tenendolo già
 
-def ingest_pdfs(paths: list[str]) -> tuple[int, list[str]]:
-    existing = _load_chunks_text()
-    new_chunks = []
+def _find_pdf_by_hash(sha: str):
+    name = (_read_json(PDF_HASHES, default={}) or {}).get(sha)
+    if name and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], name)):
+        return name
+    return None
 
-    for path in paths:
-        basename = os.path.basename(path)
-        pages = _extract_pdf_pages_text(path)
-        if not pages:
-            log_error(f"Nessun testo estratto da: {path}")
-            continue
+def _register_pdf_hash(sha: str, filename: str):
+    with _pdf_hashes_lock:
+        hashes = _read_json(PDF_HASHES, default={}) or {}
+        hashes[sha] = filename
+        _write_json_atomic(PDF_HASHES, hashes)
+
+def _forget_pdf_hash(filename: str):
+    with _pdf_hashes_lock:
+        hashes = _read_json(PDF_HASHES, default={}) or {}
+        kept = {h: n for h, n in hashes.items() if n != filename}
+        if len(kept) != len(hashes):
+            _write_json_atomic(PDF_HASHES, kept)
+
+def pdf_hash_for(path: str):
+    """sha256 registrato al momento dell'upload (None se il file non è passato dall'upload)."""
+    name = os.path.basename(path)
+    for h, n in (_read_json(PDF_HASHES, default={}) or {}).items():
+        if n == name:
+            return h
+    return None
 
-        for page_idx, raw in enumerate(pages):
-            txt = _normalize_text(raw)
-            if not txt:
-                continue
-            pieces = _chunk_text(txt)
-            for ci, piece in enumerate(pieces):
-                header = f"[SRC] {basename} | p.{page_idx+1} | c.{ci}"
-                new_chunks.append(f"{header}\n{piece}")
+def _commit_pdf(tmp_path: str, fname: str, sha: str):
+    """Sposta il file temporaneo tra i PDF, salvo che esista già lo stesso contenuto.
+    Ritorna (percorso, sha256, duplicato)."""
+    # verifica e registrazione sotto lo stesso lock: due upload identici in parallelo non vengono salvati entrambi
+    with _pdf_hashes_lock:
+        existing = _find_pdf_by_hash(sha)
+        if existing:
+            os.unlink(tmp_path)
+            log_info(f"[UPLOAD] {fname}: duplicato di {existing} (sha256 {sha[:12]})")
+            return os.path.join(app.config['UPLOAD_FOLDER'], existing), sha, True
+        candidate, dest = _unique_upload_dest(fname)
+        os.replace(tmp_path, dest)
+        _register_pdf_hash(sha, candidate)
+    log_info(f"[UPLOAD] Salvato: {candidate} (sha256 {sha[:12]})")
+    return dest, sha, False
+
+def _checked_pdf_name(filename: str) -> str:
+    fname = secure_filename(filename or "")
+    if not allowed_file(fname):
+        raise ValueError("Estensione non permessa (solo .pdf).")
+    return fname
 
-    all_chunks = existing + new_chunks
-    _save_chunks_text(all_chunks)
-    return len(all_chunks), new_chunks
+def store_pdf_stream(stream, filename: str):
+    """Copia lo stream su disco a blocchi calcolando lo sha256 nello stesso passaggio:
+    memoria costante qualunque sia la dimensione. Ritorna (percorso, sha256, duplicato)."""
+    ensure_upload_dir()
+    fname = _checked_pdf_name(filename)
+    hasher = hashlib.sha256()
+    with NamedTemporaryFile("wb", delete=False, dir=app.config['UPLOAD_FOLDER'], prefix=".part-") as tf:
+        tmp = tf.name
+        try:
+            while True:
+                block = stream.read(UPLOAD_BLOCK)
+                if not block:
+                    break
+                hasher.update(block)
+                tf.write(block)
+        except Exception:
+            tf.close()
+            os.unlink(tmp)
+            raise
+    return _commit_pdf(tmp, fname, hasher.hexdigest())
 
-def clear_vectorstore():
+def save_pdf(file_storage):
+    return store_pdf_stream(file_storage.stream, file_storage.filename)[0]
+
+# ---- upload a blocchi: lo stato dell'hash resta in memoria tra un blocco e l'altro
+class _OffsetMismatch(Exception):
+    def __init__(self, current):
+        super().__init__(f"offset atteso {current}")
+        self.current = current
+
+_partial_lock = threading.Lock()
+_partial_locks = {}     # upload_id -> lock dell'upload (i blocchi di upload diversi procedono in parallelo)
+_partial_hashers = {}   # upload_id -> (byte già inclusi nell'hash, hasher)
+
+def _lock_for_upload(upload_id: str):
+    with _partial_lock:
+        return _partial_locks.setdefault(upload_id, threading.Lock())
+
+def append_partial_upload(upload_id: str, path: str, offset: int, stream) -> int:
+    with _lock_for_upload(upload_id):
+        current = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset != current:
+            raise _OffsetMismatch(current)
+        hashed, hasher = _partial_hashers.get(upload_id, (0, hashlib.sha256()))
+        if hashed != current:
+            hasher = None   # riavvio del server a metà upload: l'hash verrà ricalcolato alla fine
+        with open(path, "ab") as f:
+            while True:
+                block = stream.read(UPLOAD_BLOCK)
+                if not block:
+                    break
+                if hasher is not None:
+                    hasher.update(block)
+                f.write(block)
+            size = f.tell()
+        if hasher is not None:
+            _partial_hashers[upload_id] = (size, hasher)
+        else:
+            _partial_hashers.pop(upload_id, None)
+        return size
+
+def finish_partial_upload(upload_id: str, path: str, filename: str):
+    fname = _checked_pdf_name(filename)
+    with _lock_for_upload(upload_id):
+        hashed, hasher = _partial_hashers.pop(upload_id, (0, None))
+        if hasher is None or hashed != os.path.getsize(path):
+            hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(UPLOAD_BLOCK), b""):
+                    hasher.update(block)
+        ensure_upload_dir()
+        tmp = os.path.join(app.config['UPLOAD_FOLDER'], f".part-{upload_id}")
+        os.replace(path, tmp)
+    with _partial_lock:
+        _partial_locks.pop(upload_id, None)
+    return _commit_pdf(tmp, fname, hasher.hexdigest())
+
+def _cleanup_partial_uploads():
+    now = time()
     try:
-        if os.path.exists(CHUNKS_STORE):
-            os.remove(CHUNKS_STORE)
+        for name in os.listdir(PARTIAL_DIR):
+            p = os.path.join(PARTIAL_DIR, name)
+            if not (name.endswith(".part") and now - os.path.getmtime(p) > PARTIAL_MAX_AGE):
+                continue
+            upload_id = name[:-5]
+            lock = _lock_for_upload(upload_id)
+            if not lock.acquire(blocking=False):
+                continue   # un blocco è in scrittura proprio ora: l'upload non è abbandonato
+            try:
+                if os.path.exists(p) and now - os.path.getmtime(p) > PARTIAL_MAX_AGE:
+                    os.remove(p)
+                    _partial_hashers.pop(upload_id, None)
+                with _partial_lock:
+                    _partial_locks.pop(upload_id, None)
+            finally:
+                lock.release()
     except Exception as e:
-        log_error(f"clear_vectorstore error: {e}")
+        log_error(f"pulizia upload parziali fallita: {e}")
+
+def _chunk_sinks(collection=None):
+    """Destinazioni dei chunk della collezione: sempre chunks.txt, più l'indice vettoriale se il RAG è disponibile."""
+    collection = _valid_collection(collection)
+    sinks = [LexicalStoreSink(_chunks_store_path(collection), CHUNK_DELIM)]
+    rag = _get_rag()
+    if rag is not None:
+        sinks.append(rag.VectorIndexSink(collection))
+    return sinks
+
+def _collection_has_pdf(collection, filename: str) -> bool:
+    return any(_chunk_source(c) == filename for c in _iter_chunks_text(_chunks_store_path(collection)))
+
+def ingest_pdfs(paths: list[str], collection=None) -> tuple[int, list[str]]:
+    """Una sola estrazione e un solo chunking per PDF; gli stessi chunk (stessi id) vanno in tutti i sink."""
+    chunks = ingest_chunks(paths, _chunk_sinks(collection), pdf_extractor, RAG_CFG["chunking"],
+                           hash_for=pdf_hash_for,
+                           on_empty=lambda p: log_error(f"Nessun testo estratto da: {p}"),
+                           on_error=lambda p, e: log_error(f"Errore lettura PDF '{p}': {e}"))
+    _bump_chunks_version(collection)
+    total = chunk_stats(collection)[0]
+    return total, [LexicalStoreSink.format_chunk(c) for c in chunks]
+
+def clear_vectorstore(collection=None):
+    for sink in _chunk_sinks(collection):
+        try:
+            sink.clear()
+        except Exception as e:
+            log_error(f"clear_vectorstore error: {e}")
+    _bump_chunks_version(collection)
 
 def delete_pdf(filename):
     try:
         path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         if os.path.exists(path):
             os.remove(path)
+        _forget_pdf_hash(filename)
     except Exception as e:
         log_error(f"delete_pdf error: {e}")
+    # anche i suoi chunk, solo nelle collezioni che li contengono (le altre non vanno caricate):
+    # nell'indice vettoriale solo tombstone, niente riscrittura
+    for collection in _collection_names():
+        if not _collection_has_pdf(collection, filename):
+            continue
+        removed = False
+        for sink in _chunk_sinks(collection):
+            try:
+                removed = bool(sink.remove(filename)) or removed
+            except Exception as e:
+                log_error(f"delete_pdf: rimozione chunk fallita ({collection}, {type(sink).__name__}): {e}")
+        if removed:
+            _bump_chunks_version(collection)
 
 # ---------- Avvio ----------
 if __name__ == '__main__':
     log_info(f"Avvio e.v.a. | OLLAMA_BASE={OLLAMA_BASE} | DEFAULT_MODEL={DEFAULT_MODEL} | DEFAULT_PROFILE={DEFAULT_PROFILE}")
     _load_handlers()
     check_ollama_connectivity(False)
+    # HTTP/1.1: il bridge Telegram riusa le connessioni (keep-alive) invece di aprirne una per messaggio
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     app.run(host='0.0.0.0', debug=True, port=5000)
@@ -34,6 +34,17 @@ STATE_FILE = os.path.join(LOG_DIR, "command_mode.state")
 # Prefisso da anteporre ai comandi quando la modalità è attiva
 CMD_PREFIX = "#@#"
 
+# ====== Risposte di conferma ======
+MSG_START = ("Modalità comandi ATTIVATA.\n"
+             "Da ora ti restituisco qualsiasi testo con prefisso '#@#'.\n"
+             "Per uscire: 'fine programmazione' / 'stop' / 'esci'.")
+MSG_STOP = "Modalità comandi DISATTIVATA. Torno a usare il modello."
+MSG_STATUS_ON = "Modalità comandi: ON"
+MSG_STATUS_OFF = "Modalità comandi: OFF"
+
+# Risposte sempre uguali: i client con TTS le pre-sintetizzano (vedi /static_replies)
+STATIC_REPLIES = [MSG_START, MSG_STOP, MSG_STATUS_ON, MSG_STATUS_OFF]
+
 # ====== Pattern di attivazione/disattivazione/stato ======
 # Usiamo regex robuste con vari sinonimi in italiano/inglese
 START_PATTERNS = [
@@ -119,14 +130,12 @@ def handle(text: str, context: dict) -> str:
     # Comandi di controllo
     if _match_any(START_PATTERNS, t):
         _write_mode(True)
-        return ("Modalità comandi ATTIVATA.\n"
-                "Da ora ti restituisco qualsiasi testo con prefisso '#@#'.\n"
-                "Per uscire: 'fine programmazione' / 'stop' / 'esci'.")
+        return MSG_START
     if _match_any(STOP_PATTERNS, t):
         _write_mode(False)
-        return "Modalità comandi DISATTIVATA. Torno a usare il modello."
+        return MSG_STOP
     if _match_any(STATUS_PATTERNS, t):
-        return "Modalità comandi: ON" if _read_mode() else "Modalità comandi: OFF"
+        return MSG_STATUS_ON if _read_mode() else MSG_STATUS_OFF
 
     # Pass-through in modalità attiva
     if _read_mode():
@@ -53,10 +53,15 @@ def can_handle(text: str, context: dict) -> bool:
             return True
     return False
 
+# Risposta di presentazione (personalizzabile)
+REPLY = (
+    "Ciao! Sono Martino, un robot pensato per aiutarti con domande e compiti del quotidiano. "
+    "Sono un po' birichino ma molto volenteroso! Come posso esserti utile adesso? "
+    "Se vuoi, mi puoi anche adottare. Ciao per farmi le domande devi dire la parola marrtino e poi farmi la domanda"
+)
+
+# Risposte sempre uguali: i client con TTS le pre-sintetizzano (vedi /static_replies)
+STATIC_REPLIES = [REPLY]
+
 def handle(text: str, context: dict) -> str:
-    # Risposta di presentazione (personalizzabile)
-    return (
-        "Ciao! Sono Martino, un robot pensato per aiutarti con domande e compiti del quotidiano. "
-        "Sono un po' birichino ma molto volenteroso! Come posso esserti utile adesso? "
-        "Se vuoi, mi puoi anche adottare. Ciao per farmi le domande devi dire la parola marrtino e poi farmi la domanda"
-    )
+    return REPLY
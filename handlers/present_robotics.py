@@ -20,13 +20,18 @@ def can_handle(text: str, context: dict) -> bool:
             return True
     return False
 
+# Presentazione dell'azienda Robotics3D e del team
+REPLY = (
+    "Robotics3D � un'azienda che si occupa di progettazione e sviluppo di robot educativi "
+    "e soluzioni innovative nel campo della robotica, come il nostro robot MARRtino. "
+    "Siamo un team appassionato e dedicato che lavora con entusiasmo per creare prodotti "
+    "tecnologici all'avanguardia. "
+    "Il nostro staff � composto da: Paolo, Fabio, Leo, Sara, Francesco ed Ennio. "
+    "Ognuno di noi porta un contributo unico e fondamentale per la realizzazione dei nostri progetti!"
+)
+
+# Risposte sempre uguali: i client con TTS le pre-sintetizzano (vedi /static_replies)
+STATIC_REPLIES = [REPLY]
+
 def handle(text: str, context: dict) -> str:
-    # Presentazione dell'azienda Robotics3D e del team
-    return (
-        "Robotics3D � un'azienda che si occupa di progettazione e sviluppo di robot educativi "
-        "e soluzioni innovative nel campo della robotica, come il nostro robot MARRtino. "
-        "Siamo un team appassionato e dedicato che lavora con entusiasmo per creare prodotti "
-        "tecnologici all'avanguardia. "
-        "Il nostro staff � composto da: Paolo, Fabio, Leo, Sara, Francesco ed Ennio. "
-        "Ognuno di noi porta un contributo unico e fondamentale per la realizzazione dei nostri progetti!"
-    )
+    return REPLY
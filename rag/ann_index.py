@@ -0,0 +1,137 @@
+# File: ann_index.py
+# Descrizione: Costruzione degli indici FAISS (flat, IVF, HNSW, IVF-PQ) scelti in base alla dimensione del corpus,
+#              con parametri di training/ricerca persistiti accanto all'indice
+
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+PARAMS_FILE = "index_params.json"
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "numpy")   # numpy: rag/numpy_store.py, senza FAISS
+
+
+def choose_index_type(n_vectors, cfg):
+    """'auto' → flat per corpus piccoli, HNSW per quelli medi, IVF-PQ (compresso) per quelli grandi.
+    'numpy' va chiesto esplicitamente (config o index_type della collezione)."""
+    wanted = (cfg.get("type") or "auto").lower()
+    if wanted in INDEX_TYPES:
+        return wanted
+    if n_vectors <= int(cfg.get("flat_max", 20000)):
+        return "flat"
+    if n_vectors <= int(cfg.get("hnsw_max", 200000)):
+        return "hnsw"
+    return "ivfpq"
+
+
+def _nlist_for(n_vectors, cfg):
+    nlist = cfg.get("nlist")
+    if nlist:
+        return int(nlist)
+    # regola pratica: ~4*sqrt(N) liste, almeno 39 punti di training per lista
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39 or 1))
+
+
+def _pq_m_for(dim, cfg):
+    m = int(cfg.get("pq_m", 48))
+    while m > 1 and dim % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors, cfg, index_type=None):
+    """
+    Crea e (se serve) addestra un indice FAISS vuoto adatto ai vettori dati.
+    I vettori NON vengono aggiunti: lo fa il vectorstore.
+    Ritorna (index, params).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index_type = index_type or choose_index_type(n, cfg)
+    params = {"type": index_type, "dim": dim, "n_trained": n}
+
+    if index_type in ("ivf", "ivfpq"):
+        nlist = _nlist_for(n, cfg)
+        nbits = int(cfg.get("pq_nbits", 8))
+        if index_type == "ivfpq" and n < (1 << nbits) * 39:
+            # troppi pochi punti per addestrare i codebook PQ: ripiego su IVF non compresso
+            index_type = params["type"] = "ivf"
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivfpq":
+            m = _pq_m_for(dim, cfg)
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits)
+            params.update({"pq_m": m, "pq_nbits": nbits})
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        train_max = int(cfg.get("train_max", 100000))
+        sample = vectors
+        if n > train_max:
+            sample = vectors[np.random.default_rng(0).choice(n, train_max, replace=False)]
+        index.train(sample)
+        params.update({"nlist": nlist, "nprobe": int(cfg.get("nprobe", 16))})
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, int(cfg.get("hnsw_m", 32)))
+        index.hnsw.efConstruction = int(cfg.get("ef_construction", 80))
+        params.update({
+            "hnsw_m": int(cfg.get("hnsw_m", 32)),
+            "ef_construction": int(cfg.get("ef_construction", 80)),
+            "ef_search": int(cfg.get("ef_search", 64)),
+        })
+    else:
+        index = faiss.IndexFlatL2(dim)
+
+    apply_search_params(index, params)
+    return index, params
+
+
+def apply_search_params(index, params):
+    """Imposta i parametri di ricerca (nprobe / efSearch) su un indice appena creato o caricato."""
+    ps = faiss.ParameterSpace()
+    if params.get("nprobe"):
+        ps.set_index_parameter(index, "nprobe", int(params["nprobe"]))
+    if params.get("ef_search"):
+        ps.set_index_parameter(index, "efSearch", int(params["ef_search"]))
+
+
+def reconstruct_all(index):
+    """
+    Vettori memorizzati nell'indice (float32, in ordine di posizione): una ricostruzione non ricalcola gli embedding.
+    IVF ha bisogno della direct map; IVF-PQ restituisce i vettori decodificati dai codici (approssimati).
+    """
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return np.asarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+
+
+def needs_rebuild(params, n_vectors, cfg):
+    """Vero se il corpus è cresciuto tanto da richiedere un altro tipo di indice o un nuovo training."""
+    if params.get("type") == "numpy":
+        # scelto esplicitamente per questo indice: resta NumPy finché la config non chiede un tipo FAISS
+        return (cfg.get("type") or "auto").lower() not in ("auto", "numpy")
+    if not params:
+        return choose_index_type(n_vectors, cfg) != "flat"
+    if choose_index_type(n_vectors, cfg) != params.get("type"):
+        return True
+    if params.get("type") in ("ivf", "ivfpq"):
+        growth = float(cfg.get("retrain_growth", 4.0))
+        return n_vectors > growth * max(1, int(params.get("n_trained", 0)))
+    return False
+
+
+def save_params(folder, params):
+    with open(os.path.join(folder, PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=2)
+
+
+def load_params(folder):
+    path = os.path.join(folder, PARAMS_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception as e:
+        print(f"[ERRORE] Parametri indice illeggibili ({path}): {e}")
+        return {}
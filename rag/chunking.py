@@ -0,0 +1,49 @@
+# File: chunking.py
+# Descrizione: Normalizzazione del testo estratto e suddivisione in chunk con overlap,
+#              tagliando preferibilmente a fine paragrafo o fine frase
+
+import re
+
+
+def normalize_text(s):
+    if not s:
+        return ""
+    s = s.replace("\r", "\n")
+    s = re.sub(r"\u00A0", " ", s)
+    s = re.sub(r"[ \t]+", " ", s)
+    s = re.sub(r"\n{3,}", "\n\n", s)
+    return s.strip()
+
+
+def chunk_text(t, max_chars=1200, overlap=200):
+    t = normalize_text(t)
+    n = len(t)
+    if n == 0:
+        return []
+
+    chunks = []
+    i = 0
+    while i < n:
+        hard_end = min(n, i + max_chars)
+        window = t[i:hard_end]
+        m = list(re.finditer(r"(\n\n|[\.!?](?:\s|$))", window))
+        if m:
+            end = i + m[-1].end()
+        else:
+            end = hard_end
+        if end <= i:
+            end = min(n, i + max_chars)
+
+        chunk = t[i:end].strip()
+        if chunk:
+            chunks.append(chunk)
+
+        if end >= n:
+            break
+
+        if overlap > 0:
+            i = max(end - overlap, i + 1)
+        else:
+            i = end
+
+    return chunks
@@ -0,0 +1,141 @@
+# File: context.py
+# Descrizione: Assemblaggio del contesto RAG: unisce i chunk adiacenti della stessa pagina,
+#              elimina il testo ripetuto dall'overlap e riempie il prompt entro un budget di token
+
+import os
+import re
+
+from langchain_core.documents import Document
+
+
+def estimate_tokens(text, chars_per_token=3.5):
+    """Stima economica (niente tokenizer): per l'italiano ~3.5 caratteri per token."""
+    return int(len(text or "") / chars_per_token) + 1
+
+
+def context_budget(options, system_message, question, cfg):
+    """Token disponibili per il contesto: num_ctx meno risposta (num_predict), system, domanda e margine."""
+    options = options or {}
+    cpt = float(cfg.get("chars_per_token", 3.5))
+    num_ctx = int(options.get("num_ctx") or cfg.get("default_num_ctx", 2048))
+    num_predict = int(options.get("num_predict") or cfg.get("default_num_predict", 256))
+    if num_predict < 0:  # -1 = illimitato per Ollama: teniamo la riserva di default
+        num_predict = int(cfg.get("default_num_predict", 256))
+    reserved = (num_predict + estimate_tokens(system_message, cpt) + estimate_tokens(question, cpt)
+                + int(cfg.get("safety_tokens", 64)))
+    budget = num_ctx - reserved
+    cap = cfg.get("max_context_tokens")
+    if cap:
+        budget = min(budget, int(cap))
+    return max(0, budget)
+
+
+def _source_key(doc):
+    meta = doc.metadata or {}
+    src = meta.get("source") or ""
+    return os.path.basename(src) or src, meta.get("page")
+
+
+def _order_key(doc):
+    meta = doc.metadata or {}
+    for k in ("chunk", "start_index"):
+        if meta.get(k) is not None:
+            return int(meta[k])
+    return None
+
+
+def _overlap(a, b, max_chars):
+    """Lunghezza del più lungo suffisso di a che è anche prefisso di b (l'overlap del chunker)."""
+    limit = min(len(a), len(b), max_chars)
+    for n in range(limit, 15, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _join(a, b, max_chars):
+    """Unisce due chunk vicini (in qualunque ordine) togliendo la parte ripetuta; None se non si toccano."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    ab = _overlap(a, b, max_chars)
+    ba = _overlap(b, a, max_chars)
+    if ab >= ba and ab:
+        return a + b[ab:]
+    if ba:
+        return b + a[ba:]
+    return None
+
+
+def merge_chunks(docs, max_overlap_chars=400):
+    """
+    Raggruppa per (sorgente, pagina) mantenendo l'ordine di rilevanza del miglior chunk del gruppo.
+    Dentro il gruppo i chunk sono ordinati per posizione (se nota) e uniti senza ripetere l'overlap.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        groups.setdefault(_source_key(doc), []).append((rank, doc))
+
+    merged = []
+    for key, items in sorted(groups.items(), key=lambda kv: kv[1][0][0]):
+        if all(_order_key(d) is not None for _, d in items):
+            items = sorted(items, key=lambda it: _order_key(it[1]))
+        parts = []
+        for _, doc in items:
+            text = (doc.page_content or "").strip()
+            if not text:
+                continue
+            for i, prev in enumerate(parts):
+                joined = _join(prev, text, max_overlap_chars)
+                if joined is not None:
+                    parts[i] = joined
+                    break
+            else:
+                parts.append(text)
+        if parts:
+            meta = dict(items[0][1].metadata or {})
+            meta["merged_chunks"] = len(items)
+            merged.append(Document(page_content="\n…\n".join(parts), metadata=meta))
+    return merged
+
+
+def _truncate(text, max_chars):
+    """Taglia a fine frase (o parola) entro max_chars."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    m = list(re.finditer(r"[\.!?](?:\s|$)|\n\n", cut))
+    if m and m[-1].end() > max_chars // 2:
+        return cut[:m[-1].end()].rstrip()
+    return cut.rsplit(" ", 1)[0].rstrip() + " …"
+
+
+def pack_context(docs, budget_tokens, cfg):
+    """Documenti uniti e deduplicati, nell'ordine di rilevanza, fino a esaurire il budget di token."""
+    cpt = float(cfg.get("chars_per_token", 3.5))
+    min_tokens = int(cfg.get("min_chunk_tokens", 48))
+    packed = []
+    used = 0
+    for doc in merge_chunks(docs, int(cfg.get("max_overlap_chars", 400))):
+        label = format_label(doc)
+        cost = estimate_tokens(label, cpt) + estimate_tokens(doc.page_content, cpt)
+        if used + cost <= budget_tokens:
+            packed.append(doc)
+            used += cost
+            continue
+        room = budget_tokens - used - estimate_tokens(label, cpt)
+        if room >= min_tokens:
+            packed.append(Document(page_content=_truncate(doc.page_content, int(room * cpt)),
+                                   metadata=doc.metadata))
+        break
+    return packed
+
+
+def format_label(doc):
+    src, page = _source_key(doc)
+    return f"[{src or '?'}" + (f" p.{int(page) + 1}]" if page is not None else "]")
+
+
+def format_context(docs):
+    return "\n\n".join(f"{format_label(d)}\n{d.page_content}" for d in docs)
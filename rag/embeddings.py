@@ -0,0 +1,204 @@
+# File: embeddings.py
+# Descrizione: Motore di embedding su CPU (torch o ONNX int8) a batch espliciti,
+#              con cache su disco per i chunk e LRU in memoria per le query
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text):
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache persistente (sqlite) degli embedding, chiave (modello, hash del testo)."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS emb ("
+            " model TEXT NOT NULL, hash TEXT NOT NULL, vec BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._db.commit()
+
+    def get_many(self, model, hashes):
+        found = {}
+        uniq = list(dict.fromkeys(hashes))
+        with self._lock:
+            # sqlite limita i parametri per query: interroghiamo a blocchi
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._db.execute(
+                    f"SELECT hash, vec FROM emb WHERE model = ? AND hash IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO emb (model, hash, vec) VALUES (?, ?, ?)",
+                [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items],
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    Embeddings compatibili LangChain.
+    - backend 'torch' (sentence-transformers) oppure 'onnx' (onnxruntime, modello int8)
+    - batch_size e numero di thread espliciti
+    - cache su disco: re-indicizzare testo invariato non ricalcola nulla
+    - LRU per gli embedding delle query
+    """
+
+    def __init__(self, model_name, backend="torch", onnx_file=None, batch_size=32,
+                 num_threads=None, normalize=True, cache_path=None, query_cache_size=256):
+        self.model_name = model_name
+        self.backend = (backend or "torch").lower()
+        self.onnx_file = onnx_file
+        self.batch_size = max(1, int(batch_size or 1))
+        self.num_threads = int(num_threads) if num_threads else None
+        self.normalize = bool(normalize)
+        self.query_cache_size = max(0, int(query_cache_size or 0))
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._cache = EmbeddingCache(cache_path) if cache_path else None
+
+    @classmethod
+    def from_config(cls, cfg):
+        cfg = cfg or {}
+        return cls(
+            model_name=cfg.get("model", "sentence-transformers/all-MiniLM-L6-v2"),
+            backend=cfg.get("backend", "torch"),
+            onnx_file=cfg.get("onnx_file"),
+            batch_size=cfg.get("batch_size", 32),
+            num_threads=cfg.get("num_threads"),
+            normalize=cfg.get("normalize", True),
+            cache_path=cfg.get("cache_path"),
+            query_cache_size=cfg.get("query_cache_size", 256),
+        )
+
+    @property
+    def cache_key(self):
+        """Identifica modello e runtime: vettori torch e int8 non vanno mescolati in cache."""
+        key = f"{self.model_name}|{self.backend}"
+        if self.backend == "onnx":
+            key += f"|{self.onnx_file}"
+        return key + ("|norm" if self.normalize else "")
+
+    # ---------- modello ----------
+    def _load_onnx(self):
+        import onnxruntime
+        from sentence_transformers import SentenceTransformer
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if self.onnx_file:
+            model_kwargs["file_name"] = self.onnx_file
+        if self.num_threads:
+            opts = onnxruntime.SessionOptions()
+            opts.intra_op_num_threads = self.num_threads
+            opts.inter_op_num_threads = 1
+            model_kwargs["session_options"] = opts
+        return SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    def _load_torch(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        return SentenceTransformer(self.model_name, device="cpu")
+
+    def _get_model(self):
+        if self._model is not None:
+            return self._model
+        with self._model_lock:
+            if self._model is None:
+                if self.backend == "onnx":
+                    try:
+                        self._model = self._load_onnx()
+                    except Exception as e:
+                        print(f"[WARN] Backend ONNX non disponibile ({e}): uso torch.")
+                        self.backend = "torch"
+                        self._model = self._load_torch()
+                else:
+                    self._model = self._load_torch()
+                print(f"[INFO] Modello di embedding caricato: {self.model_name} ({self.backend})")
+        return self._model
+
+    def _encode(self, texts):
+        model = self._get_model()
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            vecs = model.encode(
+                batch,
+                batch_size=self.batch_size,
+                normalize_embeddings=self.normalize,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            out.extend(np.asarray(vecs, dtype=np.float32))
+        return out
+
+    # ---------- API Embeddings ----------
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        hashes = [text_hash(t) for t in texts]
+        cached = self._cache.get_many(self.cache_key, hashes) if self._cache else {}
+
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            vecs = self._encode(list(missing.values()))
+            computed = dict(zip(missing.keys(), vecs))
+            if self._cache:
+                self._cache.put_many(self.cache_key, computed.items())
+            cached.update(computed)
+        if len(texts) > len(missing):
+            print(f"[INFO] Embedding: {len(texts)} testi, {len(missing)} calcolati, il resto da cache.")
+        return [cached[h].tolist() for h in hashes]
+
+    def cached_documents(self, texts):
+        """Vettori già in cache per i testi (None dove mancano): nessun calcolo, nessun modello caricato."""
+        hashes = [text_hash(t) for t in texts]
+        found = self._cache.get_many(self.cache_key, hashes) if self._cache else {}
+        return [found.get(h) for h in hashes]
+
+    def embed_query(self, text):
+        key = text or ""
+        if self.query_cache_size:
+            with self._query_lock:
+                vec = self._query_cache.get(key)
+                if vec is not None:
+                    self._query_cache.move_to_end(key)
+                    return vec
+        vec = self._encode([key])[0].tolist()
+        if self.query_cache_size:
+            with self._query_lock:
+                self._query_cache[key] = vec
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+        return vec
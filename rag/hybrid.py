@@ -0,0 +1,123 @@
+# File: hybrid.py
+# Descrizione: Indice lessicale BM25 in memoria e fusione dei ranking (Reciprocal Rank Fusion)
+#              per il retrieval ibrido lessicale + vettoriale
+
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+# Parole troppo frequenti per essere utili nel ranking lessicale (italiano + inglese di base)
+STOPWORDS = frozenset("""
+a ad al alla alle allo agli ai anche che chi ci col come con cosa da dal dalla dalle dei del della delle
+dello degli di e ed gli ha hai hanno ho i il in io la le lei lo loro lui ma mi ne nei nel nella nelle
+nello negli noi non o per più può quale quali quando se sei si sia sono su sua sue sui sul sulla suo
+tra tu un una uno vi voi è
+the of and to in is for on with as by an be are or at from this that it
+""".split())
+
+# Parole intere comprese codici con trattini/punti/barre (es. "NPK-20-10-10", "CuSO4", "EN-1234/2")
+_TOKEN_RX = re.compile(r"\w+(?:[-./]\w+)*", re.UNICODE)
+
+
+def tokenize(text):
+    """Token minuscoli; i codici composti vengono indicizzati sia interi sia per parti."""
+    out = []
+    for tok in _TOKEN_RX.findall((text or "").lower()):
+        if tok not in STOPWORDS:
+            out.append(tok)
+        if any(c in tok for c in "-./"):
+            out.extend(p for p in re.split(r"[-./]", tok) if p and p not in STOPWORDS)
+    return out
+
+
+class BM25Index:
+    """
+    BM25 (Okapi) con indice invertito; aggiunta e cancellazione incrementali, idf calcolato in ricerca.
+    I documenti cancellati restano nelle posting list ma non contano più (né nei punteggi né nelle statistiche).
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._ids = []                       # posizione -> id documento
+        self._lengths = []                   # posizione -> numero di token
+        self._postings = defaultdict(list)   # termine -> [(posizione, tf)]
+        self._total_len = 0
+        self._live = {}                      # id -> posizione dei documenti non cancellati
+        self._deleted = set()                # posizioni cancellate
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._live)
+
+    @property
+    def deleted_count(self):
+        return len(self._deleted)
+
+    def ids(self):
+        with self._lock:
+            return set(self._live)
+
+    def add(self, items):
+        """items: iterabile di (id, testo); un id già presente viene sostituito."""
+        with self._lock:
+            for doc_id, text in items:
+                self._remove_locked(doc_id)
+                pos = len(self._ids)
+                tokens = tokenize(text)
+                self._ids.append(doc_id)
+                self._lengths.append(len(tokens))
+                self._total_len += len(tokens)
+                self._live[doc_id] = pos
+                for term, tf in Counter(tokens).items():
+                    self._postings[term].append((pos, tf))
+
+    def remove(self, ids):
+        """Cancella i documenti indicati; ritorna quanti erano presenti."""
+        with self._lock:
+            return sum(1 for doc_id in ids if self._remove_locked(doc_id))
+
+    def _remove_locked(self, doc_id):
+        pos = self._live.pop(doc_id, None)
+        if pos is None:
+            return False
+        self._deleted.add(pos)
+        self._total_len -= self._lengths[pos]
+        return True
+
+    def search(self, query, k=10):
+        """[(id, score)] in ordine decrescente di score. Con il lock: add/remove dall'ingestione modificano le posting list."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._live)
+            if not n:
+                return []
+            avgdl = self._total_len / float(n) or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings and self._deleted:
+                    postings = [(pos, tf) for pos, tf in postings if pos not in self._deleted]
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                for pos, tf in postings:
+                    norm = self.k1 * (1.0 - self.b + self.b * self._lengths[pos] / avgdl)
+                    scores[pos] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+            best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+            return [(self._ids[pos], score) for pos, score in best]
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60, weights=None):
+    """
+    Fonde più ranking (liste di id, dal migliore) con RRF: score = sum w / (rrf_k + rank).
+    Ritorna [(id, score)] ordinati per score decrescente.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = defaultdict(float)
+    for ranking, w in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += w / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
@@ -0,0 +1,161 @@
+# File: ingest.py
+# Descrizione: Pipeline unica di ingestione PDF: una sola estrazione e un solo chunking per documento,
+#              i chunk (con id stabili) vengono scritti su più destinazioni (chunk store lessicale, indice vettoriale)
+
+import os
+import re
+import threading
+from collections import namedtuple
+
+from rag.chunking import chunk_text
+from rag.pdf_extract import file_sha256
+
+# page è 0-based come nei metadati LangChain; index = posizione del chunk nella pagina
+Chunk = namedtuple("Chunk", "id source page index text")
+_ID_RX = re.compile(r"\| id\.(\S+)")
+_store_lock = threading.Lock()   # scritture sui chunk store (i sink sono creati per richiesta, lo stato è per file)
+_ids_cache = {}                  # percorso -> ((dimensione, mtime_ns) del file, set degli id)
+
+
+def chunk_id(doc_hash, page, index):
+    """Id stabile: stesso PDF (hash del contenuto), stessa pagina e posizione -> stesso id in ogni sink."""
+    return f"{doc_hash[:16]}-p{page}-c{index}"
+
+
+def iter_pdf_chunks(path, extractor, cfg, doc_hash=None):
+    """Chunk di un PDF: testo per pagina dall'estrattore (con cache), poi chunking con i parametri di cfg."""
+    doc_hash = doc_hash or file_sha256(path)
+    max_chars = int(cfg.get("max_chars", 1200))
+    overlap = int(cfg.get("overlap", 200))
+    for page, raw in enumerate(extractor.extract_pages(path, doc_hash=doc_hash)):
+        for index, piece in enumerate(chunk_text(raw, max_chars=max_chars, overlap=overlap)):
+            yield Chunk(chunk_id(doc_hash, page, index), path, page, index, piece)
+
+
+def ingest(paths, sinks, extractor, cfg, hash_for=None, on_empty=None, on_error=None):
+    """
+    Estrae e suddivide ogni PDF una volta sola e passa gli stessi chunk a tutti i sink (sink.add(chunks)).
+    hash_for(path): sha256 già noto (es. calcolato all'upload), per non rileggere il file.
+    on_empty(path): chiamata per i PDF senza testo estraibile.
+    on_error(path, exc): se data, un PDF illeggibile viene segnalato e saltato invece di interrompere tutto.
+    Ritorna la lista dei chunk prodotti.
+    """
+    chunks = []
+    for path in paths:
+        try:
+            doc_hash = hash_for(path) if hash_for else None
+            found = list(iter_pdf_chunks(path, extractor, cfg, doc_hash=doc_hash))
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(path, e)
+            continue
+        if not found and on_empty:
+            on_empty(path)
+        chunks.extend(found)
+    if chunks:
+        for sink in sinks:
+            sink.add(chunks)
+    return chunks
+
+
+class LexicalStoreSink:
+    """Chunk store testuale (chunks.txt): i nuovi chunk vengono accodati, il file non viene riscritto."""
+
+    def __init__(self, path, delim):
+        self.path = path
+        self.delim = delim
+
+    @staticmethod
+    def format_chunk(chunk):
+        name = os.path.basename(chunk.source)
+        return f"[SRC] {name} | p.{chunk.page + 1} | c.{chunk.index} | id.{chunk.id}\n{chunk.text}"
+
+    def add(self, chunks):
+        """Accoda i chunk non ancora presenti (stesso id): re-ingerire un PDF non li duplica, come nell'indice."""
+        with _store_lock:
+            known = self._ids_locked()
+            chunks = [c for c in chunks if c.id not in known]
+            if not chunks:
+                return 0
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            has_data = os.path.exists(self.path) and os.path.getsize(self.path) > 0
+            with open(self.path, "a", encoding="utf-8") as f:
+                if has_data:
+                    f.write(self.delim)
+                f.write(self.delim.join(self.format_chunk(c) for c in chunks))
+            _ids_cache[self.path] = (self._stat(), known | {c.id for c in chunks})
+        return len(chunks)
+
+    def ids(self):
+        """Id dei chunk nello store, dall'intestazione '[SRC] ... | id.<id>' (i chunk più vecchi non lo hanno)."""
+        with _store_lock:
+            return set(self._ids_locked())
+
+    def _ids_locked(self):
+        # il file viene riletto solo se è cambiato da fuori (dimensione o mtime diversi da quelli in cache)
+        stat = self._stat()
+        cached = _ids_cache.get(self.path)
+        if cached is not None and cached[0] == stat:
+            return cached[1]
+        out = set()
+        for raw in self.iter_raw():
+            m = _ID_RX.search(raw.lstrip().split("\n", 1)[0])
+            if m:
+                out.add(m.group(1))
+        _ids_cache[self.path] = (stat, out)
+        return out
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def iter_raw(self):
+        """Chunk formattati, letti a blocchi senza caricare tutto il file."""
+        if not os.path.exists(self.path):
+            return
+        buf = ""
+        with open(self.path, "r", encoding="utf-8") as f:
+            for block in iter(lambda: f.read(64 * 1024), ""):
+                parts = (buf + block).split(self.delim)
+                buf = parts.pop()
+                for p in parts:
+                    if p.strip():
+                        yield p
+        if buf.strip():
+            yield buf
+
+    def remove(self, source):
+        """Riscrive lo store senza i chunk del documento indicato (nome file o percorso)."""
+        if not os.path.exists(self.path):
+            return 0
+        name = os.path.basename(source) or source
+        prefix = f"[SRC] {name} | "
+        tmp = self.path + ".tmp"
+        removed = 0
+        first = True
+        with _store_lock:
+            with open(tmp, "w", encoding="utf-8") as out:
+                for raw in self.iter_raw():
+                    if raw.lstrip().startswith(prefix):
+                        removed += 1
+                        continue
+                    if not first:
+                        out.write(self.delim)
+                    out.write(raw)
+                    first = False
+            if removed:
+                os.replace(tmp, self.path)
+                _ids_cache.pop(self.path, None)
+            else:
+                os.remove(tmp)
+        return removed
+
+    def clear(self):
+        with _store_lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            _ids_cache.pop(self.path, None)
@@ -0,0 +1,268 @@
+# File: numpy_store.py
+# Descrizione: Vectorstore a forza bruta su matrice NumPy (float16 o int8) memory-mapped, con i testi in un
+#              file JSONL: nessun pickle, caricamento quasi istantaneo, pensato per le basi di conoscenza piccole
+
+import json
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+VECTORS_FILE = "vectors.bin"  # righe grezze (float16 o int8) in coda: il salvataggio scrive solo le nuove
+SCALES_FILE = "scales.f32"    # int8: fattore di scala per riga
+NORMS_FILE = "norms.f32"      # l2: norma al quadrato dei vettori originali
+DOCS_FILE = "docs.jsonl"      # una riga per vettore: {"id", "text", "metadata"}
+STORE_FILE = "store.json"     # dtype, metrica, dimensione, numero di vettori (le righe oltre count non valgono)
+LEGACY_FILES = ("vectors.npy", "scales.npy", "norms.npy")   # formato precedente, riscritto per intero a ogni salvataggio
+DTYPES = ("float16", "int8")
+BLOCK_ROWS = 65536            # righe convertite in float32 per volta durante la ricerca
+
+
+def exists(folder):
+    return os.path.exists(os.path.join(folder, STORE_FILE))
+
+
+def remove_files(folder):
+    for name in (VECTORS_FILE, SCALES_FILE, NORMS_FILE, DOCS_FILE, STORE_FILE) + LEGACY_FILES:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _quantize_int8(x):
+    scales = np.abs(x).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+class NumpyFlatIndex:
+    """
+    Indice esatto con la stessa interfaccia minima di un indice FAISS (ntotal, d, add, search).
+    metric 'ip' (embedding normalizzati, distanza = -prodotto scalare) oppure 'l2' (distanza al quadrato).
+    """
+
+    def __init__(self, dim, dtype="float16", metric="ip"):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype non supportato: {dtype} (usa {', '.join(DTYPES)})")
+        self.d = int(dim)
+        self.dtype = dtype
+        self.metric = metric
+        self._vectors = np.zeros((0, self.d), dtype=np.dtype(dtype))
+        self._scales = np.zeros(0, dtype=np.float32)
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._saved = 0   # righe già presenti nei file grezzi
+
+    @property
+    def ntotal(self):
+        return int(self._vectors.shape[0])
+
+    @property
+    def nbytes(self):
+        return int(self._vectors.nbytes + self._scales.nbytes + self._norms.nbytes)
+
+    def add(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d)
+        if not len(x):
+            return
+        if self.dtype == "int8":
+            rows, scales = _quantize_int8(x)
+            self._scales = np.concatenate([self._scales, scales])
+        else:
+            rows = x.astype(np.float16)
+        self._vectors = np.concatenate([self._vectors, rows])
+        self._norms = np.concatenate([self._norms, np.einsum("ij,ij->i", x, x)])
+
+    def _scores(self, queries):
+        """Prodotti scalari (n, m) calcolati a blocchi: la matrice mappata non viene mai convertita tutta."""
+        out = np.empty((self.ntotal, len(queries)), dtype=np.float32)
+        for start in range(0, self.ntotal, BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            dots = block @ queries.T
+            if self.dtype == "int8":
+                dots *= self._scales[start:start + BLOCK_ROWS, None]
+            out[start:start + len(block)] = dots
+        return out
+
+    def search(self, queries, k):
+        """Come faiss: (distanze, posizioni) di forma (m, k), con -1 dove mancano risultati."""
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.d)
+        m = len(queries)
+        distances = np.full((m, k), np.inf, dtype=np.float32)
+        positions = np.full((m, k), -1, dtype=np.int64)
+        n = self.ntotal
+        if not n or k <= 0:
+            return distances, positions
+        scores = self._scores(queries)
+        if self.metric == "l2":
+            dist = self._norms[:, None] - 2.0 * scores + np.einsum("ij,ij->i", queries, queries)[None, :]
+        else:
+            dist = -scores
+        top = min(k, n)
+        for j in range(m):
+            col = dist[:, j]
+            best = np.argpartition(col, top - 1)[:top] if top < n else np.arange(n)
+            best = best[np.argsort(col[best], kind="stable")]
+            distances[j, :top] = col[best]
+            positions[j, :top] = best
+        return distances, positions
+
+    def reconstruct_n(self, start, n):
+        """Righe [start, start+n) come float32 (int8 riportati in scala), come faiss.Index.reconstruct_n."""
+        rows = np.asarray(self._vectors[start:start + n], dtype=np.float32)
+        if self.dtype == "int8":
+            rows *= self._scales[start:start + n, None]
+        return rows
+
+    def save(self, folder):
+        """Accoda ai file grezzi le righe aggiunte dall'ultimo salvataggio; il conteggio valido resta in store.json."""
+        files = [(VECTORS_FILE, self._vectors), (NORMS_FILE, self._norms)]
+        if self.dtype == "int8":
+            files.append((SCALES_FILE, self._scales))
+        start = self._saved if all(os.path.exists(os.path.join(folder, name)) for name, _ in files) else 0
+        for name, arr in files:
+            _append_raw(os.path.join(folder, name), arr, start)
+        self._saved = self.ntotal
+
+    @classmethod
+    def load(cls, folder, dim, dtype, metric, count):
+        """Mappa le prime count righe; una cartella nel vecchio formato .npy viene letta e riscritta al salvataggio."""
+        index = cls(dim, dtype=dtype, metric=metric)
+        raw = (VECTORS_FILE, NORMS_FILE) + ((SCALES_FILE,) if dtype == "int8" else ())
+        if all(os.path.exists(os.path.join(folder, name)) for name in raw):
+            index._vectors = _map_raw(os.path.join(folder, VECTORS_FILE), dtype, (count, index.d))
+            index._norms = _map_raw(os.path.join(folder, NORMS_FILE), np.float32, (count,))
+            if dtype == "int8":
+                index._scales = _map_raw(os.path.join(folder, SCALES_FILE), np.float32, (count,))
+            index._saved = count
+            return index
+        vectors, norms, scales = (os.path.join(folder, name) for name in LEGACY_FILES)
+        index._vectors = np.load(vectors, mmap_mode="r")[:count]
+        index._norms = np.load(norms, mmap_mode="r")[:count]
+        if dtype == "int8":
+            index._scales = np.load(scales, mmap_mode="r")[:count]
+        return index
+
+
+def _append_raw(path, arr, start):
+    """Scrive le righe arr[start:] dopo le prime start già su disco; quello che segue (salvataggi interrotti) si perde."""
+    arr = np.asarray(arr)
+    offset = start * arr.dtype.itemsize * int(np.prod(arr.shape[1:], dtype=np.int64))
+    with open(path, "r+b" if start else "wb") as f:
+        f.seek(offset)
+        if os.fstat(f.fileno()).st_size > offset:
+            f.truncate()
+        f.write(np.ascontiguousarray(arr[start:]).tobytes())
+
+
+def _map_raw(path, dtype, shape):
+    if not shape[0]:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class _Docstore:
+    """Stessa risposta di InMemoryDocstore.search: Document, o una stringa se l'id non esiste."""
+
+    def __init__(self):
+        self._dict = {}
+
+    def search(self, doc_id):
+        doc = self._dict.get(doc_id)
+        return doc if doc is not None else f"ID {doc_id} not found."
+
+
+class NumpyVectorStore:
+    """
+    Sostituto del vectorstore FAISS di LangChain per i punti usati da rag_chain:
+    index (ntotal/search), index_to_docstore_id, docstore.search, add_embeddings, similarity_search,
+    save_local / load_local.
+    """
+
+    def __init__(self, embedding_function, dim=None, dtype="float16", metric="ip"):
+        self.embedding_function = embedding_function
+        self.dtype = dtype
+        self.metric = metric
+        self.index = NumpyFlatIndex(dim, dtype=dtype, metric=metric) if dim else None
+        self.index_to_docstore_id = {}
+        self.docstore = _Docstore()
+        self._saved = 0         # righe già presenti in docs.jsonl: il salvataggio accoda solo le nuove
+        self._saved_bytes = 0   # fine dell'ultima riga valida (oltre: resti di un salvataggio interrotto)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None):
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        metadatas = metadatas or [{} for _ in text_embeddings]
+        ids = list(ids) if ids else [os.urandom(16).hex() for _ in text_embeddings]
+        dup = [i for i in ids if i in self.docstore._dict]
+        if dup:
+            raise ValueError(f"Tried to add ids that already exist: {dup[:5]}")
+        vectors = np.asarray([vec for _, vec in text_embeddings], dtype=np.float32)
+        if self.index is None:
+            self.index = NumpyFlatIndex(vectors.shape[1], dtype=self.dtype, metric=self.metric)
+        start = self.index.ntotal
+        self.index.add(vectors)
+        for offset, ((text, _), meta, doc_id) in enumerate(zip(text_embeddings, metadatas, ids)):
+            self.index_to_docstore_id[start + offset] = doc_id
+            self.docstore._dict[doc_id] = Document(page_content=text, metadata=dict(meta or {}))
+        return ids
+
+    def similarity_search(self, query, k=4):
+        if self.index is None:
+            return []
+        vec = np.asarray([self.embedding_function.embed_query(query)], dtype=np.float32)
+        _, positions = self.index.search(vec, k)
+        docs = []
+        for pos in positions[0]:
+            doc_id = self.index_to_docstore_id.get(int(pos))
+            if pos >= 0 and doc_id is not None:
+                docs.append(self.docstore._dict[doc_id])
+        return docs
+
+    def save_local(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        if self.index is None:
+            return
+        self.index.save(folder)
+        docs_path = os.path.join(folder, DOCS_FILE)
+        n = self.index.ntotal
+        if not (self._saved and os.path.exists(docs_path)):
+            self._saved = self._saved_bytes = 0
+        with open(docs_path, "r+b" if self._saved else "wb") as f:
+            f.seek(self._saved_bytes)
+            f.truncate()
+            for pos in range(self._saved, n):
+                doc_id = self.index_to_docstore_id[pos]
+                doc = self.docstore._dict[doc_id]
+                f.write((json.dumps({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata},
+                                    ensure_ascii=False) + "\n").encode("utf-8"))
+            self._saved_bytes = f.tell()
+        self._saved = n
+        header = {"dim": self.index.d, "dtype": self.dtype, "metric": self.metric, "count": n}
+        tmp = os.path.join(folder, STORE_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2)
+        os.replace(tmp, os.path.join(folder, STORE_FILE))
+        for name in LEGACY_FILES:
+            path = os.path.join(folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+        # da qui in poi la matrice viene letta dal file mappato, non resta in RAM
+        self.index = NumpyFlatIndex.load(folder, self.index.d, self.dtype, self.metric, n)
+
+    @classmethod
+    def load_local(cls, folder, embeddings):
+        with open(os.path.join(folder, STORE_FILE), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        vs = cls(embeddings, dtype=header["dtype"], metric=header.get("metric", "ip"))
+        count = int(header["count"])
+        vs.index = NumpyFlatIndex.load(folder, header["dim"], header["dtype"], vs.metric, count)
+        with open(os.path.join(folder, DOCS_FILE), "rb") as f:
+            for pos in range(count):
+                row = json.loads(f.readline().decode("utf-8"))
+                vs.index_to_docstore_id[pos] = row["id"]
+                vs.docstore._dict[row["id"]] = Document(page_content=row["text"], metadata=row.get("metadata") or {})
+            vs._saved_bytes = f.tell()
+        vs._saved = count
+        return vs
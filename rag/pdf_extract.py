@@ -0,0 +1,166 @@
+# File: pdf_extract.py
+# Descrizione: Estrazione del testo dai PDF con backend intercambiabili (PyMuPDF, pypdfium2, pypdf)
+#              e cache su disco del testo per pagina, chiave (hash del documento + backend e versione, pagina)
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+
+def file_sha256(path, block=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ---------- backend ----------
+def _extract_pymupdf(path):
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return [page.get_text("text") or "" for page in doc]
+
+
+def _extract_pypdfium2(path):
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(path)
+    try:
+        out = []
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            out.append(textpage.get_text_range() or "")
+            textpage.close()
+            page.close()
+        return out
+    finally:
+        pdf.close()
+
+
+def _extract_pypdf(path):
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [p.extract_text() or "" for p in reader.pages]
+
+
+# dal più veloce al più lento; pypdf è sempre installato (requirements.txt)
+# nome -> (modulo importato, distribuzione pip, funzione)
+BACKENDS = {
+    "pymupdf": ("fitz", "PyMuPDF", _extract_pymupdf),
+    "pypdfium2": ("pypdfium2", "pypdfium2", _extract_pypdfium2),
+    "pypdf": ("pypdf", "pypdf", _extract_pypdf),
+}
+
+
+def available_backends():
+    import importlib.util
+    return [name for name, (module, _, _) in BACKENDS.items() if importlib.util.find_spec(module) is not None]
+
+
+def backend_version(name):
+    """Versione installata del backend ("" se non determinabile)."""
+    from importlib import metadata
+    try:
+        return metadata.version(BACKENDS[name][1])
+    except metadata.PackageNotFoundError:
+        return ""
+
+
+def pick_backend(preferred=None):
+    """Primo backend installato nell'ordine di preferenza (default: ordine di BACKENDS)."""
+    available = available_backends()
+    for name in (preferred or list(BACKENDS)):
+        if name in available:
+            return name
+    raise RuntimeError("Nessun estrattore PDF installato (pip install pypdf).")
+
+
+# ---------- cache ----------
+class PageTextCache:
+    """
+    Testo estratto per (chiave documento, pagina) in sqlite; sopravvive a /clear_chunks.
+    La chiave include backend e versione: cambiare estrattore non riusa testo estratto da un altro.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs (doc_hash TEXT PRIMARY KEY, pages INTEGER NOT NULL, backend TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " doc_hash TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL,"
+            " PRIMARY KEY (doc_hash, page))"
+        )
+        self._db.commit()
+
+    def get(self, doc_hash):
+        with self._lock:
+            row = self._db.execute("SELECT pages FROM docs WHERE doc_hash = ?", (doc_hash,)).fetchone()
+            if row is None:
+                return None
+            rows = self._db.execute(
+                "SELECT page, text FROM pages WHERE doc_hash = ? ORDER BY page", (doc_hash,)
+            ).fetchall()
+        if len(rows) != row[0]:
+            return None
+        return [text for _, text in rows]
+
+    def put(self, doc_hash, pages, backend):
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE doc_hash = ?", (doc_hash,))
+            self._db.executemany(
+                "INSERT INTO pages (doc_hash, page, text) VALUES (?, ?, ?)",
+                [(doc_hash, i, t) for i, t in enumerate(pages)],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO docs (doc_hash, pages, backend) VALUES (?, ?, ?)",
+                (doc_hash, len(pages), backend),
+            )
+            self._db.commit()
+
+
+class PdfExtractor:
+    """Estrae il testo per pagina; un PDF già visto (stesso hash) non viene più ri-analizzato."""
+
+    def __init__(self, backends=None, cache_path=None):
+        self.backends = list(backends or BACKENDS)
+        self.cache = PageTextCache(cache_path) if cache_path else None
+        self._backend = None
+        self._cache_tag = None
+
+    @classmethod
+    def from_config(cls, cfg):
+        cfg = cfg or {}
+        return cls(backends=cfg.get("backends"), cache_path=cfg.get("cache_path"))
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = pick_backend(self.backends)
+            print(f"[INFO] Estrattore PDF: {self._backend}")
+        return self._backend
+
+    @property
+    def cache_tag(self):
+        """Backend e versione, es. "pymupdf-1.24.9": parte della chiave di cache."""
+        if self._cache_tag is None:
+            self._cache_tag = f"{self.backend}-{backend_version(self.backend)}"
+        return self._cache_tag
+
+    def extract_pages(self, path, doc_hash=None):
+        """Lista del testo di ogni pagina. doc_hash: sha256 già noto (es. calcolato all'upload)."""
+        key = f"{doc_hash or file_sha256(path)}:{self.cache_tag}"
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        pages = BACKENDS[self.backend][2](path)
+        if self.cache is not None:
+            self.cache.put(key, pages, self.cache_tag)
+        return pages
@@ -1,104 +1,760 @@
 # File: rag_chain.py
-# Descrizione: Gestione dell'ingestione di PDF e interrogazione tramite RAG con LangChain e Ollama
+# Descrizione: Gestione dell'ingestione di PDF e interrogazione tramite RAG con LangChain e Ollama,
+#              con una collezione di documenti (vectorstore) per profilo, caricata al primo uso
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.llms import Ollama
-from langchain.chains import RetrievalQA
+from langchain_core.prompts import ChatPromptTemplate
 
+import json
 import os
+import re
 import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rag.rag_config import load_rag_config
+from rag.embeddings import EmbeddingEngine
+from rag import ann_index
+from rag import numpy_store
+from rag import segments
+from rag.numpy_store import NumpyVectorStore
+from rag.hybrid import BM25Index, reciprocal_rank_fusion
+from rag import context as rag_context
+from rag.pdf_extract import PdfExtractor
+from rag import ingest as rag_ingest
 
 PDF_DIR = 'data/pdfs'
-VECTOR_DIR = 'data/vectors'
+VECTOR_DIR = 'data/vectors'   # collezione "default" (percorso storico)
 os.makedirs(VECTOR_DIR, exist_ok=True)
 
-embedding = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
+CHAIN_CACHE_SIZE = 16
+DEFAULT_TEMPERATURE = 0.3
+DEFAULT_COLLECTION = "default"
+_COLLECTION_RX = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+DEFAULT_SYSTEM_MESSAGE = (
+    "Rispondi esclusivamente utilizzando le informazioni fornite nel contesto. "
+    "Se la risposta non è presente nei documenti, rispondi: 'Non sono in grado di rispondere con le informazioni disponibili.' "
+    "Se la domanda è collegata in modo indiretto al contesto, prova a rispondere usando inferenze dai contenuti presenti. "
+    "Non usare conoscenze esterne. Rispondi in italiano."
+)
+
+RAG_CFG = load_rag_config()
+embedding = EmbeddingEngine.from_config(RAG_CFG["embedding"])
+pdf_extractor = PdfExtractor.from_config(RAG_CFG["extraction"])
+
+class _ReadWriteLock:
+    """
+    Lock lettori/scrittore: più domande in parallelo, l'ingestione in esclusiva.
+    Con uno scrittore in attesa non entrano nuovi lettori: un flusso continuo di domande non blocca
+    all'infinito ingestione, ricaricamento e compattazione.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+_chain_lock = threading.Lock()
+_chain_cache = OrderedDict()   # (host, model, system_message, k, opzioni) -> _RagChain
+_ollama_host = None            # ollama_host di eva (config.json); None = default di LangChain (localhost)
+_search_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-search")
+_collections_lock = threading.Lock()
+_collections = OrderedDict()   # nome -> _Collection, dalla meno recente alla più recente
+_collection_options = {}       # nome -> opzioni da config.json (es. index_type)
+
+
+def configure_ollama(host):
+    """Host Ollama usato dalle catene RAG (lo stesso di eva, anche se remoto)."""
+    global _ollama_host
+    _ollama_host = (host or "").rstrip("/") or None
+
+
+def _llm_params(options):
+    """Opzioni del profilo (temperature, top_p, num_ctx, stop, ...) che il wrapper Ollama di LangChain accetta."""
+    fields = getattr(Ollama, "model_fields", None) or getattr(Ollama, "__fields__", {})
+    params = {k: v for k, v in (options or {}).items() if v is not None and k in fields and k != "model"}
+    params.setdefault("temperature", DEFAULT_TEMPERATURE)
+    return params
+
+
+def collection_dir(name):
+    """Cartella dei vettori di una collezione; 'default' resta in data/vectors."""
+    if name == DEFAULT_COLLECTION:
+        return VECTOR_DIR
+    return os.path.join(RAG_CFG["collections"]["root"], name, "vectors")
+
+
+def configure_collections(defs):
+    """Opzioni per collezione da config.json ({"nome": {"label": ..., "index_type": "numpy"}})."""
+    global _collection_options
+    _collection_options = {name: dict(opts or {}) for name, opts in (defs or {}).items()}
+
+
+class _Collection:
+    """Una base di conoscenza: vectorstore (caricato al primo uso), lock e dati derivati."""
+
+    def __init__(self, name):
+        self.name = name
+        self.folder = collection_dir(name)
+        self.lock = _ReadWriteLock()
+        self.vectorstore = None
+        self.loaded = False          # False anche dopo l'eviction: si ricarica alla prossima domanda
+        self.loaded_mtime = None     # mtime di manifest e tombstone al momento del caricamento
+        self.size_bytes = 0          # stima dell'occupazione in RAM (dimensione su disco)
+        self.source_counts = None    # {sorgente: n_chunk}, ricalcolato dopo ogni modifica dell'indice
+        self.lexical_index = None    # BM25Index sui chunk correnti: costruito al caricamento, poi aggiornato
+        self.lexical_lock = threading.Lock()
+        self.compact_lock = threading.Lock()   # una sola compattazione alla volta
+
+    @property
+    def index_type(self):
+        return _collection_options.get(self.name, {}).get("index_type")
+
+
+def _get_collection(name=None):
+    name = name or DEFAULT_COLLECTION
+    if not _COLLECTION_RX.match(name):
+        raise ValueError(f"Nome collezione non valido: {name!r}")
+    with _collections_lock:
+        col = _collections.get(name)
+        if col is None:
+            col = _collections[name] = _Collection(name)
+        _collections.move_to_end(name)
+        return col
+
+
+def _folder_bytes(folder):
+    total = 0
+    for root, _, files in os.walk(folder):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _evict_over_cap(keep):
+    """Scarica le collezioni usate meno di recente finché la memoria stimata supera max_loaded_mb."""
+    cap = float(RAG_CFG["collections"].get("max_loaded_mb") or 0) * 1024 * 1024
+    if cap <= 0:
+        return
+    with _collections_lock:
+        loaded = [c for c in _collections.values() if c.loaded and c.vectorstore is not None]
+        total = sum(c.size_bytes for c in loaded)
+        victims = []
+        for col in loaded:
+            if total <= cap:
+                break
+            if col is not keep:
+                victims.append(col)
+                total -= col.size_bytes
+    for col in victims:
+        col.lock.acquire_write()
+        try:
+            col.vectorstore = None
+            col.loaded = False
+            col.source_counts = None
+            col.lexical_index = None
+        finally:
+            col.lock.release_write()
+        print(f"[INFO] Collezione '{col.name}' scaricata dalla memoria ({col.size_bytes // 1024} KB).")
+
+
+def _index_mtime(folder):
+    out = []
+    for name in (segments.MANIFEST_FILE, segments.TOMBSTONES_FILE):
+        try:
+            out.append(os.path.getmtime(os.path.join(folder, name)))
+        except OSError:
+            out.append(None)
+    return tuple(out) if out[0] is not None else None
+
+
+def _load_segment(folder):
+    """Un segmento: matrice NumPy o indice FAISS, riconosciuto dai file presenti."""
+    if numpy_store.exists(folder):
+        return NumpyVectorStore.load_local(folder, embedding)
+    vs = FAISS.load_local(folder, embeddings=embedding, allow_dangerous_deserialization=True)
+    ann_index.apply_search_params(vs.index, ann_index.load_params(folder))
+    return vs
+
+
+def _save_segment(folder, vs, params):
+    vs.save_local(folder)
+    ann_index.save_params(folder, params)
+
+
+def _new_store(col):
+    return segments.SegmentedStore(col.folder, embedding, _segment_builder(col), _load_segment, _save_segment)
+
 
 # Funzione per caricare il vectorstore da file se esiste
-def load_vectorstore():
-    faiss_index = os.path.join(VECTOR_DIR, 'index.faiss')
-    if os.path.exists(faiss_index):
-        print("[INFO] Caricamento vectorstore FAISS esistente...")
-        return FAISS.load_local(VECTOR_DIR, embeddings=embedding, allow_dangerous_deserialization=True)
+def load_vectorstore(col):
+    if segments.exists(col.folder):
+        print(f"[INFO] Caricamento collezione '{col.name}'...")
+        store = segments.SegmentedStore.load_local(col.folder, embedding, _segment_builder(col),
+                                                   _load_segment, _save_segment)
+        print(f"[INFO] {len(store.segments)} segmenti, {len(store)} chunk, {store.deleted_count} cancellati.")
+        return store
     else:
-        print("[INFO] Nessun vectorstore FAISS trovato.")
+        print(f"[INFO] Nessun vectorstore per la collezione '{col.name}'.")
         return None
 
-vectorstore = load_vectorstore()
-last_used_model = None
-
-def ingest_pdfs(pdf_paths):
-    global vectorstore
-    all_chunks = []
-    for pdf_path in pdf_paths:
-        print(f"[INFO] Caricamento PDF: {pdf_path}")
-        loader = PyPDFLoader(pdf_path)
-        documents = loader.load()
-        print(f"[INFO] Trovate {len(documents)} pagine in {pdf_path}")
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-        chunks = text_splitter.split_documents(documents)
-        print(f"[INFO] Generati {len(chunks)} frammenti da indicizzare.")
-        all_chunks.extend(chunks)
-
-    if vectorstore is None:
-        vectorstore = FAISS.from_documents(all_chunks, embedding)
+
+def _set_vectorstore(col, vs, lexical=None):
+    """
+    Sostituisce il vectorstore della collezione. Da chiamare con il lock in scrittura.
+    lexical: BM25 già allineato a vs (aggiornato in modo incrementale); None = da ricostruire al primo uso.
+    """
+    col.vectorstore = vs
+    col.loaded = True
+    col.source_counts = None
+    col.lexical_index = lexical
+    col.loaded_mtime = _index_mtime(col.folder)
+    col.size_bytes = _folder_bytes(col.folder) if vs is not None else 0
+
+
+def _refresh_if_changed(col):
+    """Carica la collezione al primo uso (o dopo l'eviction) e la ricarica se su disco è cambiata."""
+    if col.loaded and _index_mtime(col.folder) == col.loaded_mtime:
+        return
+    col.lock.acquire_write()
+    try:
+        if not col.loaded or _index_mtime(col.folder) != col.loaded_mtime:
+            _set_vectorstore(col, load_vectorstore(col))
+    finally:
+        col.lock.release_write()
+    _evict_over_cap(col)
+
+
+def _acquire_loaded(col):
+    """Lock in lettura su una collezione caricata: se è stata scaricata prima di prendere il lock, la ricarica."""
+    while True:
+        _refresh_if_changed(col)
+        col.lock.acquire_read()
+        if col.loaded:
+            return
+        col.lock.release_read()
+
+
+def _load_locked(col):
+    """Come _refresh_if_changed ma con il lock in scrittura già preso (prima di modificare il vectorstore)."""
+    if not col.loaded or _index_mtime(col.folder) != col.loaded_mtime:
+        _set_vectorstore(col, load_vectorstore(col))
+
+
+def ingest_pdfs(pdf_paths, collection=None):
+    """Ingestione solo nell'indice vettoriale, con la stessa estrazione/chunking di eva.ingest_pdfs."""
+    chunks = rag_ingest.ingest(pdf_paths, [VectorIndexSink(collection)], pdf_extractor, RAG_CFG["chunking"],
+                               on_empty=lambda p: print(f"[INFO] Nessun testo estratto da {p}"))
+    print(f"[INFO] Generati {len(chunks)} frammenti da {len(pdf_paths)} PDF.")
+    return len(chunks), chunks  # Restituisce anche i chunk per l'esplorazione
+
+
+def _store_has(vs, doc_id):
+    doc = vs.docstore.search(doc_id) if vs is not None else None
+    return doc is not None and not isinstance(doc, str)
+
+
+def add_chunks(chunks, collection=None):
+    """
+    Indicizza i chunk di rag.ingest usando il loro id come id del docstore (lo stesso che compare in chunks.txt).
+    I chunk già presenti vengono saltati, quindi re-ingerire lo stesso PDF non duplica i vettori.
+    I nuovi vettori formano un segmento a sé: su disco si scrive solo quello.
+    """
+    col = _get_collection(collection)
+    _acquire_loaded(col)
+    try:
+        chunks = [c for c in chunks if not _store_has(col.vectorstore, c.id)]
+    finally:
+        col.lock.release_read()
+    if not chunks:
+        return 0
+
+    # embedding fuori dal lock: le domande in corso non restano bloccate
+    texts = [c.text for c in chunks]
+    metadatas = [{"source": c.source, "page": c.page, "chunk": c.index, "chunk_id": c.id} for c in chunks]
+    text_embeddings = list(zip(texts, embedding.embed_documents(texts)))
+
+    col.lock.acquire_write()
+    try:
+        _load_locked(col)   # potrebbe essere stata scaricata o modificata nel frattempo
+        keep = [i for i, c in enumerate(chunks) if not _store_has(col.vectorstore, c.id)]
+        if not keep:
+            return 0
+        store = col.vectorstore if col.vectorstore is not None else _new_store(col)
+        store.add_embeddings([text_embeddings[i] for i in keep], metadatas=[metadatas[i] for i in keep],
+                             ids=[chunks[i].id for i in keep])
+        store.save_local()
+        lexical = col.lexical_index
+        if lexical is not None:
+            lexical.add((chunks[i].id, chunks[i].text) for i in keep)
+        _set_vectorstore(col, store, lexical)
+    finally:
+        col.lock.release_write()
+    _schedule_compaction(col)
+    return len(keep)
+
+
+def delete_source(source, collection=None):
+    """Cancella i chunk di un documento (nome file o percorso): solo tombstone, nessuna riscrittura dell'indice."""
+    col = _get_collection(collection)
+    col.lock.acquire_write()
+    try:
+        _load_locked(col)
+        vs = col.vectorstore
+        if vs is None:
+            return 0
+        ids = [doc_id for doc_id, doc in _iter_store_docs(vs) if _match_source(doc, source)]
+        removed = vs.delete(ids)
+        if removed:
+            vs.save_local()
+            lexical = col.lexical_index
+            if lexical is not None:
+                lexical.remove(ids)
+            _set_vectorstore(col, vs, lexical)
+    finally:
+        col.lock.release_write()
+    if removed:
+        print(f"[INFO] Cancellati {removed} chunk di {source} dalla collezione '{col.name}'.")
+        _schedule_compaction(col)
+    return removed
+
+
+class VectorIndexSink:
+    """Sink di rag.ingest verso l'indice vettoriale di una collezione."""
+
+    def __init__(self, collection=None):
+        self.collection = collection
+
+    def add(self, chunks):
+        return add_chunks(chunks, self.collection)
+
+    def remove(self, source):
+        return delete_source(source, self.collection)
+
+    def clear(self):
+        clear_vectorstore(self.collection)
+
+
+def _iter_store_docs(vs):
+    """(id, Document) nell'ordine dell'indice, leggendo direttamente il docstore."""
+    for pos in sorted(vs.index_to_docstore_id):
+        doc_id = vs.index_to_docstore_id[pos]
+        doc = vs.docstore.search(doc_id)
+        if doc is not None and not isinstance(doc, str):
+            yield doc_id, doc
+
+
+def _build_segment(ids, text_embeddings, metadatas, index_type=None):
+    """Nuovo segmento con l'indice scelto per la sua dimensione (o forzato con index_type)."""
+    cfg = RAG_CFG["index"]
+    vectors = [vec for _, vec in text_embeddings]
+    index_type = index_type or ann_index.choose_index_type(len(vectors), cfg)
+    if index_type == "numpy":
+        # con embedding normalizzati il prodotto scalare dà lo stesso ordinamento di L2, senza le norme
+        metric = "ip" if RAG_CFG["embedding"].get("normalize", True) else "l2"
+        vs = NumpyVectorStore(embedding, dtype=cfg.get("numpy_dtype", "float16"), metric=metric)
+        params = {"type": "numpy", "dtype": vs.dtype, "metric": metric}
     else:
-        vectorstore.add_documents(all_chunks)
+        index, params = ann_index.build_index(vectors, cfg, index_type=index_type)
+        vs = FAISS(embedding_function=embedding, index=index,
+                   docstore=InMemoryDocstore(), index_to_docstore_id={})
+    print(f"[INFO] Segmento '{params['type']}' per {len(vectors)} vettori.")
+    vs.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return vs, params
 
-    vectorstore.save_local(VECTOR_DIR)
-    return len(all_chunks), all_chunks  # Restituisce anche i chunk per l'esplorazione
 
+def _segment_builder(col):
+    """Costruttore di segmenti per la collezione: usa il suo index_type (config.json) se indicato."""
+    def build(ids, text_embeddings, metadatas, index_type=None):
+        return _build_segment(ids, text_embeddings, metadatas, index_type=index_type or col.index_type)
+    return build
 
-def ask_question(question, model_name='mistral', system_message=None):
-    global vectorstore, last_used_model
 
-    if vectorstore is None or model_name != last_used_model:
-        vectorstore = load_vectorstore()
-        last_used_model = model_name
-        if vectorstore is None:
-            return "[ERRORE] Nessun documento indicizzato. Caricare un PDF."
+def _needs_compaction(store, index_type=None):
+    """
+    Troppi segmenti o cancellati, oppure il corpus richiede un altro tipo di indice (es. flat -> HNSW),
+    anche con un solo segmento. index_type: tipo fissato per la collezione, che vale al posto della soglia.
+    """
+    cfg = RAG_CFG["index"]
+    if store is None or not store.segments:
+        return False
+    if store.needs_compaction(cfg):
+        return True
+    params = store.segments[0].params
+    if index_type:
+        return params.get("type") != index_type
+    return ann_index.needs_rebuild(params, len(store), cfg)
 
-    from langchain_community.llms import Ollama
-    from langchain_core.prompts import ChatPromptTemplate
-    from langchain.chains import RetrievalQA
 
-    llm = Ollama(model=model_name, temperature=0.3)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
+def _stored_vectors(where, texts):
+    """
+    Vettori dei chunk per [(segmento, posizione)]: esatti dalla cache degli embedding, ricostruiti
+    dall'indice del segmento solo per i mancanti (con IVF-PQ sono approssimati e ricomprimerli
+    a ogni compattazione accumulerebbe l'errore di quantizzazione).
+    """
+    out = embedding.cached_documents(texts)
+    matrices = {}
+    missing = 0
+    for i, (seg, pos) in enumerate(where):
+        if out[i] is not None:
+            continue
+        mat = matrices.get(seg.name)
+        if mat is None:
+            mat = matrices[seg.name] = ann_index.reconstruct_all(seg.vs.index)
+        out[i] = mat[pos]
+        missing += 1
+    if missing:
+        print(f"[WARN] Compattazione: {missing} vettori non in cache, ricostruiti dall'indice.")
+    return out
 
-    system_message = system_message or (
-        "Rispondi esclusivamente utilizzando le informazioni fornite nel contesto. "
-        "Se la risposta non è presente nei documenti, rispondi: 'Non sono in grado di rispondere con le informazioni disponibili.' "
-        "Se la domanda è collegata in modo indiretto al contesto, prova a rispondere usando inferenze dai contenuti presenti. "
-        "Non usare conoscenze esterne. Rispondi in italiano."
-    )
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "{context}\n\n" + system_message),
-        ("human", "{question}")
-    ])
-
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type_kwargs={
-            "prompt": prompt,
-            "document_variable_name": "context"
-        }
+def _compact(col):
+    """
+    Fonde tutti i segmenti in uno, senza i chunk cancellati. Il nuovo indice viene costruito e salvato
+    fuori dal lock con i vettori letti dai segmenti (nessun embedding); il lock in scrittura serve solo
+    per lo scambio finale.
+    """
+    col.lock.acquire_read()
+    try:
+        store = col.vectorstore
+        if store is None:
+            return None
+        names, items, where, name = store.snapshot()
+        lexical = col.lexical_index
+    finally:
+        col.lock.release_read()
+
+    # BM25 ricostruito qui, fuori dal percorso delle domande, quando i cancellati pesano troppo
+    if lexical is not None and lexical.deleted_count > len(lexical) * float(RAG_CFG["index"].get("max_deleted_ratio", 0.2)):
+        lexical = BM25Index()
+        lexical.add((doc_id, doc.page_content) for doc_id, doc in items)
+
+    vs, params = None, {}
+    if items:
+        ids = [doc_id for doc_id, _ in items]
+        texts = [doc.page_content for _, doc in items]
+        pairs = list(zip(texts, _stored_vectors(where, texts)))
+        index_type = col.index_type or ann_index.choose_index_type(len(items), RAG_CFG["index"])
+        vs, params = _build_segment(ids, pairs, [doc.metadata for _, doc in items], index_type=index_type)
+        _save_segment(store.segment_path(name), vs, params)
+
+    col.lock.acquire_write()
+    try:
+        if col.vectorstore is not store:   # collezione svuotata, ricaricata o scaricata nel frattempo
+            shutil.rmtree(store.segment_path(name), ignore_errors=True)
+            return None
+        store.replace_segments(names, name, vs, params, [doc_id for doc_id, _ in items])
+        store.save_local()
+        if lexical is not None and lexical is not col.lexical_index:
+            _sync_lexical(lexical, store)
+        _set_vectorstore(col, store, lexical)
+    finally:
+        col.lock.release_write()
+    print(f"[INFO] Collezione '{col.name}': compattati {len(names)} segmenti in '{name}' ({len(items)} chunk).")
+    return params
+
+
+def _sync_lexical(lexical, store):
+    """Allinea un BM25 ricostruito da uno snapshot ai chunk aggiunti o cancellati nel frattempo. Con il lock in scrittura."""
+    live = set(store.index_to_docstore_id.values())
+    known = lexical.ids()
+    lexical.remove(known - live)
+    added = live - known
+    if added:
+        lexical.add((doc_id, store.docstore.search(doc_id).page_content) for doc_id in added)
+
+
+def _compact_background(col):
+    try:
+        _compact(col)
+    except Exception as e:
+        print(f"[ERRORE] Compattazione della collezione '{col.name}' fallita: {e}")
+    finally:
+        col.compact_lock.release()
+
+
+def _schedule_compaction(col):
+    """Avvia la compattazione in background se serve e se non ce n'è già una in corso."""
+    if not _needs_compaction(col.vectorstore, col.index_type):
+        return
+    if not col.compact_lock.acquire(blocking=False):
+        return
+    threading.Thread(target=_compact_background, args=(col,), name="rag-compact", daemon=True).start()
+
+
+class _RagChain:
+    """LLM, prompt e k condivisi da tutte le domande con lo stesso (modello, system message, k, contesto).
+    Non referenzia il vectorstore: i documenti vengono recuperati a ogni domanda."""
+
+    def __init__(self, model_name, system_message, k, options=None, base_url=None):
+        self.k = k
+        self.system_message = system_message
+        self.options = dict(options or {})
+        llm_kwargs = _llm_params(self.options)
+        if base_url:
+            llm_kwargs["base_url"] = base_url
+        self.llm = Ollama(model=model_name, **llm_kwargs)
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", "{context}\n\n" + system_message),
+            ("human", "{question}")
+        ])
+        self.chain = self.prompt | self.llm
+
+    def pack(self, question, docs):
+        """Unisce/deduplica i chunk e li taglia al budget di token ricavato da num_ctx e num_predict."""
+        cfg = RAG_CFG["context"]
+        budget = rag_context.context_budget(self.options, self.system_message, question, cfg)
+        return rag_context.pack_context(docs, budget, cfg)
+
+    def inputs(self, question, packed_docs):
+        return {"context": rag_context.format_context(packed_docs), "question": question}
+
+
+def _get_chain(model_name, system_message, k, options=None):
+    """Restituisce la _RagChain per (host, modello, system message, k, opzioni del profilo), creandola una sola volta."""
+    options = options or {}
+    base_url = _ollama_host
+    key = (base_url, model_name, system_message, k, json.dumps(options, sort_keys=True, default=str))
+    with _chain_lock:
+        chain = _chain_cache.get(key)
+        if chain is not None:
+            _chain_cache.move_to_end(key)
+            return chain
+
+    chain = _RagChain(model_name, system_message, k, options=options, base_url=base_url)
+
+    with _chain_lock:
+        # un'altra domanda potrebbe averla creata nel frattempo: teniamo la prima
+        chain = _chain_cache.setdefault(key, chain)
+        _chain_cache.move_to_end(key)
+        while len(_chain_cache) > CHAIN_CACHE_SIZE:
+            _chain_cache.popitem(last=False)
+    return chain
+
+
+def _get_lexical_index(col):
+    """
+    BM25 sui chunk correnti. Costruito solo quando la collezione viene (ri)caricata da disco: ingestione,
+    cancellazione e compattazione lo aggiornano in modo incrementale. Con il lock in lettura.
+    """
+    with col.lexical_lock:
+        if col.lexical_index is None:
+            bm25 = BM25Index()
+            bm25.add((doc_id, doc.page_content) for doc_id, doc in _iter_store_docs(col.vectorstore))
+            col.lexical_index = bm25
+        return col.lexical_index
+
+
+def _dense_search_ids(vs, question, n):
+    """Ricerca vettoriale: [doc_id] dal più vicino. Con il lock in lettura."""
+    query = np.asarray([embedding.embed_query(question)], dtype=np.float32)
+    _, positions = vs.index.search(query, n)
+    mapping = vs.index_to_docstore_id
+    return [mapping[p] for p in positions[0] if p >= 0 and p in mapping]
+
+
+def _hybrid_search(col, question, k, cfg):
+    """BM25 e ricerca vettoriale in parallelo, fusi con Reciprocal Rank Fusion; ritorna i k documenti migliori."""
+    vs = col.vectorstore
+    n = max(k, int(cfg.get("candidates", 20)))
+    lexical = _search_pool.submit(lambda: [doc_id for doc_id, _ in _get_lexical_index(col).search(question, n)])
+    dense_ids = _dense_search_ids(vs, question, n)
+    fused = reciprocal_rank_fusion(
+        [dense_ids, lexical.result()],
+        rrf_k=int(cfg.get("rrf_k", 60)),
+        weights=[float(cfg.get("dense_weight", 1.0)), float(cfg.get("lexical_weight", 1.0))],
     )
+    docs = []
+    for doc_id, _ in fused[:k]:
+        doc = vs.docstore.search(doc_id)
+        if doc is not None and not isinstance(doc, str):
+            docs.append(doc)
+    return docs
+
+
+def _retrieve(question, k, collection=None, mode=None):
+    """Documenti pertinenti della collezione, o None se è vuota. Il lock è tenuto solo durante la ricerca."""
+    col = _get_collection(collection)
+    cfg = RAG_CFG["retrieval"]
+    _acquire_loaded(col)
+    try:
+        vs = col.vectorstore
+        if vs is None or not len(vs):
+            return None
+        if (mode or cfg.get("mode") or "hybrid").lower() == "hybrid":
+            return _hybrid_search(col, question, k, cfg)
+        return vs.similarity_search(question, k=k)
+    finally:
+        col.lock.release_read()
+
+
+def retrieve(question, k=None, mode=None, collection=None):
+    """Solo il retrieval, senza modello: mode 'hybrid' o 'dense' (default da rag.json). Usato da benchmark_retrieval."""
+    return _retrieve(question, k or RAG_CFG["retrieval"]["k"], collection, mode=mode) or []
+
+
+def format_sources(docs):
+    """'📚 Fonti: a.pdf p.2, b.pdf p.5' senza duplicati, nell'ordine di rilevanza."""
+    seen = []
+    for d in docs:
+        meta = d.metadata or {}
+        ref = _doc_source(d) or "?"
+        if meta.get("page") is not None:
+            ref += f" p.{int(meta['page']) + 1}"
+        if ref not in seen:
+            seen.append(ref)
+    return "📚 Fonti: " + ", ".join(seen) if seen else ""
+
+
+NO_INDEX_MESSAGE = "[ERRORE] Nessun documento indicizzato. Caricare un PDF."
+
+
+def ask_question(question, model_name='mistral', system_message=None, k=None, options=None, collection=None):
+    rag = _get_chain(model_name, system_message or DEFAULT_SYSTEM_MESSAGE,
+                     k or RAG_CFG["retrieval"]["k"], options)
+    docs = _retrieve(question, rag.k, collection)
+    if docs is None:
+        return NO_INDEX_MESSAGE
+    return rag.chain.invoke(rag.inputs(question, rag.pack(question, docs)))
+
+
+def ask_question_stream(question, model_name='mistral', system_message=None, k=None, options=None,
+                        collection=None):
+    """
+    Come ask_question ma in streaming: prima le fonti (appena finito il retrieval),
+    poi i token della risposta man mano che Ollama li genera.
+    options: opzioni del profilo (temperature, top_p, num_ctx, ...) passate a Ollama; da num_ctx e num_predict
+    si ricava anche il budget del contesto.
+    collection: base di conoscenza del profilo (default: 'default').
+    """
+    rag = _get_chain(model_name, system_message or DEFAULT_SYSTEM_MESSAGE,
+                     k or RAG_CFG["retrieval"]["k"], options)
+    docs = _retrieve(question, rag.k, collection)
+    if docs is None:
+        yield NO_INDEX_MESSAGE
+        return
+    packed = rag.pack(question, docs)
+    sources = format_sources(packed)
+    if sources:
+        yield sources + "\n\n"
+    for token in rag.chain.stream(rag.inputs(question, packed)):
+        if token:
+            yield token
+
+
+def _doc_source(doc):
+    src = (doc.metadata or {}).get("source") or ""
+    return os.path.basename(src) or src
+
+
+def _match_source(doc, source):
+    src = (doc.metadata or {}).get("source") or ""
+    return source in (src, os.path.basename(src)) or os.path.basename(source) == os.path.basename(src)
+
+
+def iter_chunks(cursor=None, limit=50, source=None, collection=None):
+    """
+    Pagina di chunk letta direttamente dal docstore (nessun embedding, nessuna ricerca).
+    cursor = id dell'ultimo chunk della pagina precedente: resta valido anche se tra una pagina e l'altra
+    la collezione riceve chunk, cancellazioni o una compattazione; source filtra per documento (nome file o percorso).
+    Ritorna (lista di Document, next_cursor) con next_cursor = None a fine indice.
+    """
+    limit = max(1, int(limit or 1))
+    col = _get_collection(collection)
+    _acquire_loaded(col)
+    try:
+        vs = col.vectorstore
+        if vs is None:
+            return [], None
+        out, last = [], None
+        for doc_id, doc in vs.iter_docs(after=cursor or None):
+            if doc is None or isinstance(doc, str) or (source and not _match_source(doc, source)):
+                continue
+            if len(out) == limit:
+                return out, last
+            out.append(doc)
+            last = doc_id
+        return out, None
+    finally:
+        col.lock.release_read()
+
+
+def list_sources(collection=None):
+    """Conteggio dei chunk per documento sorgente ({nome_file: n}), calcolato una volta per versione dell'indice."""
+    col = _get_collection(collection)
+    _acquire_loaded(col)
+    try:
+        if col.vectorstore is None:
+            return {}
+        counts = col.source_counts
+        if counts is None:
+            counts = {}
+            for _, doc in _iter_store_docs(col.vectorstore):
+                src = _doc_source(doc)
+                counts[src] = counts.get(src, 0) + 1
+            col.source_counts = counts
+        return dict(counts)
+    finally:
+        col.lock.release_read()
+
 
-    return qa_chain.run(question)
+def count_chunks(source=None, collection=None):
+    if source:
+        src = os.path.basename(source) or source
+        return list_sources(collection).get(src, 0)
+    col = _get_collection(collection)
+    _acquire_loaded(col)
+    try:
+        return len(col.vectorstore) if col.vectorstore is not None else 0
+    finally:
+        col.lock.release_read()
 
-def get_indexed_chunks():
-    if vectorstore is None:
-        return []
-    return vectorstore.similarity_search("", k=100)
 
-def clear_vectorstore():
-    global vectorstore
-    if os.path.exists(VECTOR_DIR):
-        shutil.rmtree(VECTOR_DIR)
-    os.makedirs(VECTOR_DIR, exist_ok=True)
-    vectorstore = None
+def clear_vectorstore(collection=None):
+    col = _get_collection(collection)
+    col.lock.acquire_write()
+    try:
+        if os.path.exists(col.folder):
+            shutil.rmtree(col.folder)
+        os.makedirs(col.folder, exist_ok=True)
+        _set_vectorstore(col, None)
+    finally:
+        col.lock.release_write()
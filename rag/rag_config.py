@@ -0,0 +1,90 @@
+# File: rag_config.py
+# Descrizione: Configurazione della pipeline RAG (config/rag.json), con default e chiavi mancanti integrate
+
+import copy
+import json
+import os
+
+CONFIG_PATH = os.path.join("config", "rag.json")
+
+DEFAULT_CONFIG = {
+    "embedding": {
+        "model": "sentence-transformers/all-MiniLM-L6-v2",
+        "backend": "torch",              # torch | onnx
+        "onnx_file": "onnx/model_qint8_avx2.onnx",  # usato solo con backend onnx (int8 quantizzato)
+        "batch_size": 32,
+        "num_threads": 4,
+        "normalize": True,
+        "cache_path": "data/cache/embeddings.sqlite",
+        "query_cache_size": 256
+    },
+    "index": {
+        "type": "auto",                  # auto | flat | ivf | hnsw | ivfpq | numpy
+        "flat_max": 20000,               # auto: fino a qui ricerca esatta
+        "hnsw_max": 200000,              # auto: fino a qui HNSW, oltre IVF-PQ compresso
+        "nlist": None,                   # None = ~4*sqrt(N)
+        "nprobe": 16,
+        "hnsw_m": 32,
+        "ef_construction": 80,
+        "ef_search": 64,
+        "pq_m": 48,
+        "pq_nbits": 8,
+        "train_max": 100000,
+        "retrain_growth": 4.0,           # IVF: riaddestra quando il corpus cresce di questo fattore
+        "numpy_dtype": "float16",        # type numpy: float16 | int8 (matrice .npy memory-mapped)
+        "max_segments": 8,               # oltre, i segmenti vengono fusi in background
+        "max_deleted_ratio": 0.2         # idem se i chunk cancellati superano questa frazione
+    },
+    "retrieval": {
+        "mode": "hybrid",                # hybrid (BM25 + FAISS con RRF) | dense
+        "k": 10,                         # documenti passati al modello dopo la fusione (poi il budget di contesto)
+        "candidates": 20,                # risultati letti da ciascun retriever prima della fusione
+        "rrf_k": 60,
+        "dense_weight": 1.0,
+        "lexical_weight": 1.0
+    },
+    "context": {
+        "chars_per_token": 3.5,          # stima token senza tokenizer
+        "default_num_ctx": 2048,         # se il profilo non specifica num_ctx / num_predict
+        "default_num_predict": 256,
+        "safety_tokens": 64,
+        "max_context_tokens": None,      # tetto opzionale al contesto, indipendente da num_ctx
+        "max_overlap_chars": 400,        # overlap massimo cercato tra chunk adiacenti
+        "min_chunk_tokens": 48           # sotto questa soglia un chunk troncato non viene aggiunto
+    },
+    "extraction": {
+        "backends": ["pymupdf", "pypdfium2", "pypdf"],   # ordine di preferenza, si usa il primo installato
+        "cache_path": "data/cache/pages.sqlite"
+    },
+    "chunking": {
+        "max_chars": 1200,               # un solo chunking per chunk store lessicale e indice vettoriale
+        "overlap": 200
+    },
+    "collections": {
+        "root": "data/collections",      # <root>/<nome>/vectors e chunks.txt; "default" resta in data/
+        "max_loaded_mb": 512             # oltre, le collezioni usate meno di recente escono dalla RAM (0 = nessun limite)
+    }
+}
+
+
+def _merge_defaults(cfg, defaults):
+    out = dict(cfg or {})
+    for k, v in defaults.items():
+        if k not in out:
+            out[k] = copy.deepcopy(v)
+        elif isinstance(v, dict) and isinstance(out[k], dict):
+            out[k] = _merge_defaults(out[k], v)
+    return out
+
+
+def load_rag_config(path=CONFIG_PATH):
+    """Carica config/rag.json completando le chiavi mancanti con i default."""
+    cfg = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cfg = json.load(f) or {}
+        except Exception as e:
+            print(f"[ERRORE] Impossibile leggere/parsare {path}: {e}. Uso i default.")
+            cfg = {}
+    return _merge_defaults(cfg, DEFAULT_CONFIG)
@@ -0,0 +1,325 @@
+# File: segments.py
+# Descrizione: Vectorstore a segmenti: ogni ingestione aggiunge un segmento (FAISS o NumPy) in una sua cartella,
+#              le cancellazioni sono tombstone in un log append-only, la compattazione fonde i segmenti in uno
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"     # segmenti attivi, in ordine, con i parametri dell'indice di ciascuno
+TOMBSTONES_FILE = "tombstones.log"  # una riga "segmento<TAB>id" per chunk cancellato
+# file di un vectorstore a indice unico (prima dei segmenti): al primo caricamento diventano seg-000000
+LEGACY_FILES = ("index.faiss", "index.pkl", "index_params.json",
+                "vectors.npy", "scales.npy", "norms.npy", "docs.jsonl", "store.json")
+
+
+def exists(folder):
+    return os.path.exists(os.path.join(folder, MANIFEST_FILE)) or any(
+        os.path.exists(os.path.join(folder, name)) for name in ("index.faiss", "store.json"))
+
+
+class _Segment:
+    def __init__(self, name, vs, params, saved=False):
+        self.name = name
+        self.vs = vs
+        self.params = params or {}
+        self.saved = saved
+        self._positions = None   # id -> posizione nel segmento, costruito al primo uso (il segmento non cambia)
+
+    @property
+    def ntotal(self):
+        return self.vs.index.ntotal
+
+    def position(self, doc_id):
+        """Posizione del chunk nel segmento, anche se cancellato; None se non c'è."""
+        if self._positions is None:
+            self._positions = {d: p for p, d in self.vs.index_to_docstore_id.items()}
+        return self._positions.get(doc_id)
+
+
+class _SegmentedIndex:
+    """Vista 'indice FAISS' sull'insieme dei segmenti: posizioni globali, risultati cancellati esclusi."""
+
+    def __init__(self, store):
+        self._store = store
+
+    @property
+    def ntotal(self):
+        return sum(seg.ntotal for seg in self._store.segments)
+
+    def search(self, queries, k):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        m = len(queries)
+        found = [[] for _ in range(m)]
+        offset = 0
+        for seg in self._store.segments:
+            n = seg.ntotal
+            dead = self._store._dead_count.get(seg.name, 0)
+            if n - dead > 0 and k > 0:
+                dist, pos = seg.vs.index.search(queries, min(n, k + dead))
+                if seg.params.get("metric") == "ip":
+                    dist = 2.0 + 2.0 * dist   # -<a,b> -> ||a-b||^2 per vettori normalizzati
+                mapping = seg.vs.index_to_docstore_id
+                for j in range(m):
+                    for d, p in zip(dist[j], pos[j]):
+                        if p >= 0 and (seg.name, mapping.get(int(p))) not in self._store.tombstones:
+                            found[j].append((float(d), offset + int(p)))
+            offset += n
+        distances = np.full((m, k), np.inf, dtype=np.float32)
+        positions = np.full((m, k), -1, dtype=np.int64)
+        for j, hits in enumerate(found):
+            hits.sort()
+            for col, (d, p) in enumerate(hits[:k]):
+                distances[j, col] = d
+                positions[j, col] = p
+        return distances, positions
+
+
+class SegmentedStore:
+    """
+    Stessa interfaccia usata da rag_chain per i vectorstore a indice unico (index, index_to_docstore_id,
+    docstore.search, add_embeddings, similarity_search, save_local), più delete() per chunk id.
+    build(ids, text_embeddings, metadatas, index_type) -> (vs, params) crea un segmento;
+    load(cartella) -> vs e save(cartella, vs, params) lo leggono/scrivono.
+    Il salvataggio scrive solo i segmenti nuovi, le tombstone nuove e il manifest.
+    """
+
+    def __init__(self, folder, embedding_function, build, load, save):
+        self.folder = folder
+        self.embedding_function = embedding_function
+        self._build, self._load, self._save = build, load, save
+        self.segments = []
+        self.tombstones = set()        # (segmento, id)
+        self._new_tombstones = []      # da accodare al log al prossimo salvataggio
+        self._rewrite_tombstones = False
+        self._obsolete = []            # cartelle di segmenti fusi, da eliminare dopo il manifest
+        self._next = 1
+        self.index = _SegmentedIndex(self)
+        self.docstore = self
+        self._refresh()
+
+    # ---------- viste ----------
+    def _refresh(self):
+        """Viste ricostruite da zero: solo al caricamento e dopo la compattazione (add/delete le aggiornano)."""
+        self.index_to_docstore_id = {}
+        self._live = {}
+        self._dead_count = {}
+        self._offsets = {}             # segmento -> prima posizione globale
+        self._ntotal = 0
+        for seg in self.segments:
+            self._append_view(seg)
+
+    def _append_view(self, seg):
+        offset = self._offsets[seg.name] = self._ntotal
+        for pos, doc_id in seg.vs.index_to_docstore_id.items():
+            if (seg.name, doc_id) in self.tombstones:
+                self._dead_count[seg.name] = self._dead_count.get(seg.name, 0) + 1
+            else:
+                self.index_to_docstore_id[offset + pos] = doc_id
+                self._live[doc_id] = seg
+        self._ntotal += seg.ntotal
+
+    def search(self, doc_id):
+        seg = self._live.get(doc_id)
+        return seg.vs.docstore.search(doc_id) if seg is not None else f"ID {doc_id} not found."
+
+    def __len__(self):
+        return len(self._live)
+
+    def iter_docs(self, after=None):
+        """
+        (id, Document) vivi nell'ordine dei segmenti, dal chunk successivo ad 'after' (id già letto).
+        La compattazione conserva l'ordine relativo dei chunk, quindi l'id resta un cursore valido;
+        solo se nel frattempo è stato cancellato e compattato via si riparte dall'inizio.
+        """
+        start_seg, start_pos = 0, 0
+        if after is not None:
+            for i, seg in enumerate(self.segments):
+                pos = seg.position(after)
+                if pos is not None:
+                    start_seg, start_pos = i, pos + 1
+                    break
+        for seg in self.segments[start_seg:]:
+            mapping = seg.vs.index_to_docstore_id
+            for pos in range(start_pos, seg.ntotal):
+                doc_id = mapping.get(pos)
+                if doc_id is not None and self._live.get(doc_id) is seg:
+                    yield doc_id, seg.vs.docstore.search(doc_id)
+            start_pos = 0
+
+    @property
+    def deleted_count(self):
+        return sum(self._dead_count.values())
+
+    # ---------- modifiche ----------
+    def _new_name(self):
+        name = f"seg-{self._next:06d}"
+        self._next += 1
+        return name
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, index_type=None):
+        """Nuovo segmento con i soli vettori dati; i segmenti esistenti non vengono toccati."""
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        ids = list(ids) if ids else [os.urandom(16).hex() for _ in text_embeddings]
+        dup = [i for i in ids if i in self._live]
+        if dup:
+            raise ValueError(f"Tried to add ids that already exist: {dup[:5]}")
+        vs, params = self._build(ids, text_embeddings, metadatas or [{} for _ in ids], index_type)
+        seg = _Segment(self._new_name(), vs, params)
+        self.segments.append(seg)
+        self._append_view(seg)   # solo i chunk del nuovo segmento, non tutto il corpus
+        return ids
+
+    def delete(self, ids):
+        """Marca i chunk come cancellati (tombstone); i vettori restano fino alla compattazione."""
+        removed = 0
+        for doc_id in ids:
+            seg = self._live.pop(doc_id, None)
+            if seg is None:
+                continue
+            self.tombstones.add((seg.name, doc_id))
+            self._new_tombstones.append((seg.name, doc_id))
+            self.index_to_docstore_id.pop(self._offsets[seg.name] + seg.position(doc_id), None)
+            self._dead_count[seg.name] = self._dead_count.get(seg.name, 0) + 1
+            removed += 1
+        return removed
+
+    def similarity_search(self, query, k=4):
+        vec = np.asarray([self.embedding_function.embed_query(query)], dtype=np.float32)
+        _, positions = self.index.search(vec, k)
+        docs = []
+        for pos in positions[0]:
+            doc_id = self.index_to_docstore_id.get(int(pos))
+            if doc_id is not None:
+                docs.append(self.search(doc_id))
+        return docs
+
+    # ---------- compattazione ----------
+    def needs_compaction(self, cfg):
+        total = self.index.ntotal
+        if not total:
+            return False
+        return (len(self.segments) > int(cfg.get("max_segments", 8))
+                or self.deleted_count / float(total) > float(cfg.get("max_deleted_ratio", 0.2)))
+
+    def snapshot(self):
+        """
+        (nomi dei segmenti, [(id, Document)] vivi, [(segmento, posizione nel segmento)] degli stessi chunk,
+        nome per il segmento fuso). Con il lock in lettura; i segmenti non cambiano dopo la creazione.
+        """
+        names = [seg.name for seg in self.segments]
+        starts, offset = [], 0
+        for seg in self.segments:
+            starts.append(offset)
+            offset += seg.ntotal
+        items, where = [], []
+        i = 0
+        for pos in sorted(self.index_to_docstore_id):
+            while i + 1 < len(starts) and pos >= starts[i + 1]:
+                i += 1
+            doc_id = self.index_to_docstore_id[pos]
+            items.append((doc_id, self.search(doc_id)))
+            where.append((self.segments[i], pos - starts[i]))
+        return names, items, where, self._new_name()
+
+    def replace_segments(self, names, name, vs, params, snapshot_ids):
+        """
+        Sostituisce i segmenti 'names' con quello fuso (vs già salvato in cartella 'name').
+        I chunk cancellati mentre la compattazione era in corso diventano tombstone del nuovo segmento.
+        Con il lock in scrittura.
+        """
+        names = set(names)
+        still_live = {doc_id for doc_id, seg in self._live.items() if seg.name in names}
+        keep = [seg for seg in self.segments if seg.name not in names]
+        self.tombstones = {t for t in self.tombstones if t[0] not in names}
+        self._rewrite_tombstones = True
+        if vs is not None:
+            for doc_id in snapshot_ids:
+                if doc_id not in still_live:
+                    self.tombstones.add((name, doc_id))
+                    self._new_tombstones.append((name, doc_id))
+            keep.insert(0, _Segment(name, vs, params, saved=True))
+        self._obsolete.extend(names)
+        self.segments = keep
+        self._refresh()
+
+    # ---------- persistenza ----------
+    def segment_path(self, name):
+        return os.path.join(self.folder, name)
+
+    def save_local(self, folder=None):
+        os.makedirs(self.folder, exist_ok=True)
+        for seg in self.segments:
+            if not seg.saved:
+                self._save(self.segment_path(seg.name), seg.vs, seg.params)
+                seg.saved = True
+
+        # ordine pensato per un'interruzione in qualsiasi punto: il log dei tombstone in append vale sia per il
+        # manifest vecchio sia per il nuovo (al caricamento contano solo le righe dei segmenti nel manifest),
+        # poi il manifest atomico, e solo dopo la riscrittura del log senza i segmenti compattati
+        tomb_path = os.path.join(self.folder, TOMBSTONES_FILE)
+        if self._new_tombstones:
+            with open(tomb_path, "a", encoding="utf-8") as f:
+                f.writelines(f"{s}\t{i}\n" for s, i in self._new_tombstones)
+        self._new_tombstones = []
+
+        manifest = {"next": self._next,
+                    "segments": [{"name": seg.name, "params": seg.params} for seg in self.segments]}
+        tmp = os.path.join(self.folder, MANIFEST_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.folder, MANIFEST_FILE))
+
+        if self._rewrite_tombstones:
+            tmp = tomb_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(f"{s}\t{i}\n" for s, i in sorted(self.tombstones))
+            os.replace(tmp, tomb_path)
+        self._rewrite_tombstones = False
+
+        for name in self._obsolete:
+            shutil.rmtree(self.segment_path(name), ignore_errors=True)
+        self._obsolete = []
+
+    @classmethod
+    def load_local(cls, folder, embedding_function, build, load, save):
+        store = cls(folder, embedding_function, build, load, save)
+        manifest_path = os.path.join(folder, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            store._migrate_legacy()
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        store._next = int(manifest.get("next", 1))
+        for entry in manifest.get("segments", []):
+            vs = load(store.segment_path(entry["name"]))
+            store.segments.append(_Segment(entry["name"], vs, entry.get("params"), saved=True))
+        names = {seg.name for seg in store.segments}
+        tomb_path = os.path.join(folder, TOMBSTONES_FILE)
+        if os.path.exists(tomb_path):
+            with open(tomb_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    seg_name, _, doc_id = line.rstrip("\n").partition("\t")
+                    if seg_name in names and doc_id:
+                        store.tombstones.add((seg_name, doc_id))
+        store._refresh()
+        return store
+
+    def _migrate_legacy(self):
+        """Sposta un indice unico preesistente nel segmento seg-000000 (nessun ricalcolo)."""
+        target = self.segment_path("seg-000000")
+        os.makedirs(target, exist_ok=True)
+        for name in LEGACY_FILES:
+            src = os.path.join(self.folder, name)
+            if os.path.exists(src):
+                os.replace(src, os.path.join(target, name))
+        params = {}
+        params_path = os.path.join(target, "index_params.json")
+        if os.path.exists(params_path):
+            with open(params_path, "r", encoding="utf-8") as f:
+                params = json.load(f) or {}
+        with open(os.path.join(self.folder, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump({"next": 1, "segments": [{"name": "seg-000000", "params": params}]}, f, indent=2)
@@ -1,22 +1,34 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 # file : tg_ollama_bridge.py
+import io
 import os
+import re
 import sys
 import json
+import shutil
 import html
+import time
+import codecs
+import hashlib
+import queue
+import random
 import asyncio
-import tempfile
+import threading
 import subprocess
-from typing import Dict, Any
+import unicodedata
+import importlib.util
+from collections import OrderedDict, deque, namedtuple
+from typing import Dict, Any, Optional
 
 import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.constants import ParseMode, ChatAction
-from telegram.error import BadRequest, TelegramError
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
-    ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
+    ApplicationBuilder, BaseUpdateProcessor, ContextTypes, CommandHandler, MessageHandler, filters
 )
 
 # =============== Caricamento variabili di ambiente e config ===============
@@ -41,13 +53,40 @@ APP_BASE_URL: str = os.getenv("APP_BASE_URL", "http://127.0.0.1:5000/json")
 DEFAULT_MODEL: str = os.getenv("DEFAULT_MODEL", "gemma2:2b")
 ALLOWED_CHAT_IDS = set(CFG.get("allowed_chat_ids", []))
 TIMEOUT_SEC: int = int(CFG.get("timeout_sec", 60))
+HTTP_CFG = CFG.get("http", {}) or {}
+HTTP_RETRIES = int(HTTP_CFG.get("retries", 2))
+HTTP_BACKOFF_BASE = float(HTTP_CFG.get("backoff_base_sec", 0.5))
+HTTP_BACKOFF_MAX = float(HTTP_CFG.get("backoff_max_sec", 4.0))
+STREAM_CFG = CFG.get("stream", {}) or {}
+STREAM_ENABLED = bool(STREAM_CFG.get("enabled", True))
+STREAM_URL: str = os.getenv("APP_STREAM_URL", APP_BASE_URL.rsplit("/", 1)[0] + "/stream")
+STREAM_EDIT_INTERVAL = float(STREAM_CFG.get("edit_interval_sec", 1.5))
+TG_MAX_LEN = 4096   # limite Telegram per il testo di un messaggio, in unità UTF-16 (emoji = 2)
+UPDATES_CFG = CFG.get("updates", {}) or {}
+ALLOWED_UPDATES = [Update.MESSAGE]   # gli handler usano solo i messaggi: niente altri tipi di update
+WEBHOOK_CFG = CFG.get("webhook", {}) or {}
+WEBHOOK_ENABLED = bool(WEBHOOK_CFG.get("enabled", False))
+WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", WEBHOOK_CFG.get("url", ""))
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", WEBHOOK_CFG.get("secret_token", ""))
+# API Telegram alternativa (es. benchmark/fake_telegram_api.py per le prove in locale)
+TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
 ASR_CFG = CFG.get("asr", {}) or {}
 ASR_BACKEND = (ASR_CFG.get("backend") or "faster-whisper").lower()
+ASR_TIER_CFG = ASR_CFG.get("tiered", {}) or {}
+ASR_TIERED = bool(ASR_TIER_CFG.get("enabled", False))
+ASR_VAD_CFG = ASR_CFG.get("vad", {}) or {}
 TTS_CFG = CFG.get("tts", {}) or {}
 TTS_ENABLED = bool(TTS_CFG.get("enabled", False))
 TTS_ENGINE = (TTS_CFG.get("engine") or "piper").lower()
 PIPER_CFG = TTS_CFG.get("piper", {}) or {}
 TTS_VOICE_NAME = PIPER_CFG.get("default_voice", "paola")
+PIPER_POOL_CFG = PIPER_CFG.get("pool", {}) or {}
+TTS_CACHE_CFG = TTS_CFG.get("cache", {}) or {}
+TTS_PIPELINE_CFG = TTS_CFG.get("pipeline", {}) or {}
+TTS_PIPELINE_ENABLED = bool(TTS_PIPELINE_CFG.get("enabled", False))
+TTS_PIPELINE_MODE = (TTS_PIPELINE_CFG.get("mode") or "progressive").lower()   # progressive | concat
+TTS_PIPELINE_MIN_CHARS = int(TTS_PIPELINE_CFG.get("min_chars", 60))
+TTS_PIPELINE_WORKERS = int(TTS_PIPELINE_CFG.get("workers", 2))
 
 if not BOT_TOKEN:
     print("[ERRORE] bot_token non impostato nel file .env", file=sys.stderr)
@@ -72,10 +111,25 @@ def _get_voice_for_chat(chat_id: int) -> str:
 def _set_voice_for_chat(chat_id: int, voice: str):
     CHAT_VOICE[chat_id] = (voice or "").strip()
 
+def _tg_len(text: str) -> int:
+    """Lunghezza come la conta Telegram: unità UTF-16, i caratteri fuori dal BMP (emoji) valgono 2."""
+    return len(text.encode("utf-16-le")) // 2
+
+def _tg_prefix(text: str, limit: int) -> int:
+    """Numero di caratteri del prefisso più lungo che sta in `limit` unità UTF-16."""
+    units = 0
+    for i, ch in enumerate(text):
+        units += 2 if ord(ch) > 0xFFFF else 1
+        if units > limit:
+            return i
+    return len(text)
+
 def chunk_text(text: str, max_len: int = 3800):
     text = text or ""
-    for i in range(0, len(text), max_len):
-        yield text[i:i+max_len]
+    while text:
+        cut = _tg_prefix(text, max_len)
+        yield text[:cut]
+        text = text[cut:]
 
 def _html(msg: str) -> str:
     return html.escape(msg or "")
@@ -86,27 +140,217 @@ def sanitize_response(text: str) -> str:
     text = text.replace("**", "")
     return text
 
+# =============== Sessione HTTP condivisa verso eva ===============
+# Una sola ClientSession per tutta la vita del bot: connessioni keep-alive riusate tra i messaggi.
+# Creata in post_init (loop di PTB già attivo) e chiusa in post_shutdown.
+_http_session: Optional[aiohttp.ClientSession] = None
+_RETRY_STATUS = {502, 503, 504}
+
+def _new_http_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=int(HTTP_CFG.get("pool_size", 8)),
+        keepalive_timeout=float(HTTP_CFG.get("keepalive_sec", 60)),
+    )
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT_SEC, sock_connect=float(HTTP_CFG.get("connect_timeout_sec", 5)))
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def _open_http_session(app=None):
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = _new_http_session()
+
+async def _close_http_session(app=None):
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+async def _http() -> aiohttp.ClientSession:
+    if _http_session is None or _http_session.closed:
+        await _open_http_session()
+    return _http_session
+
+def _backoff(attempt: int) -> float:
+    # "full jitter": attesa casuale fino a base * 2^tentativo, per non far ripartire insieme i retry di più chat
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+async def _request_json(method: str, url: str, idempotent: bool, **kwargs):
+    """
+    (status, json o None). Si ritenta solo quando ripetere è sicuro:
+    - connessione non stabilita (la richiesta non è mai partita): sempre;
+    - disconnessione, timeout o 502/503/504: solo per richieste idempotenti (GET).
+    Una POST arrivata a eva non viene ripetuta: raddoppierebbe la generazione.
+    """
+    for attempt in range(HTTP_RETRIES + 1):
+        last = attempt == HTTP_RETRIES
+        try:
+            session = await _http()
+            async with session.request(method, url, **kwargs) as resp:
+                if not (idempotent and resp.status in _RETRY_STATUS and not last):
+                    data = await resp.json(content_type=None) if resp.status == 200 else None
+                    return resp.status, data
+        except aiohttp.ClientConnectorError:
+            if last:
+                raise
+        except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError, asyncio.TimeoutError):
+            if not idempotent or last:
+                raise
+        await asyncio.sleep(_backoff(attempt))
+
 # =============== Client verso app-ollama.py ===============
-async def query_app_ollama(session: aiohttp.ClientSession, text: str, model: str) -> str:
+async def query_app_ollama(text: str, model: str) -> str:
     url = APP_BASE_URL
     try:
-        async with session.post(url, json={"query": text, "model": model}, timeout=TIMEOUT_SEC) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                if isinstance(data, dict):
-                    return str(data.get("response", "")) or "(risposta vuota)"
-    except Exception:
-        pass
-    try:
-        params = {"query": text, "model": model}
-        async with session.get(url, params=params, timeout=TIMEOUT_SEC) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                if isinstance(data, dict):
-                    return str(data.get("response", "")) or "(risposta vuota)"
-            return f"(errore: server ha risposto {resp.status} su GET {url})"
+        status, data = await _request_json("POST", url, idempotent=False, json={"query": text, "model": model})
     except Exception as e:
         return f"(errore: impossibile contattare l'app Ollama {url} — {e})"
+    if status != 200:
+        return f"(errore: server ha risposto {status} su POST {url})"
+    if isinstance(data, dict):
+        return str(data.get("response", "")) or "(risposta vuota)"
+    return "(errore: risposta non valida dall'app Ollama)"
+
+async def stream_app_ollama(text: str, model: str):
+    """
+    Testo della risposta di /stream man mano che arriva. Si ritenta solo se la connessione non si apre
+    (nessuna generazione avviata); il timeout è di inattività, non sulla durata totale della risposta.
+    """
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=float(HTTP_CFG.get("connect_timeout_sec", 5)),
+                                    sock_read=TIMEOUT_SEC)
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            session = await _http()
+            async with session.post(STREAM_URL, json={"query": text, "model": model}, timeout=timeout) as resp:
+                if resp.status != 200:
+                    yield f"(errore: server ha risposto {resp.status} su POST {STREAM_URL})"
+                    return
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                async for raw in resp.content.iter_any():
+                    piece = decoder.decode(raw)
+                    if piece:
+                        yield piece
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    yield tail
+                return
+        except aiohttp.ClientConnectorError:
+            if attempt == HTTP_RETRIES:
+                raise
+        await asyncio.sleep(_backoff(attempt))
+
+def _split_point(text: str, limit: int) -> int:
+    """
+    Dove spezzare un testo troppo lungo (indice in caratteri, limit in unità UTF-16): ultimo a capo
+    o spazio nella seconda metà, altrimenti al limite.
+    """
+    end = _tg_prefix(text, limit)
+    for sep in ("\n", " "):
+        cut = text.rfind(sep, end // 2, end)
+        if cut > 0:
+            return cut + 1
+    return end
+
+class StreamingReply:
+    """
+    Risposta Telegram che cresce mentre arrivano i token: primo messaggio appena c'è testo, poi
+    edit_message_text al più ogni STREAM_EDIT_INTERVAL secondi; oltre i 4096 caratteri (unità UTF-16) il messaggio
+    viene chiuso e il testo continua in uno nuovo.
+    """
+
+    def __init__(self, message, interval: float = STREAM_EDIT_INTERVAL, on_text=None):
+        self._reply_to = message
+        self._on_text = on_text  # coroutine chiamata con ogni pezzo di testo ripulito (es. pipeline TTS)
+        self._interval = interval
+        self._msg = None        # messaggio Telegram in corso
+        self._text = ""         # testo del messaggio in corso (già ripulito)
+        self._shown = ""        # testo attualmente visibile nel messaggio
+        self._held = ""         # '*' finale tenuto da parte: potrebbe essere metà di un '**'
+        self._next_edit = 0.0
+        self.full = []          # testo completo, per il TTS
+
+    async def feed(self, piece: str, final: bool = False):
+        raw = self._held + piece
+        self._held = ""
+        if raw.endswith("*") and not final:
+            raw, self._held = raw[:-1], "*"
+        clean = sanitize_response(raw)
+        self.full.append(clean)
+        if clean and self._on_text is not None:
+            await self._on_text(clean)
+        self._text += clean
+        while _tg_len(self._text) > TG_MAX_LEN:
+            cut = _split_point(self._text, TG_MAX_LEN)
+            head, self._text = self._text[:cut], self._text[cut:]
+            await self._show(head, force=True)
+            self._msg, self._shown = None, ""
+        await self._show(self._text)
+
+    async def close(self):
+        await self.feed("", final=True)
+        await self._show(self._text, force=True)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.full)
+
+    async def _show(self, text: str, force: bool = False):
+        if not text.strip() or text == self._shown:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_edit:
+            return
+        try:
+            if self._msg is None:
+                self._msg = await self._reply_to.reply_text(text)
+            else:
+                await self._msg.edit_text(text)
+            self._shown = text
+            self._next_edit = time.monotonic() + self._interval
+        except RetryAfter as e:
+            # limite di Telegram: si salta questo aggiornamento, il testo arriva con il prossimo
+            wait = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            self._next_edit = now + float(wait)
+            if force:
+                await asyncio.sleep(max(0.0, self._next_edit - time.monotonic()))
+                await self._show(text, force=True)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        except NetworkError as e:
+            # rete verso Telegram instabile: un aggiornamento intermedio si può saltare, quello finale no
+            if force:
+                raise
+            print(f"[WARN] aggiornamento del messaggio saltato: {e}", file=sys.stderr)
+
+async def reply_with_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, on_text=None) -> str:
+    """
+    Inoltra la domanda a eva e risponde nella chat; ritorna il testo completo della risposta.
+    on_text: coroutine che riceve il testo man mano che arriva (pipeline TTS).
+    """
+    model = _get_model_for_chat(update.effective_chat.id)
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+    if not STREAM_ENABLED:
+        reply = sanitize_response(await query_app_ollama(text, model))
+        for chunk in chunk_text(reply):
+            try:
+                await update.message.reply_text(chunk)
+            except TelegramError:
+                await update.message.reply_text(chunk)
+        if on_text is not None:
+            await on_text(reply)
+        return reply
+
+    out = StreamingReply(update.message, on_text=on_text)
+    # solo gli errori verso eva: quelli di Telegram li gestisce StreamingReply (o risalgono all'error handler)
+    try:
+        async for piece in stream_app_ollama(text, model):
+            await out.feed(piece)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        await out.feed(f"\n(errore: impossibile contattare l'app Ollama {STREAM_URL} — {e})")
+    await out.close()
+    if not out.text.strip():
+        await update.message.reply_text("(risposta vuota)")
+    return out.text
 
 # =============== ASR: Faster-Whisper ===============
 _whisper_model = None
@@ -130,16 +374,28 @@ _whisper_model = None
 #     if result.returncode != 0:
 #         raise RuntimeError(f"ffmpeg errore: {result.stderr.decode(errors='ignore')}")
 
-def _load_faster_whisper_model():
+_whisper_models: Dict[str, Any] = {}   # nome modello -> WhisperModel (modalità a due livelli: piccolo e grande)
+_whisper_lock = threading.Lock()
+
+def _load_faster_whisper_model(model_name: Optional[str] = None):
     global _whisper_model
-    if _whisper_model is not None:
-        return _whisper_model
+    model_name = model_name or ASR_CFG.get("model", "small")
+    model = _whisper_models.get(model_name)
+    if model is not None:
+        return model
+    with _whisper_lock:
+        if model_name not in _whisper_models:
+            _whisper_models[model_name] = _create_whisper_model(model_name)
+        if model_name == ASR_CFG.get("model", "small"):
+            _whisper_model = _whisper_models[model_name]
+    return _whisper_models[model_name]
+
+def _create_whisper_model(model_name: str):
     try:
         from faster_whisper import WhisperModel
     except Exception as e:
         raise RuntimeError(f"faster-whisper non installato: {e}. Esegui: pip install faster-whisper") from e
 
-    model_name = ASR_CFG.get("model", "small")
     # leggi da config, ma default a CPU per evitare problemi cuDNN
     device = (ASR_CFG.get("device") or "cpu").lower()
     compute_type = ASR_CFG.get("compute_type", "int8")
@@ -148,43 +404,373 @@ def _load_faster_whisper_model():
     if device == "cpu":
         os.environ["CT2_USE_CUDA"] = "0"
 
+    # thread: num_workers trascrizioni in parallelo (una per worker ASR), cpu_threads ciascuna
+    num_workers = max(1, int(ASR_CFG.get("workers", 1)))
+    cpu_threads = int(ASR_CFG.get("cpu_threads", 0)) or max(1, (os.cpu_count() or 1) // num_workers)
+
     # istanzia il modello
-    _whisper_model = WhisperModel(model_name, device=device, compute_type=compute_type)
-    return _whisper_model
+    return WhisperModel(model_name, device=device, compute_type=compute_type,
+                        cpu_threads=cpu_threads, num_workers=num_workers)
 
-async def transcribe_voice_ogg_to_text(ogg_bytes: bytes) -> str:
-    import shutil
+ASR_SAMPLE_RATE = 16000
+
+def _ffmpeg(args, data: bytes, what: str) -> bytes:
+    """ffmpeg con ingresso e uscita su pipe: nessun file temporaneo."""
     if not shutil.which("ffmpeg"):
         raise RuntimeError("ffmpeg non trovato nel PATH. Installa ffmpeg (es. sudo apt-get install ffmpeg).")
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"] + args
+    res = subprocess.run(cmd, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg errore ({what}): {res.stderr.decode(errors='ignore')}")
+    return res.stdout
 
-    with tempfile.TemporaryDirectory() as tmpd:
-        ogg_path = os.path.join(tmpd, "voice.ogg")
-        wav_path = os.path.join(tmpd, "voice.wav")
+def decode_ogg_to_float32(ogg_bytes: bytes):
+    """
+    Audio mono 16 kHz float32 (come lo vuole Whisper) dai byte OGG/Opus del vocale:
+    in-process con PyAV (decode_audio di faster-whisper), altrimenti ffmpeg su pipe.
+    """
+    import numpy as np
+    try:
+        from faster_whisper import decode_audio
+    except ImportError:
+        decode_audio = None
+    if decode_audio is not None:
+        try:
+            return decode_audio(io.BytesIO(ogg_bytes), sampling_rate=ASR_SAMPLE_RATE)
+        except Exception as e:
+            print(f"[WARN] Decodifica PyAV fallita, uso ffmpeg: {e}", file=sys.stderr)
+    pcm = _ffmpeg(["-i", "pipe:0", "-ac", "1", "-ar", str(ASR_SAMPLE_RATE), "-f", "f32le", "pipe:1"],
+                  ogg_bytes, "ogg->pcm")
+    return np.frombuffer(pcm, dtype=np.float32)
+
+def split_speech(audio) -> list:
+    """
+    Solo le parti con parlato (Silero VAD di faster-whisper), raggruppate in blocchi di al più chunk_sec secondi:
+    ogni blocco entra in una finestra Whisper e i blocchi di un vocale lungo si trascrivono insieme in batch.
+    Lista vuota se non c'è parlato; [audio] intero se il VAD è disattivato.
+    """
+    if not ASR_VAD_CFG.get("enabled", False):
+        return [audio]
+    import numpy as np
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    chunk_sec = min(float(ASR_VAD_CFG.get("chunk_sec", 30)), 30.0)
+    max_len = int(chunk_sec * ASR_SAMPLE_RATE)
+    opts = VadOptions(threshold=float(ASR_VAD_CFG.get("threshold", 0.5)),
+                      min_silence_duration_ms=int(ASR_VAD_CFG.get("min_silence_ms", 500)),
+                      speech_pad_ms=int(ASR_VAD_CFG.get("speech_pad_ms", 200)),
+                      max_speech_duration_s=chunk_sec)
+    chunks, current, size = [], [], 0
+    for ts in get_speech_timestamps(audio, opts):
+        for start in range(ts["start"], ts["end"], max_len):
+            piece = audio[start:min(ts["end"], start + max_len)]
+            if current and size + len(piece) > max_len:
+                chunks.append(np.concatenate(current))
+                current, size = [], 0
+            current.append(piece)
+            size += len(piece)
+    if current:
+        chunks.append(np.concatenate(current))
+    return chunks
 
-        # salva l'ogg
-        with open(ogg_path, "wb") as f:
-            f.write(ogg_bytes)
+# ---- Livelli ASR: "fast" (modello piccolo, decodifica greedy) e "full" (modello di config, beam search)
+AsrTier = namedtuple("AsrTier", "name model beam_size")
+# text; avg_logprob medio (pesato sulla durata dei segmenti); no_speech_prob massimo; lingua usata o rilevata
+AsrResult = namedtuple("AsrResult", "text avg_logprob no_speech_prob language", defaults=(None,))
 
-        # conversione → WAV mono 16 kHz (inline, niente helper esterno)
-        def _convert_to_wav():
-            cmd = ["ffmpeg", "-y", "-i", ogg_path, "-ac", "1", "-ar", "16000", "-f", "wav", wav_path]
-            res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if res.returncode != 0:
-                raise RuntimeError(f"ffmpeg errore: {res.stderr.decode(errors='ignore')}")
+FULL_TIER = AsrTier("full", ASR_CFG.get("model", "small"), int(ASR_CFG.get("beam_size", 5)))
+FAST_TIER = AsrTier("fast", ASR_TIER_CFG.get("model", "small"), int(ASR_TIER_CFG.get("beam_size", 1)))
 
+def _transcribe_one(audio, tier: AsrTier = FULL_TIER, language: Optional[str] = None) -> AsrResult:
+    """Un audio con model.transcribe; senza lingua Whisper la rileva (in AsrResult.language)."""
+    model = _load_faster_whisper_model(tier.model)
+    segments, info = model.transcribe(audio, language=language, beam_size=tier.beam_size)
+    segments = list(segments)
+    text = "".join(seg.text for seg in segments).strip()
+    if not segments:
+        return AsrResult(text, 0.0, 1.0, info.language)
+    weights = [max(seg.end - seg.start, 0.01) for seg in segments]
+    avg_logprob = sum(seg.avg_logprob * w for seg, w in zip(segments, weights)) / sum(weights)
+    return AsrResult(text, avg_logprob, max(seg.no_speech_prob for seg in segments), info.language)
+
+def _transcribe_batch(audios, tier: AsrTier = FULL_TIER, language: Optional[str] = None):
+    """
+    Più audio (una finestra Whisper da 30 s ciascuno) in un'unica chiamata all'encoder e al decoder.
+    Tutti nella stessa lingua, già nota: senza, ogni audio ha bisogno del suo rilevamento e si va uno per uno.
+    """
+    if len(audios) == 1 or not language:
+        return [_transcribe_one(a, tier, language) for a in audios]
+    import numpy as np
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+    model = _load_faster_whisper_model(tier.model)
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual,
+                          task="transcribe", language=language)
+    features = np.stack([pad_or_trim(model.feature_extractor(a)) for a in audios])
+    encoder_output = model.encode(features)
+    prompt = model.get_prompt(tokenizer, [], without_timestamps=True)
+    results = model.model.generate(encoder_output, [prompt] * len(audios), beam_size=tier.beam_size,
+                                   max_length=448, return_scores=True, return_no_speech_prob=True)
+    # scores: log-probabilità della sequenza divisa per la sua lunghezza (length_penalty=1) ~ avg_logprob
+    return [AsrResult(tokenizer.decode([t for t in r.sequences_ids[0] if t < tokenizer.eot]).strip(),
+                      float(r.scores[0]), float(r.no_speech_prob), language) for r in results]
+
+def _run_tier(audios, tier: AsrTier, language: Optional[str] = None):
+    if len(audios) > 1:
+        try:
+            return _transcribe_batch(audios, tier, language)
+        except Exception as e:
+            print(f"[WARN] Trascrizione a batch fallita, procedo uno alla volta: {e}", file=sys.stderr)
+    return [_transcribe_one(a, tier, language) for a in audios]
+
+def _needs_escalation(r: AsrResult) -> bool:
+    """Il risultato del modello piccolo non è affidabile: si ridecodifica con quello grande."""
+    min_logprob = float(ASR_TIER_CFG.get("min_avg_logprob", -0.7))
+    max_no_speech = float(ASR_TIER_CFG.get("max_no_speech_prob", 0.6))
+    if not r.text:
+        return r.no_speech_prob <= max_no_speech     # vuoto ma con parlato probabile
+    return r.avg_logprob < min_logprob or r.no_speech_prob > max_no_speech   # incerto o forse allucinato
+
+class AsrBusy(RuntimeError):
+    pass
+
+class AsrMetrics:
+    """Attesa in coda e real-time factor (tempo di calcolo / durata audio) delle ultime trascrizioni."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self._rtfs = deque(maxlen=window)
+        self._decodes = deque(maxlen=window)   # secondi di decodifica + VAD per vocale, nel worker
+        self.jobs = 0
+        self.batches = 0
+        self.batched_jobs = 0
+        self.rejected = 0
+        self.audio_sec = 0.0
+        self.speech_sec = 0.0       # audio effettivamente trascritto, dopo il taglio dei silenzi
+        self.escalated = 0
+        self._tier_latency = {}     # livello -> deque di secondi per chiamata
+        self._tier_jobs = {}
+
+    def record(self, waits, elapsed: float, durations, speech: float = 0.0):
+        total = sum(durations)
+        with self._lock:
+            self._waits.extend(waits)
+            if total > 0:
+                self._rtfs.append(elapsed / total)
+            self.jobs += len(waits)
+            self.audio_sec += total
+            self.speech_sec += speech
+            if len(waits) > 1:
+                self.batches += 1
+                self.batched_jobs += len(waits)
+
+    def record_decode(self, elapsed: float):
+        with self._lock:
+            self._decodes.append(elapsed)
+
+    def record_tier(self, tier: str, elapsed: float, jobs: int, escalated: int = 0):
+        with self._lock:
+            self._tier_latency.setdefault(tier, deque(maxlen=self._waits.maxlen)).append(elapsed)
+            self._tier_jobs[tier] = self._tier_jobs.get(tier, 0) + jobs
+            self.escalated += escalated
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    @staticmethod
+    def _pct(values, q: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits, rtfs, decodes = list(self._waits), list(self._rtfs), list(self._decodes)
+            tiers = {name: {"jobs": self._tier_jobs.get(name, 0),
+                            "latency_p50": round(self._pct(list(lat), 0.5), 3),
+                            "latency_p95": round(self._pct(list(lat), 0.95), 3)}
+                     for name, lat in self._tier_latency.items()}
+            fast_jobs = self._tier_jobs.get("fast", 0)
+            return {
+                "tiers": tiers, "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / fast_jobs, 3) if fast_jobs else 0.0,
+                "jobs": self.jobs, "rejected": self.rejected, "audio_sec": round(self.audio_sec, 1),
+                "speech_sec": round(self.speech_sec, 1),
+                "batches": self.batches, "batched_jobs": self.batched_jobs,
+                "queue_wait_p50": round(self._pct(waits, 0.5), 3), "queue_wait_p95": round(self._pct(waits, 0.95), 3),
+                "decode_p50": round(self._pct(decodes, 0.5), 3), "decode_p95": round(self._pct(decodes, 0.95), 3),
+                "rtf_p50": round(self._pct(rtfs, 0.5), 3), "rtf_p95": round(self._pct(rtfs, 0.95), 3),
+            }
+
+class _AsrJob:
+    def __init__(self, ogg_bytes: bytes, loop, future):
+        self.ogg_bytes = ogg_bytes  # vocale ancora da decodificare: decodifica e VAD le fa il worker
+        self.chunks = None          # blocchi di parlato in ordine (uno solo per i vocali brevi)
+        self.duration = 0.0         # durata dell'audio originale, silenzi compresi
+        self.loop = loop
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.started = None         # inizio della decodifica nel worker: fine dell'attesa in coda
+
+def _resolve(job: _AsrJob, result=None, error: Optional[BaseException] = None):
+    def _set():
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+    job.loop.call_soon_threadsafe(_set)
+
+class AsrWorkerPool:
+    """
+    Thread dedicati alla trascrizione, fuori dall'executor di default (download, TTS, ecc.).
+    Coda limitata: oltre queue_size le richieste vengono rifiutate subito invece di accumulare ritardo.
+    Anche decodifica e VAD girano nei worker, così limite della coda e metriche coprono tutto il lavoro.
+    Con la lingua in config i vocali brevi arrivati insieme (entro batch_window_ms) vengono trascritti in
+    un solo batch; i blocchi di parlato di un vocale lungo vanno a batch di batch_max (senza lingua dopo
+    il primo, che la rileva) e il testo si ricompone in ordine.
+    """
+
+    def __init__(self, workers: int, queue_size: int, batch_max: int, batch_window: float, short_sec: float):
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self.batch_max = max(1, batch_max)
+        self.batch_window = batch_window
+        self.short_sec = min(short_sec, 30.0)   # un batch usa una sola finestra Whisper per audio
+        self.metrics = AsrMetrics()
+        self._threads = [threading.Thread(target=self._run, name=f"asr-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for t in self._threads:
+            t.start()
+
+    async def transcribe(self, ogg_bytes: bytes) -> str:
         loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, _convert_to_wav)
+        job = _AsrJob(ogg_bytes, loop, loop.create_future())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.metrics.reject()
+            raise AsrBusy("troppe trascrizioni in corso, riprova tra poco")
+        return await job.future
 
-        # trascrizione con faster-whisper
-        def _do_transcribe():
-            model = _load_faster_whisper_model()
-            language = ASR_CFG.get("language") or None
-            beam_size = ASR_CFG.get("beam_size", 5)
-            segments, info = model.transcribe(wav_path, language=language, beam_size=beam_size)
-            return "".join(seg.text for seg in segments).strip()
+    def _is_short(self, job: _AsrJob) -> bool:
+        return len(job.chunks) == 1 and len(job.chunks[0]) <= self.short_sec * ASR_SAMPLE_RATE
 
-        text = await loop.run_in_executor(None, _do_transcribe)
-        return text or ""
+    def _prepare(self, job: _AsrJob) -> bool:
+        """Decodifica e VAD del vocale; False se il job è già concluso (errore o nessun parlato)."""
+        job.started = time.monotonic()
+        try:
+            audio = decode_ogg_to_float32(job.ogg_bytes)
+            job.duration = len(audio) / float(ASR_SAMPLE_RATE)
+            job.chunks = split_speech(audio)
+        except Exception as e:
+            _resolve(job, error=e)
+            return False
+        finally:
+            job.ogg_bytes = None
+        self.metrics.record_decode(time.monotonic() - job.started)
+        if not job.chunks:
+            _resolve(job, result="")
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if not self._prepare(job):
+                continue
+            batch, pending = [job], []
+            if self._is_short(job) and self.batch_max > 1 and ASR_CFG.get("language"):
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < self.batch_max:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        nxt = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if not self._prepare(nxt):
+                        continue
+                    if self._is_short(nxt):
+                        batch.append(nxt)
+                    else:
+                        pending.append(nxt)
+                        break
+            self._process(batch)
+            for other in pending:
+                self._process([other])
+
+    def _process(self, jobs):
+        start = time.monotonic()
+        waits = [j.started - j.enqueued for j in jobs]
+        chunks = [c for j in jobs for c in j.chunks]
+        # con la lingua in config si fa un batch unico anche tra vocali diversi; senza, la lingua è rilevata
+        # sul primo blocco di ogni vocale e solo i suoi blocchi successivi vanno a batch con quella
+        groups = [chunks] if ASR_CFG.get("language") else [j.chunks for j in jobs]
+        try:
+            texts = []
+            for group in groups:
+                texts.extend(r.text for r in self._transcribe(group))
+        except Exception as e:
+            for j in jobs:
+                _resolve(j, error=e)
+            return
+        self.metrics.record(waits, time.monotonic() - start, [j.duration for j in jobs],
+                            speech=sum(len(c) for c in chunks) / float(ASR_SAMPLE_RATE))
+        for j in jobs:
+            parts, texts = texts[:len(j.chunks)], texts[len(j.chunks):]
+            _resolve(j, result=" ".join(t for t in parts if t))
+
+    def _transcribe(self, audios):
+        """Blocchi di una stessa lingua, a batch di batch_max; senza lingua in config la rileva il primo blocco."""
+        language = ASR_CFG.get("language") or None
+        results = []
+        if language is None:
+            results = self._transcribe_tiers(audios[:1], None)
+            audios, language = audios[1:], results[0].language
+        for i in range(0, len(audios), self.batch_max):
+            results.extend(self._transcribe_tiers(audios[i:i + self.batch_max], language))
+        return results
+
+    def _transcribe_tiers(self, audios, language: Optional[str]):
+        """Un livello (modello di config) oppure due: piccolo per tutti, grande solo per i risultati incerti."""
+        if not ASR_TIERED:
+            t0 = time.monotonic()
+            results = _run_tier(audios, FULL_TIER, language)
+            self.metrics.record_tier(FULL_TIER.name, time.monotonic() - t0, len(audios))
+            return results
+        t0 = time.monotonic()
+        results = _run_tier(audios, FAST_TIER, language)
+        uncertain = [i for i, r in enumerate(results) if _needs_escalation(r)]
+        self.metrics.record_tier(FAST_TIER.name, time.monotonic() - t0, len(audios), escalated=len(uncertain))
+        if uncertain:
+            t1 = time.monotonic()
+            for i, r in zip(uncertain, _run_tier([audios[i] for i in uncertain], FULL_TIER, language)):
+                results[i] = r
+            self.metrics.record_tier(FULL_TIER.name, time.monotonic() - t1, len(uncertain))
+        return results
+
+_asr_pool: Optional[AsrWorkerPool] = None
+
+def _get_asr_pool() -> AsrWorkerPool:
+    global _asr_pool
+    if _asr_pool is None:
+        _asr_pool = AsrWorkerPool(
+            workers=int(ASR_CFG.get("workers", 1)),
+            queue_size=int(ASR_CFG.get("queue_size", 8)),
+            batch_max=int(ASR_CFG.get("batch_max", 4)),
+            batch_window=float(ASR_CFG.get("batch_window_ms", 150)) / 1000.0,
+            short_sec=float(ASR_CFG.get("short_sec", 30)),
+        )
+    return _asr_pool
+
+async def transcribe_voice_ogg_to_text(ogg_bytes: bytes) -> str:
+    # decodifica, taglio dei silenzi col VAD e trascrizione: tutto nei worker ASR, dagli array in memoria
+    text = await _get_asr_pool().transcribe(ogg_bytes)
+    return text or ""
 
 
 # async def transcribe_voice_ogg_to_text(ogg_bytes: bytes) -> str:
@@ -213,15 +799,24 @@ def _piper_check(voice_name: str):
     bin_path = PIPER_CFG.get("binary")
     voice_cfg = _get_piper_config_for_voice(voice_name)
     model_path = voice_cfg.get("model_path")
-    if not bin_path or not os.path.exists(bin_path):
+    if PIPER_POOL is None and (not bin_path or not os.path.exists(bin_path)):
         raise RuntimeError("Percorso 'tts.piper.binary' non valido o mancante.")
     if not model_path or not os.path.exists(model_path):
         raise RuntimeError(f"Percorso del modello '{voice_name}' non valido o mancante: {model_path}")
     return bin_path, model_path, voice_cfg
 
-def _piper_tts_to_wav(text: str, wav_path: str, voice_name: str):
+def _piper_sample_rate(model_path: str) -> int:
+    """Sample rate della voce dal file <modello>.onnx.json che Piper affianca al modello."""
+    try:
+        with open(model_path + ".json", "r", encoding="utf-8") as f:
+            return int(json.load(f)["audio"]["sample_rate"])
+    except Exception:
+        return 22050
+
+def _piper_binary_pcm(text: str, voice_name: str):
+    """(PCM int16 mono, sample rate) dal binario piper, con l'audio letto da stdout (--output_raw)."""
     bin_path, model_path, voice_cfg = _piper_check(voice_name)
-    
+
     speaker = str(voice_cfg.get("speaker", 0)) # Usiamo il valore specifico della voce
     length_scale = str(voice_cfg.get("length_scale", 1.0))
     noise_scale = str(voice_cfg.get("noise_scale", 0.667))
@@ -231,7 +826,7 @@ def _piper_tts_to_wav(text: str, wav_path: str, voice_name: str):
     cmd = [
         bin_path,
         "--model", model_path,
-        "--output_file", wav_path,
+        "--output_raw",
         "--speaker", speaker,
         "--length_scale", length_scale,
         "--noise_scale", noise_scale,
@@ -241,12 +836,467 @@ def _piper_tts_to_wav(text: str, wav_path: str, voice_name: str):
     result = subprocess.run(cmd, input=text.encode("utf-8"), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if result.returncode != 0:
         raise RuntimeError(f"piper errore: {result.stderr.decode(errors='ignore')}")
+    return result.stdout, _piper_sample_rate(model_path)
 
-def _wav_to_ogg_opus(wav_path: str, ogg_path: str):
-    cmd = ["ffmpeg", "-y", "-i", wav_path, "-ac", "1", "-ar", "48000", "-c:a", "libopus", "-b:a", "48k", ogg_path]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode != 0:
-        raise RuntimeError(f"ffmpeg errore (wav->ogg): {result.stderr.decode(errors='ignore')}")
+# ---- Pool di voci in-process (piper-tts): il modello ONNX resta caricato tra una risposta e l'altra
+def _piper_synthesize(voice, text: str, voice_cfg: Dict[str, Any]) -> bytes:
+    """PCM int16 mono con i parametri della voce; supporta sia l'API piper-tts 1.2 sia la 1.3+."""
+    speaker = voice_cfg.get("speaker", 0) if getattr(voice.config, "num_speakers", 1) > 1 else None
+    length_scale = float(voice_cfg.get("length_scale", 1.0))
+    noise_scale = float(voice_cfg.get("noise_scale", 0.667))
+    noise_w = float(voice_cfg.get("noise_w", 0.8))
+    sentence_silence = float(voice_cfg.get("sentence_silence", 0.3))
+    try:
+        from piper import SynthesisConfig   # piper-tts >= 1.3
+    except ImportError:
+        SynthesisConfig = None
+    if SynthesisConfig is None:
+        return b"".join(voice.synthesize_stream_raw(
+            text, speaker_id=speaker, length_scale=length_scale, noise_scale=noise_scale,
+            noise_w=noise_w, sentence_silence=sentence_silence,
+        ))
+    syn_config = SynthesisConfig(speaker_id=speaker, length_scale=length_scale,
+                                 noise_scale=noise_scale, noise_w_scale=noise_w)
+    silence = bytes(2 * int(voice.config.sample_rate * sentence_silence))
+    return silence.join(chunk.audio_int16_bytes for chunk in voice.synthesize(text, syn_config=syn_config))
+
+class PiperVoicePool:
+    """
+    Voci Piper caricate una volta nel processo e riusate. Caricamento al primo uso; oltre max_mb
+    (stima: dimensione dei file .onnx) viene scaricata la voce usata meno di recente.
+    """
+
+    def __init__(self, max_mb: float):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._voices = OrderedDict()        # nome -> (PiperVoice, byte stimati)
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # un caricamento alla volta: niente doppioni della stessa voce
+
+    def _cached(self, voice_name: str):
+        with self._lock:
+            entry = self._voices.get(voice_name)
+            if entry is not None:
+                self._voices.move_to_end(voice_name)
+                return entry[0]
+        return None
+
+    def get(self, voice_name: str):
+        voice = self._cached(voice_name)
+        if voice is not None:
+            return voice
+        with self._load_lock:
+            voice = self._cached(voice_name)
+            if voice is not None:
+                return voice
+            _, model_path, _ = _piper_check(voice_name)
+            from piper.voice import PiperVoice
+            voice = PiperVoice.load(model_path)
+            size = os.path.getsize(model_path)
+            with self._lock:
+                self._voices[voice_name] = (voice, size)
+                self._evict(keep=voice_name)
+            print(f"[INFO] Voce Piper caricata: {voice_name} ({size // (1024 * 1024)} MB)", file=sys.stderr)
+            return voice
+
+    def _evict(self, keep: str):
+        total = sum(size for _, size in self._voices.values())
+        for name in list(self._voices):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            total -= self._voices.pop(name)[1]
+            print(f"[INFO] Voce Piper scaricata (limite memoria): {name}", file=sys.stderr)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._voices)
+
+    def synthesize(self, text: str, voice_name: str):
+        """(PCM int16 mono, sample rate)."""
+        voice = self.get(voice_name)
+        pcm = _piper_synthesize(voice, text, _get_piper_config_for_voice(voice_name))
+        return pcm, int(voice.config.sample_rate)
+
+def _make_piper_pool():
+    if not PIPER_POOL_CFG.get("enabled", True) or importlib.util.find_spec("piper") is None:
+        return None
+    return PiperVoicePool(float(PIPER_POOL_CFG.get("max_mb", 256)))
+
+PIPER_POOL: Optional[PiperVoicePool] = _make_piper_pool()
+
+async def _preload_piper_voices():
+    if PIPER_POOL is None or not TTS_ENABLED:
+        return
+    loop = asyncio.get_running_loop()
+    for name in PIPER_POOL_CFG.get("preload", [TTS_VOICE_NAME]):
+        try:
+            await loop.run_in_executor(None, PIPER_POOL.get, name)
+        except Exception as e:
+            print(f"[WARN] Precaricamento voce {name} fallito: {e}", file=sys.stderr)
+
+def piper_tts_pcm(text: str, voice_name: str):
+    """(PCM int16 mono, sample rate): dal pool in-process se disponibile, altrimenti dal binario."""
+    if PIPER_POOL is not None:
+        return PIPER_POOL.synthesize(text, voice_name)
+    return _piper_binary_pcm(text, voice_name)
+
+def pcm_to_ogg_opus(pcm: bytes, sample_rate: int) -> bytes:
+    """PCM int16 mono -> OGG/Opus 48 kHz per send_voice, tutto su pipe."""
+    return _ffmpeg(["-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+                    "-ar", "48000", "-c:a", "libopus", "-b:a", "48k", "-f", "ogg", "pipe:1"],
+                   pcm, "pcm->ogg")
+
+def _cap_tts_text(text: str) -> str:
+    max_chars = int(PIPER_CFG.get("max_chars", 600))
+    tts_text = (text or "").strip()
+    if len(tts_text) > max_chars:
+        tts_text = tts_text[:max_chars] + "…"
+    return tts_text
+
+def _cap_tts_sentence(sentence: str, used: int, max_chars: int):
+    """Frase da sintetizzare dopo 'used' caratteri già letti, tagliata a max_chars; None se il limite è raggiunto."""
+    if used >= max_chars:
+        return None
+    if used + len(sentence) > max_chars:
+        sentence = sentence[:max_chars - used] + "…"
+    return sentence
+
+# =============== Cache TTS: OGG già codificati, indirizzati per contenuto ===============
+def _normalize_tts_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+def tts_cache_key(text: str, voice_name: str) -> str:
+    """sha256 di voce, parametri della voce, file del modello (dimensione/mtime) e testo normalizzato."""
+    voice_cfg = _get_piper_config_for_voice(voice_name)
+    try:
+        st = os.stat(voice_cfg.get("model_path") or "")
+        model = [st.st_size, int(st.st_mtime)]
+    except OSError:
+        model = None
+    payload = {"voice": voice_name, "params": voice_cfg, "model": model, "format": "opus-48k",
+               "text": _normalize_tts_text(text)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+class TtsCache:
+    """File <sha256>.ogg in una cartella; oltre max_mb si eliminano i meno usati di recente (mtime = ultimo uso)."""
+
+    def __init__(self, folder: str, max_mb: float):
+        self.folder = folder
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._index = OrderedDict()   # chiave -> byte, dal meno al più recente
+        self._total = 0
+        os.makedirs(folder, exist_ok=True)
+        entries = []
+        for name in os.listdir(folder):
+            if name.endswith(".ogg"):
+                st = os.stat(os.path.join(folder, name))
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".ogg")
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)   # l'ordine LRU sopravvive al riavvio
+            return data
+        except OSError:
+            with self._lock:
+                self._total -= self._index.pop(key, 0)
+            return None
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        victims = []
+        with self._lock:
+            self._total += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._total > self.max_bytes and len(self._index) > 1:
+                old, size = self._index.popitem(last=False)
+                self._total -= size
+                victims.append(old)
+        for old in victims:
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+def _make_tts_cache():
+    if not TTS_CACHE_CFG.get("enabled", True):
+        return None
+    folder = os.path.join(BASE_PATH, TTS_CACHE_CFG.get("dir", "data/tts_cache"))
+    return TtsCache(folder, float(TTS_CACHE_CFG.get("max_mb", 200)))
+
+TTS_CACHE: Optional[TtsCache] = _make_tts_cache()
+
+def _tts_cache_lookup(text: str, voice_name: str) -> Optional[bytes]:
+    if TTS_CACHE is None:
+        return None
+    return TTS_CACHE.get(tts_cache_key(text, voice_name))
+
+def _tts_cache_store(text: str, voice_name: str, ogg: bytes):
+    if TTS_CACHE is None:
+        return
+    try:
+        TTS_CACHE.put(tts_cache_key(text, voice_name), ogg)
+    except OSError as e:
+        print(f"[WARN] Cache TTS non scrivibile: {e}", file=sys.stderr)
+
+def tts_ogg(text: str, voice_name: str) -> bytes:
+    """OGG/Opus pronto per send_voice: dalla cache se lo stesso testo è già stato detto con questa voce."""
+    ogg = _tts_cache_lookup(text, voice_name)
+    if ogg is None:
+        ogg = pcm_to_ogg_opus(*piper_tts_pcm(text, voice_name))
+        _tts_cache_store(text, voice_name, ogg)
+    return ogg
+
+# =============== TTS a frasi: sintesi in parallelo alla generazione ===============
+_SENTENCE_END_RX = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+class SentenceSplitter:
+    """Accumula il testo in streaming e restituisce le frasi complete (almeno min_chars caratteri)."""
+
+    def __init__(self, min_chars: int = TTS_PIPELINE_MIN_CHARS):
+        self.min_chars = min_chars
+        self._buf = ""
+
+    def feed(self, text: str):
+        self._buf += text
+        out = []
+        start = 0
+        for m in _SENTENCE_END_RX.finditer(self._buf):
+            sentence = self._buf[start:m.start()].strip()
+            if len(sentence) >= self.min_chars:
+                out.append(sentence)
+                start = m.end()
+        self._buf = self._buf[start:]
+        return out
+
+    def flush(self):
+        rest, self._buf = self._buf.strip(), ""
+        return [rest] if rest else []
+
+class TtsPipeline:
+    """
+    Sintetizza ogni frase appena è completa, mentre il modello sta ancora generando.
+    progressive: un messaggio vocale per gruppo di frasi, inviati in ordine appena pronti;
+    concat: un solo vocale alla fine, unendo i WAV già pronti (resta da sintetizzare solo l'ultima frase).
+    """
+
+    def __init__(self, update: Update, context: ContextTypes.DEFAULT_TYPE, voice_name: str):
+        self.update = update
+        self.context = context
+        self.voice_name = voice_name
+        self.progressive = TTS_PIPELINE_MODE != "concat"
+        self._splitter = SentenceSplitter()
+        self._sem = asyncio.Semaphore(max(1, TTS_PIPELINE_WORKERS))
+        self._jobs = []          # task di sintesi, nell'ordine delle frasi
+        self._texts = []         # frasi sintetizzate (già tagliate a max_chars)
+        self._chars = 0
+        self._max_chars = int(PIPER_CFG.get("max_chars", 600))
+        self._queue = asyncio.Queue()
+        self._sender = asyncio.ensure_future(self._send_loop()) if self.progressive else None
+        self._failed = False
+
+    async def feed(self, text: str):
+        for sentence in self._splitter.feed(text):
+            await self._submit(sentence)
+
+    async def _submit(self, sentence: str):
+        sentence = self._accept(sentence)
+        if sentence is not None:
+            await self._start(sentence)
+
+    def _accept(self, sentence: str) -> Optional[str]:
+        """Frase tagliata al limite di caratteri e aggiunta al testo della risposta (None: limite raggiunto)."""
+        sentence = _cap_tts_sentence(sentence, self._chars, self._max_chars)
+        if sentence is not None:
+            self._chars += len(sentence)
+            self._texts.append(sentence)
+        return sentence
+
+    async def _start(self, sentence: str):
+        if not self._jobs:
+            await self.context.bot.send_chat_action(chat_id=self.update.effective_chat.id,
+                                                    action=ChatAction.RECORD_VOICE)
+        job = asyncio.ensure_future(self._synth(sentence))
+        self._jobs.append(job)
+        if self.progressive:
+            self._queue.put_nowait(job)
+
+    async def _synth(self, sentence: str):
+        """progressive: OGG pronto da inviare (dalla cache se già noto); concat: (PCM, sample rate) da unire."""
+        loop = asyncio.get_running_loop()
+        async with self._sem:
+            if self.progressive:
+                return await loop.run_in_executor(None, tts_ogg, sentence, self.voice_name)
+            return await loop.run_in_executor(None, piper_tts_pcm, sentence, self.voice_name)
+
+    async def _send_loop(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            try:
+                ogg = await job
+                await self.context.bot.send_voice(chat_id=self.update.effective_chat.id, voice=ogg)
+            except Exception as e:
+                await self._report(e)
+
+    async def _report(self, e: Exception):
+        if self._failed:
+            return
+        self._failed = True
+        try:
+            await self.update.message.reply_text(f"🔇 Errore TTS: {e}")
+        except Exception:
+            pass
+
+    async def finish(self, reply_text: str):
+        if self.progressive:
+            for sentence in self._splitter.flush():
+                await self._submit(sentence)
+            self._queue.put_nowait(None)
+            await self._sender
+            return
+        # concat: la cache della risposta intera si guarda prima di avviare l'ultima frase;
+        # se c'è, le sintesi ancora in corso o in coda non servono più
+        rest = [s for s in map(self._accept, self._splitter.flush()) if s is not None]
+        if not self._texts:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+            whole = " ".join(self._texts)
+            ogg = await loop.run_in_executor(None, _tts_cache_lookup, whole, self.voice_name)
+            if ogg is not None:
+                self.cancel()
+            else:
+                for sentence in rest:
+                    await self._start(sentence)
+                parts = await asyncio.gather(*self._jobs)
+                pcm = b"".join(p for p, _ in parts)   # stessa voce: stesso formato, basta accodare i campioni
+                ogg = await loop.run_in_executor(None, pcm_to_ogg_opus, pcm, parts[0][1])
+                await loop.run_in_executor(None, _tts_cache_store, whole, self.voice_name, ogg)
+            caption = reply_text if len(reply_text) <= 120 else None
+            await self.context.bot.send_voice(chat_id=self.update.effective_chat.id, voice=ogg, caption=caption)
+        except Exception as e:
+            await self._report(e)
+
+    def cancel(self):
+        """Interrompe sintesi e invii ancora in corso (risposta fallita o handler annullato)."""
+        for job in self._jobs:
+            job.cancel()
+        if self._sender is not None:
+            self._sender.cancel()
+
+def tts_units(text: str):
+    """Testi che la modalità TTS attiva sintetizza per questa risposta (stesse chiavi di cache)."""
+    if not TTS_PIPELINE_ENABLED:
+        return [_cap_tts_text(text)]
+    splitter = SentenceSplitter()
+    units, used = [], 0
+    max_chars = int(PIPER_CFG.get("max_chars", 600))
+    for sentence in splitter.feed(text) + splitter.flush():
+        sentence = _cap_tts_sentence(sentence, used, max_chars)
+        if sentence is None:
+            break
+        used += len(sentence)
+        units.append(sentence)
+    if TTS_PIPELINE_MODE == "concat":
+        return [" ".join(units)] if units else []
+    return units
+
+def _prerender(text: str, voice_name: str) -> bool:
+    if tts_cache_key(text, voice_name) in TTS_CACHE:
+        return False
+    tts_ogg(text, voice_name)
+    return True
+
+async def _prerender_static_replies():
+    """
+    Risposte fisse di eva (handler, modalità comandi) più tts.cache.prerender, sintetizzate per ogni voce
+    all'avvio: quando arrivano in chat il vocale esce dalla cache senza passare da Piper.
+    """
+    if TTS_CACHE is None or not TTS_ENABLED or TTS_ENGINE != "piper":
+        return
+    texts = list(TTS_CACHE_CFG.get("prerender", []))
+    url = APP_BASE_URL.rsplit("/", 1)[0] + "/static_replies"
+    try:
+        status, data = await _request_json("GET", url, idempotent=True)
+        if status == 200 and isinstance(data, dict):
+            texts += [sanitize_response(t) for t in data.get("replies", []) if isinstance(t, str)]
+    except Exception as e:
+        print(f"[WARN] Risposte fisse non disponibili da {url}: {e}", file=sys.stderr)
+    voices = TTS_CACHE_CFG.get("prerender_voices") or list(PIPER_CFG.get("voices", {}))
+    loop = asyncio.get_running_loop()
+    rendered = 0
+    for voice_name in voices:
+        try:
+            _piper_check(voice_name)
+        except Exception as e:
+            print(f"[WARN] Prerender saltato per la voce {voice_name}: {e}", file=sys.stderr)
+            continue
+        for text in texts:
+            for unit in tts_units(text):
+                try:
+                    rendered += await loop.run_in_executor(None, _prerender, unit, voice_name)
+                except Exception as e:
+                    print(f"[WARN] Prerender fallito ({voice_name}): {e}", file=sys.stderr)
+    print(f"[INFO] Cache TTS: {rendered} risposte fisse sintetizzate, {len(texts)} testi x {len(voices)} voci",
+          file=sys.stderr)
+
+TtsStart = namedtuple("TtsStart", "pipeline voice_at_end")
+
+async def start_tts_pipeline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> TtsStart:
+    """
+    pipeline: TtsPipeline per la chat, None se la modalità a frasi è spenta o la voce non è utilizzabile;
+    voice_at_end: senza pipeline, se sintetizzare la risposta intera alla fine (False: voce già segnalata come rotta).
+    """
+    if not (TTS_ENABLED and TTS_ENGINE == "piper" and TTS_PIPELINE_ENABLED):
+        return TtsStart(None, True)
+    voice_name = _get_voice_for_chat(update.effective_chat.id)
+    try:
+        _piper_check(voice_name)
+    except Exception as e:
+        try:
+            await update.message.reply_text(f"🔇 TTS disabilitato: {e}")
+        except Exception:
+            pass
+        return TtsStart(None, False)
+    return TtsStart(TtsPipeline(update, context, voice_name), False)
+
+async def answer_with_voice(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    """Risposta testuale e vocale: a frasi in pipeline se configurato, altrimenti TTS a fine risposta."""
+    tts, voice_at_end = await start_tts_pipeline(update, context)
+    if tts is None:
+        reply = await reply_with_answer(update, context, text)
+        if voice_at_end:
+            await tts_reply_and_send_voice(update, context, reply)
+        return
+    try:
+        reply = await reply_with_answer(update, context, text, on_text=tts.feed)
+        await tts.finish(reply)
+    finally:
+        tts.cancel()   # no-op se finish è arrivato in fondo; altrimenti niente task di sintesi orfani
 
 async def tts_reply_and_send_voice(update: Update, context: ContextTypes.DEFAULT_TYPE, reply_text: str):
     if not TTS_ENABLED or TTS_ENGINE != "piper":
@@ -262,37 +1312,29 @@ async def tts_reply_and_send_voice(update: Update, context: ContextTypes.DEFAULT
             pass
         return
 
-    max_chars = int(PIPER_CFG.get("max_chars", 600))
-    tts_text = (reply_text or "").strip()
-    if len(tts_text) > max_chars:
-        tts_text = tts_text[:max_chars] + "…"
+    tts_text = _cap_tts_text(reply_text)
 
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.RECORD_VOICE)
 
-    with tempfile.TemporaryDirectory() as tmpd:
-        wav_path = os.path.join(tmpd, "out.wav")
-        ogg_path = os.path.join(tmpd, "out.ogg")
-        loop = asyncio.get_running_loop()
+    loop = asyncio.get_running_loop()
+    try:
+        ogg = await loop.run_in_executor(None, tts_ogg, tts_text, voice_name)
+    except Exception as e:
         try:
-            await loop.run_in_executor(None, _piper_tts_to_wav, tts_text, wav_path, voice_name)
-            await loop.run_in_executor(None, _wav_to_ogg_opus, wav_path, ogg_path)
-        except Exception as e:
-            try:
-                await update.message.reply_text(f"🔇 Errore TTS: {e}")
-            except Exception:
-                pass
-            return
+            await update.message.reply_text(f"🔇 Errore TTS: {e}")
+        except Exception:
+            pass
+        return
+    try:
+        caption = None
+        if len(reply_text) <= 120:
+            caption = reply_text
+        await context.bot.send_voice(chat_id=update.effective_chat.id, voice=ogg, caption=caption)
+    except Exception as e:
         try:
-            with open(ogg_path, "rb") as f:
-                caption = None
-                if len(reply_text) <= 120:
-                    caption = reply_text
-                await context.bot.send_voice(chat_id=update.effective_chat.id, voice=f, caption=caption)
-        except Exception as e:
-            try:
-                await update.message.reply_text(f"🔇 Errore invio voce: {e}")
-            except Exception:
-                pass
+            await update.message.reply_text(f"🔇 Errore invio voce: {e}")
+        except Exception:
+            pass
 
 # =============== Bot Handlers ===============
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -310,6 +1352,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• <code>/model &lt;nome_modello&gt;</code><br>"
         "• <code>/voice &lt;nome_voce&gt;</code><br>"
         "• <code>/health</code><br>"
+        "• <code>/asr</code> (statistiche trascrizione)<br>"
         "• invia <b>messaggi vocali</b> per trascrizione e risposta"
     )
     try:
@@ -369,39 +1412,41 @@ async def cmd_health(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
     health_url = APP_BASE_URL.rsplit("/", 1)[0] + "/healthz"
     try:
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(health_url, timeout=10) as resp:
-                    if resp.status == 200:
-                        await update.message.reply_text("💚 app-ollama è raggiungibile.")
-                        return
-            except Exception:
-                pass
-            ans = await query_app_ollama(session, "ping", _get_model_for_chat(update.effective_chat.id))
-    except Exception as e:
-        ans = f"(errore: {e})"
+        status, _ = await _request_json("GET", health_url, idempotent=True, timeout=aiohttp.ClientTimeout(total=10))
+        if status == 200:
+            await update.message.reply_text("💚 app-ollama è raggiungibile.")
+            return
+    except Exception:
+        pass
+    ans = await query_app_ollama("ping", _get_model_for_chat(update.effective_chat.id))
     if ans.startswith("(errore"):
         await update.message.reply_text(f"💥 app-ollama non raggiungibile:\n{ans}")
     else:
         await update.message.reply_text("💚 app-ollama risponde correttamente.")
 
+async def cmd_asr(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message or not _is_allowed(update.effective_chat.id):
+        return
+    m = _get_asr_pool().metrics.snapshot()
+    await update.message.reply_text(
+        f"🎙️ ASR: {m['jobs']} trascrizioni ({m['audio_sec']} s di audio), {m['rejected']} rifiutate\n"
+        f"• batch: {m['batches']} ({m['batched_jobs']} vocali)\n"
+        f"• parlato trascritto: {m['speech_sec']} s su {m['audio_sec']} s\n"
+        f"• attesa in coda p50/p95: {m['queue_wait_p50']} / {m['queue_wait_p95']} s\n"
+        f"• decodifica + VAD p50/p95: {m['decode_p50']} / {m['decode_p95']} s\n"
+        f"• real-time factor p50/p95: {m['rtf_p50']} / {m['rtf_p95']}"
+        + "".join(f"\n• livello {name}: {t['jobs']} vocali, latenza p50/p95 {t['latency_p50']} / {t['latency_p95']} s"
+                  for name, t in m["tiers"].items())
+        + (f"\n• escalation al modello grande: {m['escalated']} ({m['escalation_rate']:.0%})" if ASR_TIERED else "")
+    )
+
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not _is_allowed(update.effective_chat.id):
         return
     text_in = (update.message.text or "").strip()
     if not text_in:
         return
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-    model = _get_model_for_chat(update.effective_chat.id)
-    async with aiohttp.ClientSession() as session:
-        reply = await query_app_ollama(session, text_in, model)
-    reply = sanitize_response(reply)
-    for chunk in chunk_text(reply):
-        try:
-            await update.message.reply_text(chunk)
-        except TelegramError:
-            await update.message.reply_text(chunk)
-    await tts_reply_and_send_voice(update, context, reply)
+    await answer_with_voice(update, context, text_in)
 
 async def on_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message or not _is_allowed(update.effective_chat.id):
@@ -425,43 +1470,165 @@ async def on_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("⚠️ Non sono riuscito a capire il contenuto audio.")
             return
         await update.message.reply_text(f"✍️ Trascrizione: {text}")
+    except AsrBusy as e:
+        await update.message.reply_text(f"⏳ Trascrizione non avviata: {e}.")
+        return
     except Exception as e:
         await update.message.reply_text(f"💥 Errore in trascrizione: {e}\nAssicurati di avere ffmpeg e faster-whisper.")
         return
-    model = _get_model_for_chat(update.effective_chat.id)
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-    async with aiohttp.ClientSession() as session:
-        reply = await query_app_ollama(session, text, model)
-    reply = sanitize_response(reply)
-    for chunk in chunk_text(reply):
-        try:
-            await update.message.reply_text(chunk)
-        except TelegramError:
-            await update.message.reply_text(chunk)
-    await tts_reply_and_send_voice(update, context, reply)
+    await answer_with_voice(update, context, text)
 
 # =============== Error handler ===============
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     print(f"[PTB ERROR] Update: {update}\nException: {context.error}", file=sys.stderr)
 
+# =============== Update concorrenti: ordine per chat ed equità tra chat ===============
+class ChatFairUpdateProcessor(BaseUpdateProcessor):
+    """
+    Update di chat diverse in parallelo (al più 'concurrency' handler attivi), quelli della stessa chat in ordine.
+    Ogni chat occupa al massimo uno slot e attende il suo turno in coda FIFO: una chat che inonda il bot
+    allunga solo la propria coda. Oltre max_pending_per_chat update in attesa, i nuovi della chat vengono scartati.
+    """
+
+    def __init__(self, concurrency: int, max_pending_per_chat: int, max_pending: int):
+        # il semaforo di PTB limita solo gli update accettati (in attesa + attivi), non il lavoro
+        super().__init__(max_concurrent_updates=max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.max_pending_per_chat = max(1, max_pending_per_chat)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chat_locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_pending: Dict[Any, int] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat = getattr(update, "effective_chat", None)
+        key = chat.id if chat is not None else None
+        pending = self._chat_pending.get(key, 0)
+        if key is not None and pending >= self.max_pending_per_chat:
+            coroutine.close()
+            print(f"[WARN] Chat {key}: {pending} update in attesa, update scartato", file=sys.stderr)
+            return
+        self._chat_pending[key] = pending + 1
+        lock = self._chat_locks.setdefault(key, asyncio.Lock()) if key is not None else None
+        try:
+            if lock is None:
+                async with self._slots:
+                    await coroutine
+                return
+            async with lock:
+                async with self._slots:
+                    await coroutine
+        finally:
+            self._chat_pending[key] -= 1
+            if not self._chat_pending[key]:
+                del self._chat_pending[key]
+                self._chat_locks.pop(key, None)
+
+def _make_update_processor() -> Optional[ChatFairUpdateProcessor]:
+    """None = update uno alla volta (comportamento predefinito di PTB)."""
+    # valore fisso: gli handler aspettano soprattutto eva/Ollama e i worker ASR/TTS, non la CPU del bot
+    concurrency = int(UPDATES_CFG.get("concurrency", 4))
+    if concurrency <= 1:
+        return None
+    return ChatFairUpdateProcessor(
+        concurrency=concurrency,
+        max_pending_per_chat=int(UPDATES_CFG.get("max_pending_per_chat", 20)),
+        max_pending=int(UPDATES_CFG.get("max_pending", 256)),
+    )
+
+# =============== Webhook: update ricevuti da un server aiohttp locale ===============
+async def _webhook_handler(request: web.Request) -> web.Response:
+    app = request.app["ptb"]
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    # risposta immediata: l'update viene elaborato dall'Application, Telegram non resta in attesa
+    await app.update_queue.put(Update.de_json(data, app.bot))
+    return web.Response()
+
+async def run_webhook(app):
+    """Al posto di run_polling: registra il webhook e serve gli update finché il processo non viene fermato."""
+    listen = WEBHOOK_CFG.get("listen", "127.0.0.1")
+    port = int(WEBHOOK_CFG.get("port", 8443))
+    path = WEBHOOK_CFG.get("path", "/telegram")
+    url = WEBHOOK_URL or f"http://{listen}:{port}{path}"
+    server = web.Application()
+    server["ptb"] = app
+    server.router.add_post(path, _webhook_handler)
+    runner = web.AppRunner(server, access_log=None)
+    async with app:
+        await _post_init(app)
+        await app.start()
+        try:
+            await runner.setup()
+            await web.TCPSite(runner, listen, port).start()
+            await app.bot.set_webhook(url, allowed_updates=ALLOWED_UPDATES, secret_token=WEBHOOK_SECRET or None,
+                                      max_connections=int(WEBHOOK_CFG.get("max_connections", 40)))
+            print(f"[INFO] Webhook in ascolto su {listen}:{port}{path} → {url}", file=sys.stderr)
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await app.stop()
+            await _close_http_session(app)
+
 # =============== Main ===============
+async def _post_init(app):
+    await _open_http_session(app)
+    # voci e risposte fisse si preparano in background: il bot risponde subito
+    app.create_task(_warm_up_tts())
+
+async def _warm_up_tts():
+    await _preload_piper_voices()
+    await _prerender_static_replies()
+
 def main():
     print(f"[INFO] Avvio Telegram bridge v 1.01 → {APP_BASE_URL} | default model: {DEFAULT_MODEL}", file=sys.stderr)
     if ALLOWED_CHAT_IDS:
         print(f"[INFO] Chat autorizzate: {sorted(ALLOWED_CHAT_IDS)}", file=sys.stderr)
     if TTS_ENABLED:
         print(f"[INFO] TTS Piper abilitato con voce di default: {TTS_VOICE_NAME}", file=sys.stderr)
+        mode = "pool in-process" if PIPER_POOL is not None else f"binario {PIPER_CFG.get('binary')}"
+        print(f"[INFO] Sintesi Piper: {mode}", file=sys.stderr)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    builder = (
+        ApplicationBuilder().token(BOT_TOKEN)
+        .post_init(_post_init)
+        .post_shutdown(_close_http_session)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        print(f"[INFO] API Telegram: {TELEGRAM_API_URL}", file=sys.stderr)
+    if WEBHOOK_ENABLED:
+        builder = builder.updater(None)   # niente long polling: gli update arrivano dal server webhook
+    processor = _make_update_processor()
+    if processor is not None:
+        builder = builder.concurrent_updates(processor)
+        print(f"[INFO] Update concorrenti: {processor.concurrency} (in ordine per chat)", file=sys.stderr)
+    app = builder.build()
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("model", cmd_model))
     app.add_handler(CommandHandler("voice", cmd_voice))
     app.add_handler(CommandHandler("health", cmd_health))
+    app.add_handler(CommandHandler("asr", cmd_asr))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
     app.add_handler(MessageHandler(filters.VOICE, on_voice))
     app.add_handler(MessageHandler(filters.AUDIO, on_voice))
     app.add_error_handler(on_error)
-    app.run_polling(allowed_updates=Update.ALL_TYPES, close_loop=False)
+    if WEBHOOK_ENABLED:
+        try:
+            asyncio.run(run_webhook(app))
+        except KeyboardInterrupt:
+            pass
+    else:
+        app.run_polling(allowed_updates=ALLOWED_UPDATES, close_loop=False)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file